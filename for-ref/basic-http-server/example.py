@@ -1,6 +1,15 @@
-import time
-
-from litehttp import HTTP_201, HTTP_204, HTTP_400, Loop, Request, Server, json_response, text_response, stream_response
+from litehttp import (
+    HTTP_201,
+    HTTP_204,
+    HTTP_400,
+    IoWaitType,
+    Loop,
+    Request,
+    Server,
+    json_response,
+    stream_response,
+    text_response,
+)
 
 
 def handle_root(req: Request):
@@ -8,10 +17,10 @@ def handle_root(req: Request):
         return text_response(text="Howdy!")
 
     if req.method == "POST":
-        return json_response(data={'message': "created"}, status=HTTP_201)
+        return json_response(data={"message": "created"}, status=HTTP_201)
 
     if req.method == "DELETE":
-        return json_response(data={'message': "deleted"})
+        return json_response(data={"message": "deleted"})
 
     if req.method == "PUT":
         return text_response(status=HTTP_204)
@@ -22,9 +31,10 @@ def handle_root(req: Request):
 def sse_resp(req: Request):
     print("SSE: ", req)
     message = req.path.split("/")[-1]
+
     def stream():
         for _ in range(10):
-            time.sleep(0.1)
+            yield IoWaitType.Sleep, 0.1
             yield f"data: {message=}\r\n"
 
     return stream_response(stream())
@@ -1,18 +1,22 @@
+import gzip
+import heapq
 import json
 import logging
+import mimetypes
+import os
+import selectors
 import socket
 import sys
-import time
 from argparse import ArgumentParser
-from collections import deque
+from collections import OrderedDict, deque
+from email.utils import formatdate, parsedate_to_datetime
 from enum import Enum
 from functools import cached_property
+from itertools import count
 from pathlib import Path
-from select import select
-from threading import Thread
+from time import monotonic, perf_counter
 from typing import Generator
-from time import perf_counter
-from urllib.parse import parse_qsl, urlparse
+from urllib.parse import parse_qsl, unquote, urlparse
 from uuid import uuid4
 
 logger = logging.getLogger("litehttp")
@@ -30,10 +34,17 @@ HTTP_201 = "HTTP/1.1 201 Created"
 HTTP_204 = "HTTP/1.1 204 No Content"
 HTTP_400 = "HTTP/1.1 400 Bad Request"
 HTTP_404 = "HTTP/1.1 404 Not Found"
+HTTP_405 = "HTTP/1.1 405 Method Not Allowed"
+HTTP_206 = "HTTP/1.1 206 Partial Content"
 HTTP_302 = "HTTP/1.1 302 Found"
+HTTP_304 = "HTTP/1.1 304 Not Modified"
 HTTP_411 = "HTTP/1.1 411 Length Required"
+HTTP_416 = "HTTP/1.1 416 Range Not Satisfiable"
 HTTP_429 = "HTTP/1.1 429 Too Many Requests"
 
+MAX_HEADER_SIZE = 65536
+FILE_CHUNK_SIZE = 65536
+
 
 class ServerOptions:
     static_path = ""
@@ -46,17 +57,16 @@ class IoWaitType(Enum):
 
 
 class Request:
-    def __init__(self, data: str, source):
-        self._data = data.split("\r\n")
-        self._body_start = -1
-        self._header_end = -1
-        self._body_end = -1
+    def __init__(
+        self, request_line: str, headers: dict, raw_body: bytes = b"", source=None
+    ):
+        """headers come in with lowercase names, raw_body already de-chunked"""
+        self.request = request_line.split(" ")
+        if len(self.request) != 3:
+            raise ValueError(f"invalid request line {request_line!r}")
+        self.headers = headers
+        self.raw_body = raw_body
         self._source = source
-        assert len(self._data) >= 2, "invalid request"
-
-    @property
-    def request(self) -> list[str]:
-        return self._data[0].split(" ")
 
     @cached_property
     def request_id(self):
@@ -70,7 +80,7 @@ class Request:
     def protocol(self) -> str:
         return self.request[2]
 
-    @property
+    @cached_property
     def _url(self):
         return urlparse(self.request[1])
 
@@ -91,71 +101,31 @@ class Request:
         return self.request[0]
 
     @property
-    def _body_len(self) -> int | None:
-        l = self.headers.get("content-length")
-        if l is None:
-            return None
-        return int(l)
+    def length_required(self) -> bool:
+        """anything but GET and HEAD has to say how long its body is"""
+        framed = "content-length" in self.headers or self.chunked
+        return self.method not in ("GET", "HEAD") and not framed
 
     @property
-    def _got_body(self) -> bool:
-        expected = self._body_len
-        if expected is None:
-            return False
-        got = len(self.body) >= expected
-        if got:
-            self._body_end = expected
-
-        return got
+    def chunked(self) -> bool:
+        return "chunked" in self.headers.get("transfer-encoding", "").lower()
 
     @property
-    def _is_done(self) -> tuple[bool, int]:
-        """
-        The tuple can be interpreted as (is_done, content-length header present?)
-        If content-length is not set in headers, it will return False, 411
-        If the entire request has arrived the it returns True, 0
-        """
-        body_sz = (
-            self._body_len
-        )  # until self.headers is called, self._header_end won't get updated
-        got_headers = self._header_end > -1
-        is_valid = got_headers and (body_sz is not None)
-        if got_headers and self.method == "GET":
-            return True, 0
-
-        if not is_valid:
-            return False, 411
-        return self._got_body, 0
+    def keep_alive(self) -> bool:
+        """HTTP/1.1 keeps the connection by default, HTTP/1.0 only when asked to"""
+        value = self.headers.get("connection", "").lower()
+        tokens = {t.strip() for t in value.split(",")}
+        if self.protocol == "HTTP/1.0":
+            return "keep-alive" in tokens
+        return "close" not in tokens
 
-    @property
-    def headers(self) -> dict:
-        rv = {}
-        for i, line in enumerate(self._data[1:]):
-            if not line:
-                if self._header_end == -1:
-                    self._header_end = i + 2
-                break
-
-            pos = line.index(":")
-            name, val = tuple(
-                map(lambda x: x.strip().lower(), (line[:pos], line[pos + 1 :]))
-            )
-            rv[name] = val
-
-        return rv
-
-    @property
+    @cached_property
     def body(self) -> str:
-        # TODO: body may contain binary data
-        _ = self.headers  # prime the body pos just in case
-        if self._header_end == -1:  # or self._header_end > len(self._data):
-            return ""
-
-        body = "\n".join(self._data[self._header_end :])
-        return body
+        # raw_body stays around for binary uploads
+        return self.raw_body.decode("utf-8", errors="replace")
 
     def json(self) -> dict:
-        return json.loads(self.body)
+        return json.loads(self.raw_body)
 
     def __repr__(self):
         args = ", ".join(
@@ -168,11 +138,128 @@ class Request:
         return f"{type(self).__name__}({args})"
 
 
+class RequestParser:
+    """
+    resumable parser over a bytearray, feed it whatever recv returned and call
+    parse until it returns None. the header end is searched for once, headers
+    are parsed once and the body is tracked by byte count, so a request costs
+    O(size) however it gets split up on the wire
+    """
+
+    def __init__(self, source=None, max_header_size: int = MAX_HEADER_SIZE):
+        self.source = source
+        self.max_header_size = max_header_size
+        self.buf = bytearray()
+        self._reset()
+
+    def _reset(self):
+        self._scan = 0  # where the next search resumes
+        self._request_line = ""
+        self._headers: dict | None = None
+        self._body_start = 0
+        self._length = 0
+        self._chunks: bytearray | None = None
+        self._chunk_size = -1
+
+    def feed(self, data: bytes):
+        self.buf += data
+
+    def parse(self) -> Request | None:
+        """the next complete request, raises ValueError on malformed input"""
+        if self._headers is None and not self._parse_head():
+            return None
+
+        if self._chunks is None:
+            end = self._body_start + self._length
+            if len(self.buf) < end:
+                return None
+            body = bytes(self.buf[self._body_start : end])
+        else:
+            end = self._parse_chunks()
+            if end < 0:
+                return None
+            body = bytes(self._chunks)
+
+        request = Request(self._request_line, self._headers, body, self.source)  # type: ignore
+        del self.buf[:end]
+        self._reset()
+        return request
+
+    def _parse_head(self) -> bool:
+        # the terminator may straddle the previous chunk, back up a little
+        head_end = self.buf.find(b"\r\n\r\n", max(0, self._scan - 3))
+        if head_end < 0:
+            self._scan = len(self.buf)
+            if self._scan > self.max_header_size:
+                raise ValueError("request headers too large")
+            return False
+
+        lines = bytes(self.buf[:head_end]).decode("latin-1").split("\r\n")
+        headers = {}
+        for line in lines[1:]:
+            name, sep, val = line.partition(":")
+            if not sep:
+                raise ValueError(f"invalid header line {line!r}")
+            headers[name.strip().lower()] = val.strip()
+
+        self._request_line = lines[0]
+        self._body_start = self._scan = head_end + 4
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            self._chunks = bytearray()
+        elif "content-length" in headers:
+            self._length = int(headers["content-length"])
+            if self._length < 0:
+                raise ValueError(f"invalid content-length {self._length}")
+        self._headers = headers
+        return True
+
+    def _parse_chunks(self) -> int:
+        """end of the request once the last chunk is in, -1 until then"""
+        while True:
+            if self._chunk_size < 0:
+                line_end = self.buf.find(b"\r\n", self._scan)
+                if line_end < 0:
+                    return -1
+
+                # chunk extensions after ";" are allowed and ignored
+                size = bytes(self.buf[self._scan : line_end]).split(b";")[0]
+                self._chunk_size = int(size, 16)
+                self._scan = line_end + 2
+
+            if self._chunk_size == 0:
+                # optional trailers, then the blank line
+                end = self.buf.find(b"\r\n\r\n", self._scan - 2)
+                return -1 if end < 0 else end + 4
+
+            data_end = self._scan + self._chunk_size
+            if len(self.buf) < data_end + 2:
+                return -1
+            if self.buf[data_end : data_end + 2] != b"\r\n":
+                raise ValueError("chunk is longer than its size")
+
+            self._chunks += self.buf[self._scan : data_end]
+            self._scan = data_end + 2
+            self._chunk_size = -1
+
+
 class Loop:
+    """
+    single threaded scheduler, tasks are generators yielding (IoWaitType, socket)
+    and get resumed once the selector reports the socket ready.
+    (IoWaitType.Sleep, seconds) parks the task on a timer heap instead
+    """
+
     def __init__(self):
         self.tasks = deque()
         self.recv_wait = {}
         self.send_wait = {}
+        self.selector = selectors.DefaultSelector()
+        # (deadline, seq, task, socket | None), seq keeps equal deadlines in
+        # fifo order and tells a live io timeout from one that already lost
+        self.timers = []
+        self.timeouts = {}
+        self.errors = {}
+        self._seq = count()
 
     def add_job(self, job):
         self.tasks.append(job)
@@ -181,35 +268,144 @@ class Loop:
         return self.tasks.popleft()
 
     def run_job(self, job):
+        exc = self.errors.pop(job, None)
+        if exc is not None:
+            return job.throw(exc)
         return next(job)
 
-    def _handle(self, why: IoWaitType, what: socket.socket, task):
+    def _register(self, what: socket.socket):
+        events = 0
+        if what in self.recv_wait:
+            events |= selectors.EVENT_READ
+        if what in self.send_wait:
+            events |= selectors.EVENT_WRITE
+
+        key = self.selector.get_map().get(what)
+        if key is None:
+            if events:
+                self.selector.register(what, events)
+        elif not events:
+            self.selector.unregister(what)
+        elif key.events != events:
+            self.selector.modify(what, events)
+
+    def _add_timer(self, delay: float, task, what: socket.socket | None = None) -> int:
+        seq = next(self._seq)
+        heapq.heappush(self.timers, (monotonic() + delay, seq, task, what))
+        return seq
+
+    def _handle(self, why: IoWaitType, what, task, timeout: float | None = None):
+        """
+        io waits may carry a timeout, (IoWaitType.Recv, sock, 5.0) resumes the
+        task with a TimeoutError if the socket stays quiet for 5 seconds
+        """
         match why:
             case IoWaitType.Recv:
                 self.recv_wait[what] = task
             case IoWaitType.Send:
                 self.send_wait[what] = task
             case IoWaitType.Sleep:
-                raise NotImplementedError("Async Sleep is not yet implemented")
+                self._add_timer(what, task)
+                return
             case _:
                 raise ValueError(f"Unknown wait type specified {why}")
 
+        self._register(what)
+        if timeout is not None:
+            self.timeouts[what] = self._add_timer(timeout, task, what)
+
+    def _wake_timers(self):
+        now = monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            _, seq, task, what = heapq.heappop(self.timers)
+            if what is None:
+                self.add_job(task)
+            elif self.timeouts.get(what) == seq:
+                # the io never came, cancel the wait and raise in the task
+                del self.timeouts[what]
+                if self.recv_wait.get(what) is task:
+                    del self.recv_wait[what]
+                if self.send_wait.get(what) is task:
+                    del self.send_wait[what]
+                self._register(what)
+                self.errors[task] = TimeoutError(f"no io on {what} in time")
+                self.add_job(task)
+
+    def _poll(self):
+        timeout = None
+        if self.timers:
+            timeout = max(0.0, self.timers[0][0] - monotonic())
+
+        for key, mask in self.selector.select(timeout):
+            what = key.fileobj
+            self.timeouts.pop(what, None)
+            if mask & selectors.EVENT_READ and what in self.recv_wait:
+                self.add_job(self.recv_wait.pop(what))
+            if mask & selectors.EVENT_WRITE and what in self.send_wait:
+                self.add_job(self.send_wait.pop(what))
+            # drop the registration before the task runs, it may close the socket
+            self._register(what)  # type: ignore
+
+        self._wake_timers()
+
     def start(self):
-        while any([self.tasks, self.recv_wait, self.send_wait]):
-            while not self.tasks:
-                # wait for IO
-                can_recv, can_send, _ = select(self.recv_wait, self.send_wait, [])
-                for task in can_recv:
-                    self.add_job(self.recv_wait.pop(task))
-                for task in can_send:
-                    self.add_job(self.send_wait.pop(task))
+        while any([self.tasks, self.recv_wait, self.send_wait, self.timers]):
+            if not self.tasks:
+                # wait for IO or the nearest timer, which may turn out stale
+                self._poll()
+                continue
 
             task = self.get_next_job()
             try:
-                why, what = self.run_job(task)
-                self._handle(why, what, task)
+                why, what, *timeout = self.run_job(task)
             except StopIteration:
-                pass
+                continue
+            except Exception:
+                # one broken task must not take the whole loop down
+                logger.exception(f"Task {task} failed")
+                continue
+
+            self._handle(why, what, task, *timeout)
+
+
+def recv(client: socket.socket, size: int = 65536, timeout: float | None = None):
+    """read whatever is buffered, only waits on the loop when the socket is empty"""
+    while True:
+        try:
+            return client.recv(size)
+        except BlockingIOError:
+            yield IoWaitType.Recv, client, timeout
+
+
+def send_all(client: socket.socket, data: bytes):
+    view = memoryview(data)
+    while view:
+        try:
+            sent = client.send(view)
+        except BlockingIOError:
+            yield IoWaitType.Send, client
+            continue
+        view = view[sent:]
+
+
+def _set_connection(resp: bytes, keep_alive: bool, protocol: str) -> bytes:
+    if keep_alive and protocol != "HTTP/1.0":
+        return resp
+    value = b"keep-alive" if keep_alive else b"close"
+    # right after the status line
+    return resp.replace(b"\r\n", b"\r\nconnection: " + value + b"\r\n", 1)
+
+
+def _is_chunked(head: bytes) -> bool:
+    head_end = head.find(b"\r\n\r\n")
+    return b"\r\ntransfer-encoding: chunked" in head[:head_end].lower()
+
+
+def _has_length(resp: bytes) -> bool:
+    if resp.startswith((b"HTTP/1.1 204", b"HTTP/1.1 304")):
+        return True
+    head_end = resp.find(b"\r\n\r\n")
+    return b"\r\ncontent-length:" in resp[:head_end].lower()
 
 
 def redirect_response(url: str) -> str:
@@ -253,48 +449,115 @@ def json_response(data: dict, headers: dict = {}, status=HTTP_200) -> str:
     )
 
 
-def stream_response(data: Generator[str | bytes, None, None], headers: dict = {}, status=HTTP_200):
+class ChunkedWriter:
+    """
+    frames rows as http chunks. small rows are held back and go out as one
+    chunk once max_size bytes are pending or the oldest of them is max_delay
+    seconds old, so memory stays bounded and a chatty generator doesn't cost
+    a send per row
+    """
+
+    def __init__(self, max_size: int = 16384, max_delay: float = 0.05):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.pending: list[bytes] = []
+        self.pending_size = 0
+        self.since = 0.0
+
+    def write(self, data: bytes) -> bytes | None:
+        """a framed chunk when it is time to send, None while buffering"""
+        if not data:
+            # an empty chunk would end the body
+            return None
+
+        if not self.pending:
+            self.since = monotonic()
+        self.pending.append(data)
+        self.pending_size += len(data)
+        if self.pending_size >= self.max_size:
+            return self.flush()
+        if monotonic() - self.since >= self.max_delay:
+            return self.flush()
+        return None
+
+    def flush(self) -> bytes | None:
+        if not self.pending:
+            return None
+
+        data = b"".join(self.pending)
+        self.pending.clear()
+        self.pending_size = 0
+        return b"%x\r\n%s\r\n" % (len(data), data)
+
+    def close(self) -> bytes:
+        """whatever is pending plus the last-chunk"""
+        return (self.flush() or b"") + b"0\r\n\r\n"
+
+
+def stream_response(
+    data: Generator[str | bytes, None, None],
+    headers: dict = {},
+    status=HTTP_200,
+    max_size: int = 16384,
+    max_delay: float = 0.05,
+):
     """
     The client must be speaking HTTP/1.1 or newer
     The request method wasn’t a HEAD
     The response does not include a Content-Length header
     The response status wasn’t 204 or 304
+
+    `data` may yield (IoWaitType.Sleep, seconds) between rows to pause the
+    stream without blocking the loop, pending rows are flushed before it
+    sleeps. the body goes out chunked, see ChunkedWriter for max_size and
+    max_delay, so the connection can be reused afterwards
     """
     default_headers = {
         "content-type": "text/event-stream",
-        # for now commented since we need to figure out how to send chunked data
-        # format: https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Transfer-Encoding#chunked_encoding
-        # "transfer-encoding": "chunked",
-        "connection": "keep-alive",
+        "transfer-encoding": "chunked",
         "cache-control": "no-cache",
     }
     _merge_headers(default_headers, headers)
     resp_h = _resp_str(status, default_headers, add_terminator=True)
     yield resp_h
-    yield from data
-    # yield from (f"{len(row)}\r\n{row}\r\n" for row in data)
-    # yield f"0\r\n\r\n"
+    writer = ChunkedWriter(max_size, max_delay)
+    for row in data:
+        if isinstance(row, tuple):
+            if (chunk := writer.flush()) is not None:
+                yield chunk
+            yield row
+            continue
+
+        if not isinstance(row, bytes):
+            row = row.encode("utf-8")
+        if (chunk := writer.write(row)) is not None:
+            yield chunk
+    yield writer.close()
 
 
 def text_response(text: str = "", headers: dict = {}, status=HTTP_200) -> str:
     default_headers = {
         "content-type": "text/plain",
-        "content-length": len(text),
+        "content-length": len(text.encode("utf-8")),
     }
     _merge_headers(default_headers, headers)
-    resp = _resp_str(status, default_headers, text)
+    # an empty body still needs the blank line ending the headers
+    resp = _resp_str(status, default_headers, text, add_terminator=not text)
     return resp
 
 
 def file_response(
     file_path: str, f_type="text", content_type="text/plain"
 ) -> bytes | str:
+    """
+    the whole file in one response, static_response streams it with sendfile
+    and handles ranges and caching headers
+    """
     root_dir = ServerOptions.static_path
     file = Path(root_dir) / file_path
     if not file.exists():
         return text_response(status=HTTP_404)
 
-    # TODO: Consider streaming files as well (large file maybe?)
     if f_type == "binary":
         contents = file.read_bytes()
         resp = bin_response(
@@ -305,7 +568,7 @@ def file_response(
 
     contents = file.read_text()
     resp = text_response(text=contents, headers={"content-type": content_type})
-    return resp
+    return resp.encode("utf-8")
 
 
 def download_file(file_path: str, contents: str | bytes) -> None:
@@ -320,19 +583,482 @@ def download_file(file_path: str, contents: str | bytes) -> None:
         f.write(contents)  # type: ignore
 
 
+class FileResponse:
+    """
+    a response head plus a slice of an open file, the server sends the slice
+    with os.sendfile so the file never passes through python memory
+    """
+
+    def __init__(self, head: bytes, file, offset: int, length: int):
+        self.head = head
+        self.file = file
+        self.offset = offset
+        self.length = length
+
+    def send(self, client: socket.socket):
+        try:
+            offset, left = self.offset, self.length
+            while left > 0 and hasattr(os, "sendfile"):
+                try:
+                    sent = os.sendfile(
+                        client.fileno(), self.file.fileno(), offset, left
+                    )
+                except BlockingIOError:
+                    yield IoWaitType.Send, client
+                    continue
+                except ConnectionError:
+                    raise
+                except OSError:
+                    # not every file or platform can sendfile, copy the rest
+                    if offset != self.offset:
+                        raise
+                    break
+
+                if not sent:
+                    raise ConnectionError(f"{self.file.name} shrank while sending")
+                offset += sent
+                left -= sent
+
+            self.file.seek(offset)
+            while left > 0:
+                chunk = self.file.read(min(left, FILE_CHUNK_SIZE))
+                if not chunk:
+                    raise ConnectionError(f"{self.file.name} shrank while sending")
+                yield from send_all(client, chunk)
+                left -= len(chunk)
+        finally:
+            self.file.close()
+
+
+def _content_type(file: Path) -> str:
+    ctype, encoding = mimetypes.guess_type(file.name)
+    if ctype is None or encoding is not None:
+        # a .gz or .bz2 is served as the archive it is
+        return "application/octet-stream"
+    if ctype.startswith("text/") or ctype in (
+        "application/javascript",
+        "image/svg+xml",
+    ):
+        return f"{ctype}; charset=utf-8"
+    return ctype
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if (match := request.headers.get("if-none-match")) is not None:
+        tags = [t.strip().removeprefix("W/") for t in match.split(",")]
+        return "*" in tags or etag in tags
+
+    if (since := request.headers.get("if-modified-since")) is not None:
+        try:
+            return int(mtime) <= parsedate_to_datetime(since).timestamp()
+        except (TypeError, ValueError):
+            pass
+    return False
+
+
+def _byte_range(request: Request, size: int, etag: str, modified: str):
+    """
+    (start, end) of a single satisfiable range, None to send the whole file.
+    raises ValueError when the range can't be satisfied
+    """
+    value = request.headers.get("range", "")
+    if_range = request.headers.get("if-range")
+    if not value.startswith("bytes=") or if_range not in (None, etag, modified):
+        return None
+
+    spec = value[6:].strip()
+    if "," in spec:
+        # multipart/byteranges is not worth it, the whole file is valid too
+        return None
+
+    first, sep, last = spec.partition("-")
+    if not sep or not (first.strip().isdigit() or last.strip().isdigit()):
+        return None
+
+    if not first.strip():
+        # a suffix, the last n bytes
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last.strip() else size - 1
+    if start >= size or start > end:
+        raise ValueError(f"range {value} outside of {size} bytes")
+    return start, end
+
+
+def _open_static(file_path: str, root: str | Path | None):
+    """(resolved path, open file) for a file under root, None if there is none"""
+    base = Path(root or ServerOptions.static_path or ".").resolve()
+    file = (base / file_path).resolve()
+    if not file.is_relative_to(base) or not file.is_file():
+        return None
+
+    try:
+        return file, open(file, "rb")
+    except OSError:
+        return None
+
+
+def _static_headers(file: Path, stat: os.stat_result, download: bool) -> dict:
+    headers = {
+        "content-type": _content_type(file),
+        "accept-ranges": "bytes",
+        "etag": f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+        "last-modified": formatdate(stat.st_mtime, usegmt=True),
+    }
+    if download:
+        name = file.name.replace("\\", "\\\\").replace('"', '\\"')
+        headers["content-disposition"] = f'attachment; filename="{name}"'
+    return headers
+
+
+def static_response(
+    request: Request, file_path: str, root: str | Path | None = None, download=False
+) -> FileResponse | str:
+    """
+    serve a file under root (ServerOptions.static_path by default) with
+    Range/206, ETag and Last-Modified/304 support. the body goes out with
+    sendfile, HEAD gets the head only
+    """
+    opened = _open_static(file_path, root)
+    if opened is None:
+        return text_response(status=HTTP_404)
+
+    file, f = opened
+    # stat the open file, the name may already point elsewhere
+    stat = os.fstat(f.fileno())
+    headers = _static_headers(file, stat, download)
+    etag, modified = headers["etag"], headers["last-modified"]
+
+    status, start, end = HTTP_200, 0, stat.st_size - 1
+    if request.method in ("GET", "HEAD"):
+        if _not_modified(request, etag, stat.st_mtime):
+            f.close()
+            del headers["content-type"], headers["accept-ranges"]
+            return _resp_str(HTTP_304, headers, add_terminator=True)
+
+        try:
+            byte_range = _byte_range(request, stat.st_size, etag, modified)
+        except ValueError:
+            f.close()
+            return text_response(
+                status=HTTP_416, headers={"content-range": f"bytes */{stat.st_size}"}
+            )
+
+        if byte_range is not None:
+            status, (start, end) = HTTP_206, byte_range
+            headers["content-range"] = f"bytes {start}-{end}/{stat.st_size}"
+
+    headers["content-length"] = end - start + 1
+    head = _resp_str(status, headers, add_terminator=True).encode("utf-8")
+    if request.method == "HEAD":
+        f.close()
+        return head.decode("utf-8")
+    return FileResponse(head, f, start, end - start + 1)
+
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml",
+)
+
+
+def _accepts_gzip(request: Request) -> bool:
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.partition(";")
+        if name.strip().lower() not in ("gzip", "*"):
+            continue
+
+        q = params.strip()
+        try:
+            return not (q.startswith("q=") and float(q[2:]) == 0)
+        except ValueError:
+            return True
+    return False
+
+
+class _CachedFile:
+    __slots__ = ("file", "version", "checked", "modified", "mtime", "variants")
+
+    def __init__(self, file: Path, stat: os.stat_result, modified: str):
+        self.file = file
+        self.version = (stat.st_mtime_ns, stat.st_size)
+        self.checked = monotonic()
+        self.modified = modified
+        self.mtime = stat.st_mtime
+        # encoding -> (complete response, head length, etag)
+        self.variants: dict[str, tuple[bytes, int, str]] = {}
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(resp) for resp, _, _ in self.variants.values())
+
+
+class StaticCache:
+    """
+    byte bounded LRU of small static files kept as complete responses, head
+    and body in one bytes object, plus a gzip variant for compressible types
+    picked by accept-encoding. entries remember the file's mtime and size and
+    get checked against them at most every check_interval seconds, a hit in
+    between costs nothing but the send. ranges, other methods and files over
+    max_file_size go to static_response
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 32 * 1024 * 1024,
+        max_file_size: int = 512 * 1024,
+        check_interval: float = 1.0,
+        min_compress: int = 256,
+    ):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.check_interval = check_interval
+        self.min_compress = min_compress
+        self.entries: OrderedDict[tuple, _CachedFile] = OrderedDict()
+        self.nbytes = 0
+
+    def response(
+        self,
+        request: Request,
+        file_path: str,
+        root: str | Path | None = None,
+        download=False,
+    ) -> FileResponse | bytes | str:
+        if request.method not in ("GET", "HEAD") or "range" in request.headers:
+            return static_response(request, file_path, root, download)
+
+        key = (str(root or ServerOptions.static_path or "."), file_path, download)
+        entry = self._get(key)
+        if entry is None:
+            entry = self._load(key, file_path, root, download)
+            if entry is None:
+                return static_response(request, file_path, root, download)
+
+        encoding = "identity"
+        if "gzip" in entry.variants and _accepts_gzip(request):
+            encoding = "gzip"
+        resp, head_len, etag = entry.variants[encoding]
+        if _not_modified(request, etag, entry.mtime):
+            headers = {"etag": etag, "last-modified": entry.modified}
+            return _resp_str(HTTP_304, headers, add_terminator=True).encode("utf-8")
+
+        return resp[:head_len] if request.method == "HEAD" else resp
+
+    def discard(self, file_path: str, root: str | Path | None = None):
+        base = str(root or ServerOptions.static_path or ".")
+        for download in (False, True):
+            self._evict((base, file_path, download))
+
+    def _get(self, key: tuple) -> _CachedFile | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        now = monotonic()
+        if now - entry.checked >= self.check_interval:
+            try:
+                stat = os.stat(entry.file)
+                version = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                version = None
+            if version != entry.version:
+                self._evict(key)
+                return None
+            entry.checked = now
+
+        self.entries.move_to_end(key)
+        return entry
+
+    def _load(self, key: tuple, file_path: str, root, download) -> _CachedFile | None:
+        opened = _open_static(file_path, root)
+        if opened is None:
+            return None
+
+        file, f = opened
+        with f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size > self.max_file_size:
+                return None
+            body = f.read()
+
+        headers = _static_headers(file, stat, download)
+        entry = _CachedFile(file, stat, headers["last-modified"])
+        bodies = {"identity": body}
+        compressible = headers["content-type"].startswith(COMPRESSIBLE_TYPES)
+        if compressible and len(body) >= self.min_compress:
+            packed = gzip.compress(body, compresslevel=6, mtime=0)
+            if len(packed) < len(body):
+                bodies["gzip"] = packed
+                headers["vary"] = "accept-encoding"
+
+        for encoding, data in bodies.items():
+            etag = headers["etag"]
+            extra = {"content-length": len(data)}
+            if encoding != "identity":
+                # a strong etag has to differ between encodings
+                etag = f'{etag[:-1]}-{encoding}"'
+                extra.update({"etag": etag, "content-encoding": encoding})
+            head = _resp_str(HTTP_200, {**headers, **extra}, add_terminator=True)
+            head = head.encode("utf-8")
+            entry.variants[encoding] = (head + data, len(head), etag)
+
+        if entry.nbytes <= self.max_bytes:
+            self.entries[key] = entry
+            self.nbytes += entry.nbytes
+            while self.nbytes > self.max_bytes:
+                _, old = self.entries.popitem(last=False)
+                self.nbytes -= old.nbytes
+        return entry
+
+    def _evict(self, key: tuple):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry.nbytes
+
+
+def _segments(path: str) -> list[str]:
+    return [unquote(seg) for seg in path.split("/") if seg]
+
+
+class _Node:
+    __slots__ = ("children", "params", "rest", "methods")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        self.params: list[tuple[str, str, _Node]] = []  # (name, kind, node)
+        self.rest: tuple[str, _Node] | None = None  # a trailing {name:path}
+        self.methods: dict = {}
+
+
+class Router:
+    """
+    routes like /users/{id:int} or /files/{path:path} compiled into a segment
+    trie. on each segment a static match wins over an int param, an int param
+    over a str one, and a str one over a path tail. handlers get called as
+    handler(request, **params)
+
+        router = Router()
+        router.add("GET", "/users/{id:int}", get_user)
+
+        @router.route("/files/{path:path}", methods=["GET", "POST"])
+        def handle_files(req: Request, path: str): ...
+    """
+
+    kinds = ("str", "int", "path")
+
+    def __init__(self):
+        self.root = _Node()
+
+    def add(self, methods: str | list[str], pattern: str, handler):
+        node = self.root
+        segments = pattern.strip("/").split("/") if pattern.strip("/") else []
+        for i, seg in enumerate(segments):
+            if not (seg.startswith("{") and seg.endswith("}")):
+                node = node.children.setdefault(seg, _Node())
+                continue
+
+            name, _, kind = seg[1:-1].partition(":")
+            kind = kind or "str"
+            if kind not in self.kinds:
+                raise ValueError(f"Unknown param type {kind!r} in {pattern}")
+
+            if kind == "path":
+                if i != len(segments) - 1:
+                    raise ValueError(f"{seg} has to be the last segment of {pattern}")
+                if node.rest is None:
+                    node.rest = (name, _Node())
+                elif node.rest[0] != name:
+                    raise ValueError(f"{seg} clashes with {{{node.rest[0]}:path}}")
+                node = node.rest[1]
+                continue
+
+            for pname, pkind, child in node.params:
+                if (pname, pkind) == (name, kind):
+                    node = child
+                    break
+            else:
+                child = _Node()
+                node.params.append((name, kind, child))
+                node.params.sort(key=lambda p: p[1] != "int")
+                node = child
+
+        for method in [methods] if isinstance(methods, str) else methods:
+            if method.upper() in node.methods:
+                raise ValueError(f"{method} {pattern} is already routed")
+            node.methods[method.upper()] = handler
+
+    def route(self, pattern: str, methods=("GET",)):
+        def register(handler):
+            self.add(list(methods), pattern, handler)
+            return handler
+
+        return register
+
+    def _matches(self, node: _Node, segs: list[str], i: int, params: dict):
+        """every route matching segs, best first, as (methods, params)"""
+        if i == len(segs):
+            if node.methods:
+                yield node.methods, params
+            return
+
+        seg = segs[i]
+        if (child := node.children.get(seg)) is not None:
+            yield from self._matches(child, segs, i + 1, params)
+
+        for name, kind, child in node.params:
+            value = seg
+            if kind == "int":
+                if not (seg.isascii() and seg.isdigit()):
+                    continue
+                value = int(seg)
+            yield from self._matches(child, segs, i + 1, {**params, name: value})
+
+        if node.rest is not None and node.rest[1].methods:
+            name, child = node.rest
+            yield child.methods, {**params, name: "/".join(segs[i:])}
+
+    def resolve(self, path: str) -> tuple[dict, dict] | None:
+        """(handlers by method, params) for the best route, None if nothing matches"""
+        return next(self._matches(self.root, _segments(path), 0, {}), None)
+
+    def dispatch(self, request: Request):
+        allowed = []
+        for methods, params in self._matches(self.root, _segments(request.path), 0, {}):
+            handler = methods.get(request.method)
+            if handler is not None:
+                return handler(request, **params)
+            allowed.extend(m for m in methods if m not in allowed)
+
+        if allowed:
+            return text_response(status=HTTP_405, headers={"allow": ", ".join(allowed)})
+        return text_response(status=HTTP_404)
+
+
 class Server:
-    def __init__(self, handlers, loop):
-        # TODO: consider paths separately to parse the params in the path
+    def __init__(self, handlers, loop, idle_timeout=5.0, max_requests=100):
+        """
+        handlers: a Router, or a list of (predicate(path), handler) tried in order
+        idle_timeout: seconds a connection may sit without sending anything
+        max_requests: requests served on one connection before it gets closed
+        """
         self.handlers = handlers
         self.loop = loop
+        self.idle_timeout = idle_timeout
+        self.max_requests = max_requests
 
     def get_response(self, request: Request) -> str:
         rid = request.request_id
         logger.info(f"[{type(self).__name__}] Processing request: {rid} | {request=}")
         prev = perf_counter()
         res = text_response(status=HTTP_404)
-        if request._is_done[1] == 411:
+        if request.length_required:
             res = text_response(status=HTTP_411)
+        elif isinstance(self.handlers, Router):
+            res = self.handlers.dispatch(request)
         else:
             for fn, handler in self.handlers:
                 if fn(request.path) is True:
@@ -344,131 +1070,147 @@ class Server:
         return res
 
     def handle_client(self, client: socket.socket):
-        # TODO: consider bytes, since the data may include files for form data
-        data = ""
-        req_addr = client.getpeername()
-        logger.info(f"Client connected: {req_addr}")
-        # maybe consider max timeout for which the server waits for client
-        client.settimeout(60.0)
-        request: Request
-        retries, max_retries = 0, 5
-        while True:
-            # yield IoWaitType.Recv, client
-            try:
-                r = client.recv(1024)
-            except TimeoutError:
-                logger.exception(f"Timeout waiting for client to send {data=}.")
-                client.close()
-                return
-
-            logger.debug(f"Read chunk {len(r)=} | {r=}")
-            data += r.decode("utf-8")
-            if retries > max_retries:
-                logger.error(
-                    f"Invalid input {data=}. Max retries of {max_retries} reached"
-                )
-                client.close()
-                return
-
-            if data:
+        served = 0
+        try:
+            req_addr = client.getpeername()
+            logger.info(f"Client connected: {req_addr}")
+            parser = RequestParser(req_addr)
+            while served < self.max_requests:
                 try:
-                    request = Request(data, req_addr)
-                    if any(request._is_done):
-                        break
-                except Exception as e:
-                    retries += 1
-                    logger.exception(
-                        f"Failed to parse request with {e=}. Retry: {retries=}/{max_retries=}"
-                    )
-                    time.sleep(0.1)
-            else:
-                # no data
-                retries += 1
-                logger.warn(f"Got no data for {retries=}/{max_retries=}.")
-                time.sleep(0.1)
-
-            # if not r:  # or len(r) < 1024:
-            #     break
-
-        logger.debug(f"Finished parsing {data=}")
-        if not data:
-            resp = text_response(status=HTTP_400)
-        else:
-            request = Request(data, req_addr)
-            resp = self.get_response(request)
-
-        # yield IoWaitType.Send, client
-        if  isinstance(resp, Generator):
-            for row in resp:
-                if not isinstance(row, bytes):
-                    row = row.encode("utf-8")
-
-                client.sendall(row)
-
+                    request = parser.parse()
+                except ValueError as e:
+                    logger.error(f"Invalid request {parser.buf=} with {e=}")
+                    resp = text_response(status=HTTP_400).encode("utf-8")
+                    yield from send_all(client, _set_connection(resp, False, ""))
+                    return
+
+                if request is None:
+                    try:
+                        r = yield from recv(client, timeout=self.idle_timeout)
+                    except TimeoutError:
+                        logger.info(f"Closing idle connection {req_addr}")
+                        return
+
+                    logger.debug(f"Read chunk {len(r)=}")
+                    if not r:
+                        if parser.buf:
+                            logger.warning(
+                                f"Client {req_addr} went away with {parser.buf=}"
+                            )
+                        return
+
+                    parser.feed(r)
+                    continue
+
+                served += 1
+                protocol = request.protocol
+                keep_alive = request.keep_alive and served < self.max_requests
+                resp = self.get_response(request)
+                if isinstance(resp, Generator):
+                    head = True
+                    for row in resp:
+                        if isinstance(row, tuple):
+                            # a stream asking the loop to park it, e.g. a sleep
+                            yield row
+                            continue
+
+                        if not isinstance(row, bytes):
+                            row = row.encode("utf-8")
+                        if head:
+                            # without chunked framing only the close ends it
+                            keep_alive = keep_alive and _is_chunked(row)
+                            row = _set_connection(row, keep_alive, protocol)
+                            head = False
+
+                        yield from send_all(client, row)
+                    if not keep_alive:
+                        return
+                    continue
+
+                if isinstance(resp, FileResponse):
+                    head = _set_connection(resp.head, keep_alive, protocol)
+                    yield from send_all(client, head)
+                    yield from resp.send(client)
+                    if not keep_alive:
+                        return
+                    continue
+
+                if not isinstance(resp, bytes):
+                    resp = resp.encode("utf-8")
+                # the body of a 411 is still on the wire, and a response
+                # without content-length can only end with the connection
+                if request.length_required or not _has_length(resp):
+                    keep_alive = False
+
+                yield from send_all(client, _set_connection(resp, keep_alive, protocol))
+                if not keep_alive:
+                    return
+        except ConnectionError as e:
+            logger.warning(f"Client connection dropped with {e=}")
+        finally:
             client.close()
-            return
-
-        if not isinstance(resp, bytes):
-            resp = resp.encode("utf-8")
-
-        client.sendall(resp)
-        client.close()
 
     def serve(self, address: tuple[str, int]):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         sock.bind(address)
-        sock.listen(5)
+        sock.listen(socket.SOMAXCONN)
+        sock.setblocking(False)
         while True:
-            # yield IoWaitType.Recv, sock
-            client, _ = sock.accept()
-            t = Thread(target=self.handle_client, args=(client,))
-            t.start()
-            # self.loop.add_job(self.handle_client(client))
+            yield IoWaitType.Recv, sock
+            # drain the backlog, one readiness event can cover many connections
+            while True:
+                try:
+                    client, _ = sock.accept()
+                except BlockingIOError:
+                    break
+                except OSError as e:
+                    # out of fds most likely, retry on the next wakeup
+                    logger.error(f"Failed to accept connection with {e=}")
+                    break
+
+                client.setblocking(False)
+                self.loop.add_job(self.handle_client(client))
 
     def run(self, host: str = "127.0.0.1", port: int = 42999):
         logger.info(f"Server listening at {host}:{port}...")
-        self.serve((host, port))
-        # self.loop.add_job(self.serve((host, port)))
-        # self.loop.start()
+        self.loop.add_job(self.serve((host, port)))
+        self.loop.start()
 
 
 def setup_defaults(host: str, port: int):
     """
     This was part of codecrafters.io challenge
     """
+
+    router = Router()
+    cache = StaticCache()
+
+    @router.route("/")
     def handle_root(req: Request):
         return text_response(status=HTTP_200)
 
-    def handle_echo(req: Request):
-        msg = req.path.split("/")[-1]
+    @router.route("/echo/{msg}")
+    def handle_echo(req: Request, msg: str):
         resp = text_response(msg)
         return resp
 
+    @router.route("/user-agent")
     def handle_user_agent(req: Request):
-        val = req.headers.get("User-Agent", "NA")
+        val = req.headers.get("user-agent", "NA")
         resp = text_response(val)
         return resp
 
-    def handle_files(req: Request):
-        fname = "/".join(req.path.split("/")[2:])
-        if req.method == "GET":
-            resp = file_response(fname)
-            return resp
-
-        if req.method == "POST":
-            got = download_file(fname, req.body)
-            resp = text_response(status=HTTP_201)
-            return resp
-
-    handlers = [
-        (lambda path: path.startswith("/echo/"), handle_echo),
-        (lambda path: path == "/user-agent", handle_user_agent),
-        (lambda path: path.startswith("/files"), handle_files),
-        (lambda path: path == "/", handle_root),
-    ]
-
-    server = Server(loop=Loop(), handlers=handlers)
+    @router.route("/files/{path:path}", methods=["GET", "HEAD", "POST"])
+    def handle_files(req: Request, path: str):
+        if req.method in ("GET", "HEAD"):
+            return cache.response(req, path)
+
+        download_file(path, req.raw_body)
+        cache.discard(path)
+        return text_response(status=HTTP_201)
+
+    server = Server(loop=Loop(), handlers=router)
     server.run(host, port)
 
 
@@ -480,6 +1222,8 @@ def main(args_list: list[str] | None = None):
     parser.add_argument("--directory")
     args = parser.parse_args(args=args_list)
 
+    if args.directory:
+        ServerOptions.static_path = args.directory
     if args.serve:
         setup_defaults(args.host, args.port)
 
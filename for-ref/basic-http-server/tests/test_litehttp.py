@@ -1,9 +1,29 @@
+import gzip
+import io
 import json
+import socket
+import threading
+import time
 from pathlib import Path
 
 import pytest
 
-from litehttp import file_response, json_response, text_response
+from litehttp import (
+    ChunkedWriter,
+    FileResponse,
+    IoWaitType,
+    Loop,
+    Request,
+    RequestParser,
+    Router,
+    Server,
+    StaticCache,
+    file_response,
+    json_response,
+    static_response,
+    stream_response,
+    text_response,
+)
 
 
 # TODO: feat/parameter substitution from path
@@ -107,3 +127,658 @@ def test_json_response():
     ]
     expected = "\r\n".join(lines)
     assert resp == expected
+
+
+def start_server(handlers, **kwargs) -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    server = Server(handlers=handlers, loop=Loop(), **kwargs)
+    threading.Thread(target=server.run, args=("127.0.0.1", port), daemon=True).start()
+    for _ in range(50):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            break
+        except ConnectionRefusedError:
+            threading.Event().wait(0.02)
+
+    return port
+
+
+def read_response(f) -> tuple[str, dict, bytes]:
+    status = f.readline().decode().strip()
+    headers = {}
+    while (line := f.readline()) != b"\r\n":
+        name, _, val = line.decode().partition(":")
+        headers[name.strip().lower()] = val.strip()
+    return status, headers, f.read(int(headers["content-length"]))
+
+
+def read_chunked(f) -> tuple[str, dict, list[bytes]]:
+    """the head and every chunk of a chunked response, as they were framed"""
+    status = f.readline().decode().strip()
+    headers = {}
+    while (line := f.readline()) != b"\r\n":
+        name, _, val = line.decode().partition(":")
+        headers[name.strip().lower()] = val.strip()
+
+    chunks = []
+    while size := int(f.readline(), 16):
+        chunks.append(f.read(size))
+        assert f.read(2) == b"\r\n"
+    assert f.readline() == b"\r\n"
+    return status, headers, chunks
+
+
+def ticks(n: int, delay: float):
+    for i in range(n):
+        yield IoWaitType.Sleep, delay
+        yield f"data: {i}\r\n"
+
+
+HANDLERS = [
+    (lambda path: path.startswith("/echo/"), lambda r: text_response(r.path[6:])),
+    (lambda path: path == "/body", lambda r: text_response(r.body)),
+    (lambda path: path == "/big", lambda r: text_response("x" * 1_000_000)),
+    (lambda path: path == "/sse", lambda r: stream_response(ticks(3, 0.2))),
+]
+
+
+@pytest.fixture
+def port():
+    return start_server(HANDLERS)
+
+
+def test_loop_tasks():
+    left, right = socket.socketpair()
+    left.setblocking(False)
+    got = []
+
+    def reader():
+        yield IoWaitType.Recv, left
+        got.append(left.recv(16))
+
+    def writer():
+        yield IoWaitType.Send, right
+        right.send(b"ping")
+
+    loop = Loop()
+    loop.add_job(reader())
+    loop.add_job(writer())
+    loop.start()
+    assert got == [b"ping"]
+    assert not loop.selector.get_map()
+    left.close()
+    right.close()
+
+
+def test_loop_sleep():
+    woke = []
+
+    def sleeper(name, delay):
+        yield IoWaitType.Sleep, delay
+        woke.append(name)
+
+    loop = Loop()
+    for name, delay in [("slow", 0.2), ("fast", 0.05), ("now", 0)]:
+        loop.add_job(sleeper(name, delay))
+
+    start = time.monotonic()
+    loop.start()
+    assert woke == ["now", "fast", "slow"]
+    assert 0.2 <= time.monotonic() - start < 0.3
+    assert not loop.timers
+
+
+def test_loop_io_timeout():
+    left, right = socket.socketpair()
+    got = []
+
+    def reader():
+        try:
+            yield IoWaitType.Recv, left, 0.05
+        except TimeoutError:
+            got.append("timeout")
+        yield IoWaitType.Recv, left, 1.0
+        got.append(left.recv(16))
+
+    def writer():
+        yield IoWaitType.Sleep, 0.1
+        right.send(b"ping")
+
+    loop = Loop()
+    loop.add_job(reader())
+    loop.add_job(writer())
+    loop.start()
+    assert got == ["timeout", b"ping"]
+    assert not loop.timeouts and not loop.selector.get_map()
+    left.close()
+    right.close()
+
+
+def test_serve_sleeping_streams(port):
+    clients = [socket.create_connection(("127.0.0.1", port)) for _ in range(5)]
+    start = time.monotonic()
+    for client in clients:
+        client.sendall(b"GET /sse HTTP/1.1\r\n\r\n")
+
+    for client in clients:
+        f = client.makefile("rb")
+        _, headers, chunks = read_chunked(f)
+        assert headers["transfer-encoding"] == "chunked"
+        # every sleep flushes what is pending, so each tick is its own chunk
+        assert chunks == [b"data: 0\r\n", b"data: 1\r\n", b"data: 2\r\n"]
+        # the framing ends the body, the connection is still good
+        client.sendall(b"GET /echo/after HTTP/1.1\r\nconnection: close\r\n\r\n")
+        assert read_response(f)[2] == b"after"
+        client.close()
+    # the streams sleep side by side on one thread, not one after another
+    assert time.monotonic() - start < 1.5
+
+
+def test_serve_concurrent(port):
+    clients = [socket.create_connection(("127.0.0.1", port)) for _ in range(200)]
+    # every connection is open before any request goes out, a blocking
+    # handler would stall on the first one
+    for i, client in enumerate(reversed(clients)):
+        client.sendall(f"GET /echo/{i} HTTP/1.1\r\n\r\n".encode())
+
+    for i, client in enumerate(reversed(clients)):
+        assert read_response(client.makefile("rb"))[2] == str(i).encode()
+        client.close()
+
+
+def test_serve_partial_request(port):
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        client.sendall(b"POST /body HTTP/1.1\r\ncontent-length: 11\r\n")
+        threading.Event().wait(0.05)
+        client.sendall(b"\r\nhello ")
+        threading.Event().wait(0.05)
+        client.sendall(b"world")
+        assert read_response(client.makefile("rb"))[2] == b"hello world"
+
+
+def test_serve_large_response(port):
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        client.sendall(b"GET /big HTTP/1.1\r\n\r\n")
+        threading.Event().wait(0.1)
+        body = read_response(client.makefile("rb"))[2]
+    assert body == b"x" * 1_000_000
+
+
+@pytest.mark.parametrize(
+    "buf, expected",
+    [
+        (b"GET / HTTP/1.1\r\nhost: x\r\n", None),
+        (b"GET / HTTP/1.1\r\n\r\nGET /next", (b"", b"GET /next")),
+        (b"POST / HTTP/1.1\r\nContent-Length: 5\r\n\r\nab", None),
+        (b"POST / HTTP/1.1\r\nContent-Length: 2\r\n\r\nabGET", (b"ab", b"GET")),
+        (b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n3\r\nabc\r\n", None),
+        (
+            b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"3;ext=1\r\nabc\r\na\r\n0123456789\r\n0\r\nx-trailer: 1\r\n\r\nGET",
+            (b"abc0123456789", b"GET"),
+        ),
+    ],
+)
+def test_request_parser(buf, expected):
+    parser = RequestParser()
+    parser.feed(buf)
+    request = parser.parse()
+    if expected is None:
+        assert request is None
+    else:
+        assert (request.raw_body, bytes(parser.buf)) == expected
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_request_parser_bytewise(chunked):
+    body = bytes(range(256)) + b"\r\n\r\n0\r\n"
+    if chunked:
+        framing = b"Transfer-Encoding: chunked\r\n\r\n"
+        first, rest = body[:256], body[256:]
+        payload = b"100\r\n%s\r\n7\r\n%s\r\n0\r\n\r\n" % (first, rest)
+    else:
+        framing = f"Content-Length: {len(body)}\r\n\r\n".encode()
+        payload = body
+    data = b"POST /upload?a=1 HTTP/1.1\r\nUser-Agent: Test/1.0\r\n" + framing + payload
+
+    parser = RequestParser(("127.0.0.1", 1))
+    requests = []
+    for i in range(len(data)):
+        parser.feed(data[i : i + 1])
+        if (request := parser.parse()) is not None:
+            requests.append(request)
+
+    [request] = requests
+    assert (request.method, request.path, request.query) == (
+        "POST",
+        "/upload",
+        {"a": "1"},
+    )
+    assert request.headers["user-agent"] == "Test/1.0"
+    assert request.raw_body == body
+    assert not parser.buf
+
+
+@pytest.mark.parametrize(
+    "buf",
+    [
+        b"POST / HTTP/1.1\r\nContent-Length: nope\r\n\r\n",
+        b"POST / HTTP/1.1\r\nContent-Length: -1\r\n\r\n",
+        b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n2\r\nabc\r\n",
+        b"GET / HTTP/1.1\r\nx: " + b"y" * 70000,
+        b"GET / HTTP/1.1\r\nno colon\r\n\r\n",
+        b"GET /\r\n\r\n",
+    ],
+)
+def test_request_parser_invalid(buf):
+    parser = RequestParser()
+    parser.feed(buf)
+    with pytest.raises(ValueError):
+        parser.parse()
+
+
+def test_keep_alive(port):
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        f = client.makefile("rb")
+        for msg in ["a", "b"]:
+            client.sendall(f"GET /echo/{msg} HTTP/1.1\r\n\r\n".encode())
+            status, headers, body = read_response(f)
+            assert (status, body) == ("HTTP/1.1 200 OK", msg.encode())
+            assert "connection" not in headers
+
+        # pipelined, including a chunked body
+        client.sendall(
+            b"GET /echo/c HTTP/1.1\r\n\r\n"
+            b"POST /body HTTP/1.1\r\ntransfer-encoding: chunked\r\n\r\n"
+            b"5\r\nhello\r\n0\r\n\r\n"
+            b"GET /echo/d HTTP/1.1\r\nConnection: close\r\n\r\n"
+        )
+        assert read_response(f)[2] == b"c"
+        assert read_response(f)[2] == b"hello"
+        _, headers, body = read_response(f)
+        assert (headers["connection"], body) == ("close", b"d")
+        assert f.read() == b""
+
+
+def test_keep_alive_framing(port):
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        f = client.makefile("rb")
+        client.sendall(b"GET /nope HTTP/1.1\r\n\r\nGET /echo/%C3%A9 HTTP/1.1\r\n\r\n")
+        assert read_response(f)[::2] == ("HTTP/1.1 404 Not Found", b"")
+        client.sendall(b"POST /body HTTP/1.1\r\ncontent-length: 2\r\n\r\n\xc3\xa9")
+        # the raw path comes back as is, the body is counted in bytes
+        assert read_response(f)[2] == b"%C3%A9"
+        assert read_response(f)[2] == "é".encode()
+
+
+def test_keep_alive_http10(port):
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        f = client.makefile("rb")
+        client.sendall(b"GET /echo/a HTTP/1.0\r\nConnection: keep-alive\r\n\r\n")
+        assert read_response(f)[1]["connection"] == "keep-alive"
+        client.sendall(b"GET /echo/b HTTP/1.0\r\n\r\n")
+        assert read_response(f)[1]["connection"] == "close"
+        assert f.read() == b""
+
+
+def test_max_requests():
+    port = start_server(HANDLERS, max_requests=2)
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        f = client.makefile("rb")
+        client.sendall(b"GET /echo/a HTTP/1.1\r\n\r\n" * 3)
+        assert "connection" not in read_response(f)[1]
+        assert read_response(f)[1]["connection"] == "close"
+        assert f.read() == b""
+
+
+def test_idle_timeout():
+    port = start_server(HANDLERS, idle_timeout=0.1)
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        client.sendall(b"GET /echo/a HTTP/1.1\r\n\r\n")
+        f = client.makefile("rb")
+        assert read_response(f)[2] == b"a"
+        start = time.monotonic()
+        assert f.read() == b""
+        assert time.monotonic() - start < 1
+
+
+@pytest.fixture
+def router():
+    router = Router()
+    route = lambda name: lambda req, **params: (name, params)
+    router.add("GET", "/", route("root"))
+    router.add("GET", "/users/me", route("me"))
+    router.add(["GET", "DELETE"], "/users/{id:int}", route("user"))
+    router.add("GET", "/users/{name}", route("by_name"))
+    router.add("GET", "/users/{id:int}/posts/{slug}", route("post"))
+    router.add(["GET", "POST"], "/files/{path:path}", route("files"))
+    return router
+
+
+@pytest.mark.parametrize(
+    "path, expected",
+    [
+        ("/", ("root", {})),
+        ("/users/me", ("me", {})),
+        ("/users/42", ("user", {"id": 42})),
+        ("/users/bob/", ("by_name", {"name": "bob"})),
+        ("/users/b%20b", ("by_name", {"name": "b b"})),
+        ("/users/7/posts/hello", ("post", {"id": 7, "slug": "hello"})),
+        ("/files/a/b/c.txt", ("files", {"path": "a/b/c.txt"})),
+        ("/files", None),
+        ("/users", None),
+        ("/users/7/posts", None),
+        ("/nope", None),
+    ],
+)
+def test_router_resolve(router, path, expected):
+    found = router.resolve(path)
+    if expected is None:
+        assert found is None
+    else:
+        methods, params = found
+        assert (methods["GET"](None)[0], params) == expected
+
+
+@pytest.mark.parametrize(
+    "method, path, expected",
+    [
+        ("GET", "/users/5", ("user", {"id": 5})),
+        ("DELETE", "/users/5", ("user", {"id": 5})),
+        ("POST", "/files/x", ("files", {"path": "x"})),
+        # the static route has no DELETE, the param route behind it does
+        ("DELETE", "/users/me", None),
+        ("PUT", "/users/5", "HTTP/1.1 405"),
+        ("PUT", "/nope", "HTTP/1.1 404"),
+    ],
+)
+def test_router_dispatch(router, method, path, expected):
+    router.add("DELETE", "/users/{who}", lambda req, who: (who, "deleted"))
+    resp = router.dispatch(Request(f"{method} {path} HTTP/1.1", {}))
+    if expected is None:
+        assert resp == ("me", "deleted")
+    elif isinstance(expected, str):
+        assert resp.startswith(expected)
+    else:
+        assert resp == expected
+
+
+def test_router_405_allow(router):
+    resp = router.dispatch(Request("PATCH /users/5 HTTP/1.1", {}))
+    assert "allow: GET, DELETE\r\n" in resp
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    ["/a/{x:float}", "/a/{rest:path}/b", "/users/{id:int}"],
+)
+def test_router_invalid(router, pattern):
+    with pytest.raises(ValueError):
+        router.add("GET", pattern, lambda req: None)
+
+
+def test_serve_router(router):
+    router.add("GET", "/echo/{msg}", lambda req, msg: text_response(msg))
+    port = start_server(router)
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        f = client.makefile("rb")
+        client.sendall(b"GET /echo/hi HTTP/1.1\r\n\r\n")
+        assert read_response(f)[::2] == ("HTTP/1.1 200 OK", b"hi")
+        client.sendall(b"POST /echo/hi HTTP/1.1\r\ncontent-length: 0\r\n\r\n")
+        status, headers, _ = read_response(f)
+        assert (status, headers["allow"]) == ("HTTP/1.1 405 Method Not Allowed", "GET")
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    (tmp_path / "site").mkdir()
+    (tmp_path / "site" / "data.bin").write_bytes(bytes(range(256)) * 4096)
+    (tmp_path / "site" / "index.html").write_text("<p>hi</p>")
+    (tmp_path / "secret.txt").write_text("nope")
+    return tmp_path / "site"
+
+
+def get(path: str, **headers) -> Request:
+    return Request(f"GET {path} HTTP/1.1", headers)
+
+
+@pytest.mark.parametrize(
+    "headers, status, span",
+    [
+        ({}, "HTTP/1.1 200 OK", (0, 1048576)),
+        ({"range": "bytes=2-5"}, "HTTP/1.1 206 Partial Content", (2, 4)),
+        ({"range": "bytes=-3"}, "HTTP/1.1 206 Partial Content", (1048573, 3)),
+        ({"range": "bytes=1048570-"}, "HTTP/1.1 206 Partial Content", (1048570, 6)),
+        ({"range": "bytes=0-9999999"}, "HTTP/1.1 206 Partial Content", (0, 1048576)),
+        ({"range": "bytes=0-1,4-5"}, "HTTP/1.1 200 OK", (0, 1048576)),
+        (
+            {"range": "bytes=2-5", "if-range": '"stale"'},
+            "HTTP/1.1 200 OK",
+            (0, 1048576),
+        ),
+    ],
+)
+def test_static_response_range(static_dir, headers, status, span):
+    resp = static_response(get("/data.bin", **headers), "data.bin", root=static_dir)
+    assert isinstance(resp, FileResponse)
+    assert resp.head.startswith(status.encode())
+    assert (resp.offset, resp.length) == span
+    assert f"content-length: {span[1]}\r\n".encode() in resp.head
+    resp.file.close()
+
+
+def test_static_response_conditional(static_dir):
+    resp = static_response(get("/index.html"), "index.html", root=static_dir)
+    resp.file.close()
+    _, headers, _ = read_response(io.BytesIO(resp.head))
+    assert headers["content-type"] == "text/html; charset=utf-8"
+
+    for cond in [
+        {"if-none-match": f'"x", {headers["etag"]}'},
+        {"if-none-match": "*"},
+        {"if-modified-since": headers["last-modified"]},
+    ]:
+        resp = static_response(get("/index.html", **cond), "index.html", static_dir)
+        assert resp.startswith("HTTP/1.1 304 Not Modified\r\n")
+        assert resp.endswith("\r\n\r\n")
+
+    resp = static_response(
+        get("/index.html", **{"if-none-match": '"other"'}), "index.html", static_dir
+    )
+    assert isinstance(resp, FileResponse)
+    resp.file.close()
+
+
+@pytest.mark.parametrize(
+    "path, status",
+    [
+        ("../secret.txt", "HTTP/1.1 404"),
+        ("missing.txt", "HTTP/1.1 404"),
+        (".", "HTTP/1.1 404"),
+    ],
+)
+def test_static_response_missing(static_dir, path, status):
+    assert static_response(get("/x"), path, root=static_dir).startswith(status)
+
+
+def test_static_response_unsatisfiable(static_dir):
+    resp = static_response(get("/d", range="bytes=2000000-"), "data.bin", static_dir)
+    assert resp.startswith("HTTP/1.1 416 Range Not Satisfiable\r\n")
+    assert "content-range: bytes */1048576\r\n" in resp
+
+
+def test_serve_static(static_dir):
+    router = Router()
+    router.add(
+        ["GET", "HEAD"],
+        "/static/{path:path}",
+        lambda req, path: static_response(req, path, root=static_dir),
+    )
+    port = start_server(router)
+    data = (static_dir / "data.bin").read_bytes()
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        f = client.makefile("rb")
+        client.sendall(b"GET /static/data.bin HTTP/1.1\r\n\r\n")
+        status, headers, body = read_response(f)
+        assert (status, body) == ("HTTP/1.1 200 OK", data)
+        assert headers["accept-ranges"] == "bytes"
+
+        # same connection, the file went out with a length so it stays usable
+        client.sendall(b"GET /static/data.bin HTTP/1.1\r\nrange: bytes=10-19\r\n\r\n")
+        status, headers, body = read_response(f)
+        assert (status, body) == ("HTTP/1.1 206 Partial Content", data[10:20])
+        assert headers["content-range"] == "bytes 10-19/1048576"
+
+        etag = headers["etag"].encode()
+        client.sendall(
+            b"GET /static/data.bin HTTP/1.1\r\nif-none-match: %s\r\n\r\n" % etag
+        )
+        assert f.readline() == b"HTTP/1.1 304 Not Modified\r\n"
+        while f.readline() != b"\r\n":
+            pass
+
+        client.sendall(b"HEAD /static/data.bin HTTP/1.1\r\nconnection: close\r\n\r\n")
+        assert f.readline() == b"HTTP/1.1 200 OK\r\n"
+        assert b"content-length: 1048576\r\n" in f.read()
+
+
+@pytest.mark.parametrize("sendfile", [True, False])
+def test_file_response_send(static_dir, monkeypatch, sendfile):
+    if not sendfile:
+        monkeypatch.delattr("os.sendfile")
+    data = (static_dir / "data.bin").read_bytes()
+    resp = static_response(get("/d", range="bytes=100-"), "data.bin", static_dir)
+    left, right = socket.socketpair()
+    left.setblocking(False)
+    got = bytearray()
+
+    def reader():
+        while chunk := right.recv(65536):
+            got.extend(chunk)
+
+    t = threading.Thread(target=reader)
+    t.start()
+    loop = Loop()
+    loop.add_job(resp.send(left))
+    loop.start()
+    left.close()
+    t.join()
+    right.close()
+    assert got == data[100:]
+    assert resp.file.closed
+
+
+def test_static_cache_hit(static_dir):
+    cache = StaticCache(check_interval=60)
+    first = cache.response(get("/index.html"), "index.html", static_dir)
+    assert first.startswith(b"HTTP/1.1 200 OK\r\n") and first.endswith(b"<p>hi</p>")
+    # served from memory, the file is not even looked at before the next check
+    (static_dir / "index.html").unlink()
+    assert cache.response(get("/index.html"), "index.html", static_dir) is first
+
+    head = cache.response(Request("HEAD /i HTTP/1.1", {}), "index.html", static_dir)
+    assert first.startswith(head) and head.endswith(b"\r\n\r\n")
+
+
+def test_static_cache_invalidate(static_dir):
+    cache = StaticCache(check_interval=0)
+    first = cache.response(get("/index.html"), "index.html", static_dir)
+    (static_dir / "index.html").write_text("<p>changed</p>")
+    second = cache.response(get("/index.html"), "index.html", static_dir)
+    assert second.endswith(b"<p>changed</p>")
+    assert cache.nbytes == len(second)
+
+    (static_dir / "index.html").unlink()
+    assert cache.response(get("/i"), "index.html", static_dir).startswith(
+        "HTTP/1.1 404"
+    )
+    assert not cache.entries and cache.nbytes == 0
+
+
+@pytest.mark.parametrize(
+    "accept, encoding",
+    [
+        ("gzip, deflate", "gzip"),
+        ("br;q=1.0, gzip;q=0.5", "gzip"),
+        ("*", "gzip"),
+        ("gzip;q=0", None),
+        ("deflate", None),
+        (None, None),
+    ],
+)
+def test_static_cache_gzip(static_dir, accept, encoding):
+    text = "litehttp " * 200
+    (static_dir / "page.txt").write_text(text)
+    cache = StaticCache()
+    headers = {} if accept is None else {"accept-encoding": accept}
+    resp = cache.response(get("/page.txt", **headers), "page.txt", static_dir)
+    _, headers, body = read_response(io.BytesIO(resp))
+    assert headers["vary"] == "accept-encoding"
+    assert headers.get("content-encoding") == encoding
+    if encoding:
+        body = gzip.decompress(body)
+    assert body == text.encode()
+
+    # each encoding has its own etag for revalidation
+    cond = {"if-none-match": headers["etag"], "accept-encoding": accept or ""}
+    resp = cache.response(get("/page.txt", **cond), "page.txt", static_dir)
+    assert resp.startswith(b"HTTP/1.1 304 Not Modified\r\n")
+
+
+def test_static_cache_lru(static_dir):
+    for name in "abc":
+        (static_dir / f"{name}.bin").write_bytes(name.encode() * 1000)
+    size = len(StaticCache().response(get("/a"), "a.bin", static_dir))
+    cache = StaticCache(max_bytes=2 * size)
+    for name in ["a.bin", "b.bin", "a.bin", "c.bin"]:
+        cache.response(get("/"), name, static_dir)
+
+    assert [key[1] for key in cache.entries] == ["a.bin", "c.bin"]
+    assert cache.nbytes == 2 * size
+
+
+def test_static_cache_bypass(static_dir):
+    cache = StaticCache(max_file_size=1024)
+    big = cache.response(get("/data.bin"), "data.bin", static_dir)
+    ranged = cache.response(get("/i", range="bytes=0-1"), "index.html", static_dir)
+    for resp in [big, ranged]:
+        assert isinstance(resp, FileResponse)
+        resp.file.close()
+    assert not cache.entries
+
+
+def test_chunked_writer():
+    writer = ChunkedWriter(max_size=8, max_delay=60)
+    assert writer.write(b"abc") is None
+    assert writer.write(b"") is None
+    assert writer.write(b"defgh") == b"8\r\nabcdefgh\r\n"
+    assert writer.write(b"x" * 20) == b"14\r\n" + b"x" * 20 + b"\r\n"
+    assert writer.write(b"y") is None
+    assert writer.close() == b"1\r\ny\r\n0\r\n\r\n"
+    assert writer.close() == b"0\r\n\r\n"
+
+    writer = ChunkedWriter(max_size=1024, max_delay=0.05)
+    assert writer.write(b"a") is None
+    time.sleep(0.06)
+    assert writer.write(b"b") == b"2\r\nab\r\n"
+
+
+def test_stream_response_chunked():
+    def rows():
+        yield "a"
+        yield b"b"
+        yield IoWaitType.Sleep, 0
+        yield "c" * 10
+
+    out = list(stream_response(rows(), max_size=8))
+    assert out[0].startswith("HTTP/1.1 200 OK\r\n")
+    assert "transfer-encoding: chunked\r\n" in out[0]
+    assert out[1:] == [
+        b"2\r\nab\r\n",
+        (IoWaitType.Sleep, 0),
+        b"a\r\n" + b"c" * 10 + b"\r\n",
+        b"0\r\n\r\n",
+    ]
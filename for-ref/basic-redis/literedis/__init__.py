@@ -0,0 +1,5084 @@
+import ast
+import builtins
+import hashlib
+import heapq
+import io
+import json
+import logging
+import math
+import operator
+import os
+import random
+import selectors
+import socket
+import struct
+import sys
+import time
+from argparse import ArgumentParser
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from enum import Enum
+from functools import cached_property, reduce, wraps
+from itertools import count, islice
+from os import PathLike
+from pathlib import Path
+from queue import Queue
+from threading import Barrier, BrokenBarrierError, Lock, RLock, Thread, local
+from typing import Any, Generator
+
+logger = logging.getLogger("literedis")
+logger.setLevel(logging.DEBUG)
+
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.DEBUG)
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+handler.setFormatter(formatter)
+logger.addHandler(handler)
+
+
+class TList(list):
+    low = ord("-")
+    high = ord("9")
+
+    def __getitem__(self, idx):
+        if isinstance(idx, str):
+            assert len(idx) == 1
+            return super().__getitem__(ord(idx) - self.low)
+
+        assert isinstance(idx, int)
+        return super().__getitem__(idx)
+
+    def __setitem__(self, idx, val):
+        if isinstance(idx, str):
+            assert len(idx) == 1
+            return super().__setitem__(ord(idx) - self.low, val)
+
+        assert isinstance(idx, int)
+        return super().__setitem__(idx, val)
+
+
+class TrieNode:
+    ends: int
+    children: TList
+
+    def __init__(self):
+        self.ends = 0
+        self.children = TList([None for _ in range(15)])
+        self.data = {}
+
+    def __repr__(self):
+        chars = [chr(i + ord("a")) for i, e in enumerate(self.children) if e]
+        return f"Trie(ends={self.ends}, children={chars})"
+
+
+MAX_SEQ = (1 << 64) - 1
+MIN_ID = (0, 0)
+MAX_ID = (MAX_SEQ, MAX_SEQ)
+
+
+def parse_stream_id(key: str, default_seq: int = 0) -> tuple[int, int]:
+    match key:
+        case "-":
+            return MIN_ID
+        case "+":
+            return MAX_ID
+        case _ if "-" not in key:
+            return int(key), default_seq
+        case _:
+            ms, seq = key.split("-")
+            return int(ms), int(seq)
+
+
+def ser_stream_id(parts: tuple[int, int]) -> str:
+    return "-".join(map(str, parts))
+
+
+class PendingEntries:
+    """
+    Pending entries list (PEL) of a consumer group: ids delivered to a
+    consumer but not acknowledged yet.
+
+    The ids are kept in a skiplist so adds, acks and range seeks are
+    O(log n) like the rax redis uses; the per entry bookkeeping lives in
+    `entries` as [consumer, last delivery in ms, delivery count].
+    """
+
+    max_level = 32
+
+    def __init__(self):
+        self.entries: dict[tuple[int, int], list] = {}
+        # a node is [id, next at level 0, next at level 1, ...]
+        self.head: list = [None] * (self.max_level + 1)
+        self.tail: list | None = None
+        self.level = 1
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, id_: tuple[int, int]):
+        return id_ in self.entries
+
+    def __iter__(self) -> Generator[tuple[int, int], None, None]:
+        node = self.head[1]
+        while node is not None:
+            yield node[0]
+            node = node[1]
+
+    def first(self) -> tuple[int, int] | None:
+        node = self.head[1]
+        return None if node is None else node[0]
+
+    def last(self) -> tuple[int, int] | None:
+        return None if self.tail is None else self.tail[0]
+
+    def _path(self, id_: tuple[int, int], inclusive=False) -> list[list]:
+        """the last node before `id_` (or at it if `inclusive`) on every level"""
+        path = [self.head] * self.level
+        node = self.head
+        for lvl in reversed(range(self.level)):
+            while (nxt := node[lvl + 1]) is not None and (
+                nxt[0] <= id_ if inclusive else nxt[0] < id_
+            ):
+                node = nxt
+            path[lvl] = node
+        return path
+
+    def add(self, id_: tuple[int, int], entry: list):
+        if id_ not in self.entries:
+            level = 1
+            while level < self.max_level and random.random() < 0.25:
+                level += 1
+            path = self._path(id_)
+            if level > self.level:
+                path.extend([self.head] * (level - self.level))
+                self.level = level
+
+            node = [id_] + [None] * level
+            for lvl in range(level):
+                node[lvl + 1] = path[lvl][lvl + 1]
+                path[lvl][lvl + 1] = node
+            if node[1] is None:
+                self.tail = node
+        self.entries[id_] = entry
+
+    def remove(self, id_: tuple[int, int]) -> list | None:
+        entry = self.entries.pop(id_, None)
+        if entry is None:
+            return None
+
+        path = self._path(id_)
+        node = path[0][1]
+        for lvl in range(len(node) - 1):
+            path[lvl][lvl + 1] = node[lvl + 1]
+        if node is self.tail:
+            self.tail = None if path[0] is self.head else path[0]
+        while self.level > 1 and self.head[self.level] is None:
+            self.level -= 1
+        return entry
+
+    def range(
+        self, start=MIN_ID, end=MAX_ID, start_xlsv=False
+    ) -> Generator[tuple[tuple[int, int], list], None, None]:
+        node = self._path(start, inclusive=start_xlsv)[0][1]
+        while node is not None and node[0] <= end:
+            # read the successor first so the caller may ack what it was given
+            id_, node = node[0], node[1]
+            yield id_, self.entries[id_]
+
+
+class ConsumerGroup:
+    name: str
+    last_id: tuple[int, int]
+    pel: PendingEntries
+    consumers: dict[str, PendingEntries]
+
+    def __init__(self, name: str, last_id: tuple[int, int]):
+        self.name = name
+        self.last_id = last_id
+        self.pel = PendingEntries()
+        self.consumers = {}
+
+    def consumer(self, name: str) -> PendingEntries:
+        if name not in self.consumers:
+            self.consumers[name] = PendingEntries()
+
+        return self.consumers[name]
+
+    def deliver(self, id_: tuple[int, int], consumer: str, now: int):
+        entry = self.pel.entries.get(id_)
+        if entry is None:
+            entry = [consumer, now, 0]
+        elif entry[0] != consumer:
+            self.consumers[entry[0]].remove(id_)
+            entry[0] = consumer
+
+        entry[1] = now
+        entry[2] += 1
+        self.pel.add(id_, entry)
+        self.consumer(consumer).add(id_, entry)
+        return entry
+
+    def ack(self, id_: tuple[int, int]) -> bool:
+        entry = self.pel.remove(id_)
+        if entry is None:
+            return False
+
+        self.consumers[entry[0]].remove(id_)
+        return True
+
+
+# TODO: convert to Radix Tree
+# https://en.wikipedia.org/wiki/Radix_tree
+class Trie:
+    root: TrieNode
+    empty = True
+    # ids are indexed in insertion (= id) order in blocks of this many entries,
+    # approximate trimming only ever drops whole blocks
+    block_size = 100
+    error_0_0 = ValueError("The ID specified in XADD must be greater than 0-0")
+    error_key_lt_last_key = ValueError(
+        "The ID specified in XADD is equal or smaller than the target stream top item"
+    )
+
+    def __init__(self):
+        self.root = TrieNode()
+        self.last_key = (0, 1)
+        self.groups: dict[str, ConsumerGroup] = {}
+        self.blocks: list[list[tuple[int, int]]] = []
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def _gen_next_ms(self):
+        curr = int(time.time() * 1000)
+        ms, seq = self.last_key
+        if curr == ms:
+            return ms, seq + 1
+
+        return curr, 0
+
+    def _gen_next_seq(self, key: str):
+        ms = int(key.split("-")[0])
+        pms, pseq = self.last_key
+        if ms < pms:
+            raise self.error_key_lt_last_key
+
+        if self.empty:
+            return self.last_key
+
+        if ms == pms:
+            return ms, pseq + 1
+
+        return ms, 0
+
+    def _ser_parts(self, parts: tuple[int, int]):
+        return "-".join(map(str, parts))
+
+    def _gen_next_key(self, key: str):
+        if key == "*":
+            return self._gen_next_ms()
+
+        _, seq = key.split("-")
+        if seq == "*":
+            return self._gen_next_seq(key)
+
+        raise ValueError(f"Invalid {key=}")
+
+    def _check_key(self, key: str):
+        if key == "0-0":
+            raise self.error_0_0
+
+        if "*" in key:
+            return self._gen_next_key(key)
+
+        ms, seq = map(int, key.split("-"))
+        exception = self.empty and (ms, seq) == (0, 1)
+        pms, pseq = self.last_key
+        if not exception and any([ms < pms, ms == pms and seq <= pseq]):
+            raise self.error_key_lt_last_key
+
+        return ms, seq
+
+    def insert(self, key: str, data: dict | None = None):
+        parts = self._check_key(key)
+
+        key = self._ser_parts(parts)
+        temp = self.root
+        for c in key:
+            if not temp.children[c]:
+                temp.children[c] = TrieNode()
+
+            temp = temp.children[c]
+
+        temp.ends += 1
+        if data:
+            temp.data = data
+
+        # _check_key guarantees ids only grow, so appending keeps blocks sorted
+        if not self.blocks or len(self.blocks[-1]) >= self.block_size:
+            self.blocks.append([])
+        self.blocks[-1].append(parts)
+        self.length += 1
+
+        self.last_key = parts
+        self.empty = False
+        return key
+
+    def _delete(self, key: str) -> bool:
+        path = []
+        temp = self.root
+        for c in key:
+            path.append((temp, c))
+            temp = temp.children[c]
+            if not temp:
+                return False
+
+        if not temp.ends:
+            return False
+
+        temp.ends -= 1
+        temp.data = {}
+        # prune the branch up to the first node still holding other entries
+        for parent, c in reversed(path):
+            node = parent.children[c]
+            if node.ends or any(node.children):
+                break
+            parent.children[c] = None
+
+        return True
+
+    def _drop(self, ids: list[tuple[int, int]]):
+        for id_ in ids:
+            self._delete(self._ser_parts(id_))
+        self.length -= len(ids)
+
+    def trim(
+        self,
+        strategy: str,
+        threshold: str,
+        approx=False,
+        limit: int | None = None,
+    ) -> int:
+        match strategy.upper():
+            case "MAXLEN":
+                maxlen = int(threshold)
+                covered = lambda block: self.length - len(block) >= maxlen
+                partial = lambda block: block[: max(self.length - maxlen, 0)]
+            case "MINID":
+                minid = parse_stream_id(threshold)
+                covered = lambda block: block[-1] < minid
+                partial = lambda block: block[: bisect_left(block, minid)]
+            case x:
+                raise ValueError(f"syntax error, unknown trim strategy {x!r}")
+
+        removed = 0
+        while self.blocks and covered(self.blocks[0]):
+            if limit is not None and removed + len(self.blocks[0]) > limit:
+                return removed
+            block = self.blocks.pop(0)
+            self._drop(block)
+            removed += len(block)
+
+        if approx or not self.blocks:
+            return removed
+
+        ids = partial(self.blocks[0])
+        if limit is not None:
+            ids = ids[: max(limit - removed, 0)]
+        del self.blocks[0][: len(ids)]
+        if not self.blocks[0]:
+            self.blocks.pop(0)
+        self._drop(ids)
+        return removed + len(ids)
+
+    def _search(
+        self, node: TrieNode, curr=""
+    ) -> Generator[tuple[str, dict], None, None]:
+        if node.ends:
+            yield (curr, node.data)
+
+        for i, _ in enumerate(node.children):
+            temp = node.children[i]
+            if not temp:
+                continue
+            yield from self._search(temp, curr + chr(ord("-") + i))
+
+    def search(self, key: str):
+        temp = self.root
+        curr = ""
+        for c in key:
+            if not temp.children[c]:
+                return None
+
+            curr += c
+            temp = temp.children[c]
+
+        return self._search(temp, curr)
+
+    def _all(self, node: TrieNode, key=""):
+        if node.ends:
+            yield key, node.data
+
+        for i, node in enumerate(node.children):
+            if not node:
+                continue
+            yield from self._all(node, key + chr(ord("-") + i))
+
+    def all(self):
+        return self._all(self.root)
+
+    def get(self, key: str) -> dict | None:
+        temp = self.root
+        for c in key:
+            temp = temp.children[c]
+            if not temp:
+                return None
+
+        return temp.data if temp.ends else None
+
+    def range(
+        self, start=MIN_ID, end=MAX_ID, start_xlsv=False, count: int | None = None
+    ) -> list[tuple[str, dict]]:
+        bisect_ = bisect_right if start_xlsv else bisect_left
+        rv = []
+        for block in self.blocks:
+            if block[-1] < start:
+                continue
+            if block[0] > end:
+                break
+
+            low = bisect_(block, start)
+            high = bisect_right(block, end)
+            for id_ in block[low:high]:
+                if count is not None and len(rv) >= count:
+                    return rv
+                key = self._ser_parts(id_)
+                rv.append((key, self.get(key)))
+
+        return rv
+
+
+INT64_MIN, INT64_MAX = -(1 << 63), (1 << 63) - 1
+
+
+def is_int_member(val) -> bool:
+    """whether `val` can be stored in an int64 without changing its string form"""
+    if isinstance(val, bool):
+        return False
+
+    if not isinstance(val, int):
+        try:
+            num = int(val)
+        except (TypeError, ValueError):
+            return False
+        if str(num) != val:
+            return False
+        val = num
+
+    return INT64_MIN <= val <= INT64_MAX
+
+
+class IntSet:
+    """
+    Small sets whose members are all integers, kept as a sorted int64 array.
+    Members are handed back as strings, same as any other set member.
+    """
+
+    __slots__ = ("members",)
+
+    def __init__(self, members=()):
+        self.members = array("q", sorted({int(m) for m in members}))
+
+    def _find(self, val) -> tuple[int, bool]:
+        if not is_int_member(val):
+            return -1, False
+
+        num = int(val)
+        idx = bisect_left(self.members, num)
+        return idx, idx < len(self.members) and self.members[idx] == num
+
+    def __contains__(self, val):
+        return self._find(val)[1]
+
+    def __len__(self):
+        return len(self.members)
+
+    def __iter__(self):
+        return (str(m) for m in self.members)
+
+    def __eq__(self, o):
+        if not isinstance(o, SET_TYPES):
+            return NotImplemented
+        return set(self) == set(o)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({list(self.members)})"
+
+    def add(self, val):
+        idx, found = self._find(val)
+        if not found:
+            self.members.insert(idx, int(val))
+
+    def remove(self, val):
+        idx, found = self._find(val)
+        if not found:
+            raise KeyError(val)
+        del self.members[idx]
+
+
+class ListPackSet:
+    """Small sets kept as a flat array of members, scanned linearly."""
+
+    __slots__ = ("members",)
+
+    def __init__(self, members=()):
+        self.members = list(dict.fromkeys(members))
+
+    def __contains__(self, val):
+        return val in self.members
+
+    def __len__(self):
+        return len(self.members)
+
+    def __iter__(self):
+        return iter(self.members)
+
+    def __eq__(self, o):
+        if not isinstance(o, SET_TYPES):
+            return NotImplemented
+        return set(self) == set(o)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.members})"
+
+    def add(self, val):
+        if val not in self.members:
+            self.members.append(val)
+
+    def remove(self, val):
+        try:
+            self.members.remove(val)
+        except ValueError:
+            raise KeyError(val)
+
+
+class ListPack:
+    """Small hashes kept as a flat [field, value, field, value, ...] array."""
+
+    __slots__ = ("entries",)
+
+    def __init__(self, items=()):
+        self.entries = []
+        for key, val in dict(items).items():
+            self.entries.extend((key, val))
+
+    def _index(self, key) -> int:
+        entries = self.entries
+        for idx in range(0, len(entries), 2):
+            if entries[idx] == key:
+                return idx
+
+        return -1
+
+    def __contains__(self, key):
+        return self._index(key) >= 0
+
+    def __len__(self):
+        return len(self.entries) // 2
+
+    def __iter__(self):
+        return iter(self.entries[::2])
+
+    def __eq__(self, o):
+        if not isinstance(o, HASH_TYPES):
+            return NotImplemented
+        return dict(self.items()) == dict(o.items())
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self.items())})"
+
+    def __getitem__(self, key):
+        idx = self._index(key)
+        if idx < 0:
+            raise KeyError(key)
+        return self.entries[idx + 1]
+
+    def __setitem__(self, key, val):
+        idx = self._index(key)
+        if idx < 0:
+            self.entries.extend((key, val))
+        else:
+            self.entries[idx + 1] = val
+
+    def __delitem__(self, key):
+        idx = self._index(key)
+        if idx < 0:
+            raise KeyError(key)
+        del self.entries[idx : idx + 2]
+
+    def get(self, key, default=None):
+        idx = self._index(key)
+        return default if idx < 0 else self.entries[idx + 1]
+
+    def keys(self):
+        return self.entries[::2]
+
+    def values(self):
+        return self.entries[1::2]
+
+    def items(self):
+        return zip(self.entries[::2], self.entries[1::2])
+
+
+SET_TYPES = (set, IntSet, ListPackSet)
+HASH_TYPES = (dict, ListPack)
+LIST_TYPES = (list, deque)
+
+# mirrors the redis.conf knobs that decide when a small encoding is converted
+ENCODING_DEFAULTS = {
+    "set-max-intset-entries": 512,
+    "set-max-listpack-entries": 128,
+    "set-max-listpack-value": 64,
+    "hash-max-listpack-entries": 128,
+    "hash-max-listpack-value": 64,
+    "list-max-listpack-size": 128,
+}
+
+# AOF rewrite knobs, a rewrite is triggered once the file doubles past the min size
+PERSISTENCE_DEFAULTS = {
+    "aof-use-rdb-preamble": "yes",
+    "auto-aof-rewrite-percentage": 100,
+    "auto-aof-rewrite-min-size": 64 * 1024 * 1024,
+}
+
+SERVER_DEFAULTS = {"databases": 16, "keyspace-shards": 16}
+
+CONFIG_DEFAULTS = SERVER_DEFAULTS | ENCODING_DEFAULTS | PERSISTENCE_DEFAULTS
+
+
+# a script runs holding every lock stripe, these bound how long it can hold them.
+# every evaluation costs a step, builtins called on a container cost its length
+SCRIPT_MAX_STEPS = 1_000_000
+SCRIPT_MAX_LEN = 1 << 20  # items or chars in a single value
+SCRIPT_MAX_BITS = 1 << 16  # size of an int result
+
+
+def _script_limit(msg: str) -> ValueError:
+    return ValueError(f"Error running script: {msg}")
+
+
+def _sized(val) -> int:
+    return len(val) if isinstance(val, (str, list, tuple, dict, set, range)) else 0
+
+
+def _script_add(a, b):
+    if _sized(a) + _sized(b) > SCRIPT_MAX_LEN:
+        raise _script_limit("value too large")
+    return a + b
+
+
+def _script_mul(a, b):
+    for seq, n in ((a, b), (b, a)):
+        if isinstance(n, int) and _sized(seq) * n > SCRIPT_MAX_LEN:
+            raise _script_limit("value too large")
+    if isinstance(a, int) and isinstance(b, int):
+        if a.bit_length() + b.bit_length() > SCRIPT_MAX_BITS:
+            raise _script_limit("integer too large")
+    return a * b
+
+
+def _script_pow(a, b):
+    if isinstance(a, int) and isinstance(b, int) and abs(a) > 1:
+        if b * a.bit_length() > SCRIPT_MAX_BITS:
+            raise _script_limit("integer too large")
+    return a**b
+
+
+def _script_lshift(a, b):
+    if (
+        isinstance(a, int)
+        and isinstance(b, int)
+        and a.bit_length() + b > SCRIPT_MAX_BITS
+    ):
+        raise _script_limit("integer too large")
+    return a << b
+
+
+def _script_range(*args):
+    rv = range(*args)
+    if len(rv) > SCRIPT_MAX_LEN:
+        raise _script_limit("range too large")
+    return rv
+
+
+class _ScriptBudget:
+    """steps a script may still take, see SCRIPT_MAX_STEPS"""
+
+    def __init__(self):
+        self.left = SCRIPT_MAX_STEPS
+
+    def spend(self, steps: int = 1):
+        self.left -= steps
+        if self.left < 0:
+            raise _script_limit(f"exceeded {SCRIPT_MAX_STEPS} steps")
+
+
+SCRIPT_BUILTINS = {
+    name: getattr(builtins, name)
+    for name in (
+        "abs all any bool dict divmod enumerate float int isinstance len list max"
+        " min reversed round set sorted str sum tuple zip"
+    ).split()
+} | {"range": _script_range}
+SCRIPT_CALLABLES = set(SCRIPT_BUILTINS) | {"call", "pcall"}
+
+# the only syntax a script may use. there is no attribute access, no
+# functions, lambdas, classes or comprehensions, nothing that leads from a
+# value back to frames, modules or the interpreter
+SCRIPT_NODES = (
+    ast.Module,
+    ast.Expr,
+    ast.Assign,
+    ast.AugAssign,
+    ast.If,
+    ast.While,
+    ast.For,
+    ast.Break,
+    ast.Continue,
+    ast.Pass,
+    ast.Return,
+    ast.Constant,
+    ast.Name,
+    ast.BinOp,
+    ast.UnaryOp,
+    ast.BoolOp,
+    ast.Compare,
+    ast.IfExp,
+    ast.Call,
+    ast.keyword,
+    ast.Subscript,
+    ast.Slice,
+    ast.List,
+    ast.Tuple,
+    ast.Dict,
+    ast.Set,
+    ast.JoinedStr,
+    ast.FormattedValue,
+    ast.Load,
+    ast.Store,
+    ast.operator,
+    ast.unaryop,
+    ast.boolop,
+    ast.cmpop,
+)
+
+SCRIPT_BINOPS = {
+    ast.Add: _script_add,
+    ast.Sub: operator.sub,
+    ast.Mult: _script_mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: _script_pow,
+    ast.LShift: _script_lshift,
+    ast.RShift: operator.rshift,
+    ast.BitOr: operator.or_,
+    ast.BitXor: operator.xor,
+    ast.BitAnd: operator.and_,
+}
+
+SCRIPT_UNARYOPS = {
+    ast.Not: operator.not_,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+    ast.Invert: operator.invert,
+}
+
+SCRIPT_CMPOPS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Is: operator.is_,
+    ast.IsNot: operator.is_not,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+}
+
+
+class _ScriptReturn(Exception):
+    def __init__(self, value):
+        self.value = value
+
+
+class _ScriptBreak(Exception):
+    pass
+
+
+class _ScriptContinue(Exception):
+    pass
+
+
+def _script_error(msg: str) -> ValueError:
+    return ValueError(f"Error compiling script: {msg}")
+
+
+def _check_script(tree: ast.Module):
+    for node in ast.walk(tree):
+        if not isinstance(node, SCRIPT_NODES):
+            raise _script_error(f"{type(node).__name__} is not allowed")
+
+        if isinstance(node, ast.Call):
+            func = node.func
+            if not isinstance(func, ast.Name) or func.id not in SCRIPT_CALLABLES:
+                raise _script_error("only call, pcall and builtins can be called")
+            if any(kw.arg is None for kw in node.keywords):
+                raise _script_error("** arguments are not allowed")
+
+        if isinstance(node, (ast.Assign, ast.For)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                elts = target.elts if isinstance(target, ast.Tuple) else [target]
+                if not all(isinstance(t, (ast.Name, ast.Subscript)) for t in elts):
+                    raise _script_error("can only assign to names and items")
+
+        if isinstance(node, ast.AugAssign) and not isinstance(
+            node.target, (ast.Name, ast.Subscript)
+        ):
+            raise _script_error("can only assign to names and items")
+
+
+def _script_assign(target, value, scope: dict, funcs: dict):
+    match target:
+        case ast.Name():
+            scope[target.id] = value
+        case ast.Subscript():
+            obj = _script_eval(target.value, scope, funcs)
+            obj[_script_eval(target.slice, scope, funcs)] = value
+        case ast.Tuple():
+            values = list(value)
+            if len(values) != len(target.elts):
+                raise ValueError(f"can't unpack {len(values)} values")
+            for elt, val in zip(target.elts, values):
+                _script_assign(elt, val, scope, funcs)
+
+
+def _script_eval(node, scope: dict, funcs: dict):
+    ev = lambda n: _script_eval(n, scope, funcs)
+    budget: _ScriptBudget = funcs["__budget__"]
+    budget.spend()
+    match node:
+        case ast.Constant():
+            return node.value
+        case ast.Name():
+            if node.id in scope:
+                return scope[node.id]
+            if node.id in SCRIPT_BUILTINS:
+                return SCRIPT_BUILTINS[node.id]
+            raise NameError(f"name {node.id!r} is not defined")
+        case ast.BinOp():
+            return SCRIPT_BINOPS[type(node.op)](ev(node.left), ev(node.right))
+        case ast.UnaryOp():
+            return SCRIPT_UNARYOPS[type(node.op)](ev(node.operand))
+        case ast.BoolOp():
+            is_and = isinstance(node.op, ast.And)
+            for value in node.values:
+                rv = ev(value)
+                if bool(rv) is not is_and:
+                    return rv
+            return rv
+        case ast.Compare():
+            left = ev(node.left)
+            for op, comp in zip(node.ops, node.comparators):
+                right = ev(comp)
+                if not SCRIPT_CMPOPS[type(op)](left, right):
+                    return False
+                left = right
+            return True
+        case ast.IfExp():
+            return ev(node.body) if ev(node.test) else ev(node.orelse)
+        case ast.Call():
+            args = [ev(a) for a in node.args]
+            kwargs = {kw.arg: ev(kw.value) for kw in node.keywords}
+            budget.spend(sum(map(_sized, args)))
+            return funcs[node.func.id](*args, **kwargs)
+        case ast.Subscript():
+            return ev(node.value)[ev(node.slice)]
+        case ast.Slice():
+            parts = (node.lower, node.upper, node.step)
+            return slice(*[None if p is None else ev(p) for p in parts])
+        case ast.List():
+            return [ev(e) for e in node.elts]
+        case ast.Tuple():
+            return tuple(ev(e) for e in node.elts)
+        case ast.Set():
+            return {ev(e) for e in node.elts}
+        case ast.Dict():
+            return {ev(k): ev(v) for k, v in zip(node.keys, node.values)}
+        case ast.JoinedStr():
+            return "".join(str(ev(v)) for v in node.values)
+        case ast.FormattedValue():
+            value = ev(node.value)
+            convert = {115: str, 114: repr, 97: ascii}.get(node.conversion)
+            value = convert(value) if convert else value
+            spec = "" if node.format_spec is None else ev(node.format_spec)
+            digits = "".join(c if c.isdigit() else " " for c in spec).split()
+            if max(map(int, digits), default=0) > SCRIPT_MAX_LEN:
+                raise _script_limit("format width too large")
+            return format(value, spec)
+
+    raise _script_error(f"{type(node).__name__} is not allowed")
+
+
+def _script_exec(body: list, scope: dict, funcs: dict):
+    ev = lambda n: _script_eval(n, scope, funcs)
+    for node in body:
+        funcs["__budget__"].spend()
+        match node:
+            case ast.Expr():
+                ev(node.value)
+            case ast.Assign():
+                value = ev(node.value)
+                for target in node.targets:
+                    _script_assign(target, value, scope, funcs)
+            case ast.AugAssign():
+                load = ast.Name(node.target.id, ast.Load())
+                if isinstance(node.target, ast.Subscript):
+                    load = ast.Subscript(
+                        node.target.value, node.target.slice, ast.Load()
+                    )
+                value = SCRIPT_BINOPS[type(node.op)](ev(load), ev(node.value))
+                _script_assign(node.target, value, scope, funcs)
+            case ast.If():
+                _script_exec(node.body if ev(node.test) else node.orelse, scope, funcs)
+            case ast.While() | ast.For():
+                _script_loop(node, scope, funcs)
+            case ast.Break():
+                raise _ScriptBreak()
+            case ast.Continue():
+                raise _ScriptContinue()
+            case ast.Return():
+                raise _ScriptReturn(None if node.value is None else ev(node.value))
+
+
+def _script_loop(node: ast.While | ast.For, scope: dict, funcs: dict):
+    if isinstance(node, ast.For):
+        items = iter(_script_eval(node.iter, scope, funcs))
+    while True:
+        if isinstance(node, ast.While):
+            if not _script_eval(node.test, scope, funcs):
+                break
+        else:
+            try:
+                _script_assign(node.target, next(items), scope, funcs)
+            except StopIteration:
+                break
+
+        try:
+            _script_exec(node.body, scope, funcs)
+        except _ScriptBreak:
+            return
+        except _ScriptContinue:
+            pass
+
+    _script_exec(node.orelse, scope, funcs)
+
+
+def compile_script(src: str):
+    """
+    Compile an EVAL script into `script(KEYS, ARGV, call, pcall)`.
+
+    Scripts are written in a small python subset using `return` for the
+    reply. The tree is checked against SCRIPT_NODES and then walked by a tiny
+    evaluator, nothing is handed to exec, so a script can only reach its own
+    values, SCRIPT_BUILTINS and call/pcall. Runs are bounded by
+    SCRIPT_MAX_STEPS and values by SCRIPT_MAX_LEN / SCRIPT_MAX_BITS.
+    """
+    try:
+        tree = ast.parse(src, "<script>")
+    except SyntaxError as e:
+        raise _script_error(str(e))
+
+    _check_script(tree)
+
+    def script(KEYS, ARGV, call, pcall):
+        scope = {"KEYS": KEYS, "ARGV": ARGV}
+        # "__budget__" is no name a script can call or load
+        funcs = SCRIPT_BUILTINS | {
+            "call": call,
+            "pcall": pcall,
+            "__budget__": _ScriptBudget(),
+        }
+        try:
+            _script_exec(tree.body, scope, funcs)
+        except _ScriptReturn as r:
+            return r.value
+        except (_ScriptBreak, _ScriptContinue):
+            raise ValueError("Error running script: break outside a loop")
+        except ValueError:
+            raise
+        except Exception as e:
+            raise ValueError(f"Error running script: {e!r}")
+        return None
+
+    return script
+
+
+def script_reply(val):
+    """map script return values onto replies the way redis converts lua values"""
+    match val:
+        case bool():
+            return 1 if val else None
+        case float():
+            return int(val)
+        case list() | tuple():
+            return [script_reply(v) for v in val]
+        case _:
+            return val
+
+
+class ErrorType(Enum):
+    Command = "command"
+    InvalidData = "invalid_data"
+    WrongType = "wrong_type_operation"
+
+
+class Base:
+    def __init__(self, **kwargs):
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+        super().__init__()
+
+    @property
+    def _margs(self):
+        args = ",".join(
+            [
+                f"{k}={v!r}"
+                for k, v in vars(self).items()  # self.kwargs.items()
+                if not (k.startswith("_"))
+            ]
+        )
+        return args
+
+    def __repr__(self):
+        cons = f"{type(self).__name__}({self._margs})"
+        return cons
+
+    def __eq__(self, o):
+        if not isinstance(o, type(self)):
+            raise NotImplementedError()
+
+        ok = True
+        for k, v in vars(self).items():
+            if not hasattr(self, k):
+                continue
+
+            ok = ok and (getattr(o, k) == v)
+
+        return ok
+
+    def __hash__(self):
+        args = self._margs
+        return hash(args)
+
+
+class Error(Base):
+    def __init__(self, msg: str, **kwargs):
+        self.msg = msg
+        super().__init__(msg=msg, **kwargs)
+
+    def ser(self):
+        return f"-ERR {self.msg}\r\n"
+
+    def __str__(self):
+        return self.msg
+
+
+class BulkError(Error):
+    def __init__(self, sz: int, msg: str, **kwargs):
+        self.sz = sz
+        self.msg = msg
+        super().__init__(msg=msg, **kwargs)
+
+    def ser(self):
+        return f"!{self.sz}\r\n-Err: {self.msg}\r\n"
+
+    def __str__(self):
+        return self.msg
+
+
+class BulkString(str):
+    def __new__(cls, sz: int, data: str):
+        # ref - https://stackoverflow.com/questions/7255655/how-to-subclass-str-in-python
+        cls.sz = sz
+        return super().__new__(cls, data)
+
+    def __init__(self, sz: int, data: str):
+        self.sz = sz
+        self.data = data
+
+    def __str__(self):
+        return self.data
+
+    def ser(self):
+        return f"${self.sz}\r\n{self.data}\r\n"
+
+    def __repr__(self):
+        return f"{type(self).__name__}(sz={self.sz},data={self.data})"
+
+
+# the wire and the AOF are utf-8, bytes that are not (e.g. bitmaps) travel as
+# lone surrogates so every value round trips with its exact byte length
+WIRE_ERRORS = "surrogateescape"
+
+
+def bulk_string(val: str) -> BulkString:
+    """RESP sizes count bytes, so the length is taken from the utf-8 encoding"""
+    return BulkString(len(val.encode("utf-8", WIRE_ERRORS)), val)
+
+
+class Push(list):
+    """RESP3 out of band message, e.g. client tracking invalidations"""
+
+    def __repr__(self):
+        return f"{type(self).__name__}({list(self)!r})"
+
+
+def skip(f, free):
+    if free:
+        f.read(free)
+
+
+def to_datetime(usecs_since_epoch: int) -> datetime:
+    seconds_since_epoch = usecs_since_epoch // int(1e6)
+    seconds_since_epoch = min(seconds_since_epoch, 221925052800)
+    useconds = usecs_since_epoch % int(1e6)
+    dt = datetime.utcfromtimestamp(seconds_since_epoch)
+    delta = timedelta(microseconds=useconds)
+    return dt + delta
+
+
+def read_char(f):
+    return struct.unpack("b", f.read(1))[0]
+
+
+def read_uchar(f):
+    return struct.unpack("B", f.read(1))[0]
+
+
+def read_short(f):
+    return struct.unpack("h", f.read(2))[0]
+
+
+def read_ushort(f):
+    return struct.unpack("H", f.read(2))[0]
+
+
+def read_int(f):
+    return struct.unpack("i", f.read(4))[0]
+
+
+def read_uint(f):
+    return struct.unpack("I", f.read(4))[0]
+
+
+def read_uint_be(f):
+    return struct.unpack(">I", f.read(4))[0]
+
+
+def read_24bit_signed_number(f):
+    s = b"0" + f.read(3)
+    num = struct.unpack("i", s)[0]
+    return num >> 8
+
+
+def read_long(f):
+    return struct.unpack("q", f.read(8))[0]
+
+
+def read_ulong(f):
+    return struct.unpack("Q", f.read(8))[0]
+
+
+def read_ms_time(f):
+    return to_datetime(read_ulong(f) * 1000)
+
+
+def read_ulong_be(f):
+    return struct.unpack(">Q", f.read(8))[0]
+
+
+def read_binary_double(f):
+    return struct.unpack("d", f.read(8))[0]
+
+
+def read_binary_float(f):
+    return struct.unpack("f", f.read(4))[0]
+
+
+def string_as_hexcode(string):
+    for s in string:
+        if isinstance(s, int):
+            logger.debug(hex(s))
+        else:
+            logger.debug(hex(ord(s)))
+
+
+def clamp_range(start: int, end: int, size: int) -> tuple[int, int]:
+    """resolve redis style inclusive indices (negatives count from the end)"""
+    if start < 0:
+        start = max(size + start, 0)
+    if end < 0:
+        end = size + end
+    end = min(end, size - 1)
+    return start, end
+
+
+def set_inter(sets: list[set], limit: int = 0) -> set:
+    """
+    Intersect `sets` starting from the smallest one so the work is bounded by
+    the smallest cardinality; stops as soon as the result can only be empty.
+    With a `limit`, members are probed one at a time and the scan stops once
+    `limit` members are found.
+    """
+    if not sets:
+        return set()
+
+    ordered = sorted(sets, key=len)
+    smallest, rest = ordered[0], ordered[1:]
+    if not smallest:
+        return set()
+
+    if limit:
+        rv = set()
+        for member in smallest:
+            if all(member in s for s in rest):
+                rv.add(member)
+                if len(rv) >= limit:
+                    break
+        return rv
+
+    rv = set(smallest)
+    for s in rest:
+        # set & set iterates the smaller operand, which `rv` always is
+        rv &= s
+        if not rv:
+            break
+
+    return rv
+
+
+def set_union(sets: list[set]) -> set:
+    non_empty = [s for s in sets if s]
+    if not non_empty:
+        return set()
+
+    largest = max(non_empty, key=len)
+    return largest.union(*(s for s in non_empty if s is not largest))
+
+
+def set_diff(sets: list[set]) -> set:
+    if not sets or not sets[0]:
+        return set()
+
+    first, rest = sets[0], [s for s in sets[1:] if s]
+    if not rest:
+        return set(first)
+
+    return first.difference(*rest)
+
+
+BITMAP_MAX_BITS = 1 << 32
+BITOPS = {
+    "AND": operator.and_,
+    "OR": operator.or_,
+    "XOR": operator.xor,
+    "NOT": operator.invert,
+}
+
+
+class CountMinSketch:
+    """
+    approximate per key counters in depth x width cells. estimates never
+    undercount, collisions can only inflate them
+    """
+
+    def __init__(self, width=1024, depth=4):
+        self.width = width
+        self.depth = depth
+        self.rows = [array("L", bytes(8 * width)) for _ in range(depth)]
+
+    def _cells(self, key) -> list[int]:
+        # double hashing, each row probes a different cell of the same hash
+        h = hash(key)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, key, n=1) -> int:
+        est = None
+        for row, cell in zip(self.rows, self._cells(key)):
+            row[cell] += n
+            est = row[cell] if est is None else min(est, row[cell])
+        return est  # type: ignore
+
+    def estimate(self, key) -> int:
+        return min(row[cell] for row, cell in zip(self.rows, self._cells(key)))
+
+    def halve(self):
+        for i, row in enumerate(self.rows):
+            self.rows[i] = array("L", (x >> 1 for x in row))
+
+
+class HotKeys:
+    """
+    count-min sketch over every key access plus a min-heap of the k keys with
+    the highest estimates. counts are halved every `decay` accesses so the
+    ranking follows current traffic instead of all time totals
+    """
+
+    def __init__(self, k=32, width=1024, depth=4, decay=1 << 20):
+        self.k = k
+        self.decay = decay
+        self.sketch = CountMinSketch(width, depth)
+        self.top: dict[str, int] = {}
+        # (count, key), entries go stale as counts grow and are fixed up lazily
+        self.heap: list[tuple[int, str]] = []
+        self.accesses = 0
+        self._lock = Lock()
+
+    def record(self, keys: list):
+        # commands on different stripes record concurrently, the sketch, the
+        # heap and the counters are only touched with the lock held
+        with self._lock:
+            for key in keys:
+                est = self.sketch.add(key)
+                if key in self.top:
+                    self.top[key] = est
+                elif len(self.top) < self.k or (self.heap and est > self.heap[0][0]):
+                    self._admit(key, est)
+
+            self.accesses += len(keys)
+            if self.accesses >= self.decay:
+                self._age()
+
+    def _admit(self, key: str, est: int):
+        heap, top = self.heap, self.top
+        while len(top) >= self.k:
+            count_, victim = heap[0]
+            current = top.get(victim)
+            if current is None:
+                heapq.heappop(heap)
+                continue
+            if current != count_:
+                # stale entry, requeue the key with its current count
+                heapq.heapreplace(heap, (current, victim))
+                continue
+            if count_ >= est:
+                return
+            heapq.heappop(heap)
+            del top[victim]
+
+        top[key] = est
+        heapq.heappush(heap, (est, key))
+
+    def _age(self):
+        self.accesses = 0
+        self.sketch.halve()
+        self.top = {key: count_ >> 1 for key, count_ in self.top.items()}
+        self.heap = [(count_, key) for key, count_ in self.top.items()]
+        heapq.heapify(self.heap)
+
+    def most_common(self, n=10) -> list[tuple[str, int]]:
+        with self._lock:
+            items = sorted(self.top.items(), key=lambda kv: (-kv[1], kv[0]))
+        return items[:n]
+
+
+class ShardedDict(MutableMapping):
+    """
+    a dict split into `n` shards by key hash. Redis.locked stripes its locks
+    the same way, so a key's shard is only mutated under that key's lock
+    """
+
+    def __init__(self, n: int = 16):
+        self.n = n
+        self.shards: list[dict] = [{} for _ in range(n)]
+
+    def shard(self, key) -> dict:
+        return self.shards[hash(key) % self.n]
+
+    def __getitem__(self, key):
+        return self.shards[hash(key) % self.n][key]
+
+    def __setitem__(self, key, val):
+        self.shards[hash(key) % self.n][key] = val
+
+    def __delitem__(self, key):
+        del self.shards[hash(key) % self.n][key]
+
+    def __contains__(self, key):
+        return key in self.shards[hash(key) % self.n]
+
+    def __len__(self):
+        return sum(map(len, self.shards))
+
+    def __iter__(self):
+        # snapshots, other shards may change while a caller walks the keyspace
+        for shard in self.shards:
+            yield from list(shard)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
+    def get(self, key, default=None):
+        return self.shards[hash(key) % self.n].get(key, default)
+
+    def pop(self, key, *default):
+        return self.shards[hash(key) % self.n].pop(key, *default)
+
+    def clear(self):
+        for shard in self.shards:
+            shard.clear()
+
+
+class Keyspace:
+    """one logical database: values, expiry times and WATCH versions"""
+
+    epochs = count(1)
+
+    def __init__(self, shards: int = 16):
+        self.store = ShardedDict(shards)
+        self.ts = ShardedDict(shards)
+        # bumped on every write, WATCH compares them at EXEC time
+        self.versions: ShardedDict = ShardedDict(shards)
+        # replaced when the whole db changes (FLUSHDB, SWAPDB), so every WATCH fails
+        self.epoch = next(self.epochs)
+
+    def flush(self):
+        self.store.clear()
+        self.ts.clear()
+        self.versions.clear()
+        self.epoch = next(self.epochs)
+
+
+class Selected(local):
+    """the db each thread's commands run against, see Redis.select"""
+
+    db = 0
+
+
+class Outbox(local):
+    """invalidations raised while a thread holds lock stripes, see Redis.locked"""
+
+    def __init__(self):
+        self.depth = 0
+        self.pushes: list[tuple] = []
+
+
+class Redis:
+    config = {}
+
+    def __init__(self):
+        shards = self._config_int("keyspace-shards")
+        self.dbs = [Keyspace(shards) for _ in range(self._config_int("databases"))]
+        self._selected = Selected()
+        # one lock per keyspace shard (in every db), see locked
+        self.locks = [RLock() for _ in range(shards)]
+        self._aof_lock = Lock()
+        self._rewrite_due = False
+        # sha1 -> compiled script, filled by EVAL and SCRIPT LOAD
+        self.scripts = {}
+        # sha1 -> source, an EVALSHA is logged as the EVAL it stands for
+        self.script_sources: dict[str, str] = {}
+        # CLIENT TRACKING: key -> sessions that read it, prefix -> BCAST sessions
+        self.tracking: dict[str, set] = {}
+        self.bcast: dict[str, set] = {}
+        self._tracking_lock = Lock()
+        self._outbox = Outbox()
+        # fed with the keys of every dispatched command, see HOTKEYS
+        self.hotkeys = HotKeys()
+        self._started = time.time()
+        # AOF size after the last rewrite (or load), auto rewrite grows from it
+        self._aof_base_size = 0
+        # db a replay of the AOF ends up in, appends for other dbs get a SELECT first
+        self._aof_db = 0
+
+    @property
+    def db(self) -> int:
+        return self._selected.db
+
+    @contextmanager
+    def locked(self, keys: list | None = None):
+        """
+        holds the lock stripes of `keys`, or every stripe for None. stripes are
+        always taken in index order so multi-key commands can not deadlock
+        """
+        if keys is None:
+            locks = self.locks
+        else:
+            n = len(self.locks)
+            locks = [self.locks[i] for i in sorted({hash(key) % n for key in keys})]
+
+        for lock in locks:
+            lock.acquire()
+        outbox = self._outbox
+        outbox.depth += 1
+        try:
+            yield
+        finally:
+            outbox.depth -= 1
+            for lock in reversed(locks):
+                lock.release()
+            # pushes block on slow clients, they only go out once every stripe is free
+            if not outbox.depth and outbox.pushes:
+                pushes, outbox.pushes = outbox.pushes, []
+                for session, push in pushes:
+                    session.push(push)
+
+    @property
+    def store(self) -> dict:
+        return self.dbs[self._selected.db].store
+
+    @property
+    def _ts(self) -> dict:
+        return self.dbs[self._selected.db].ts
+
+    def select(self, index) -> str:
+        """switch the calling thread's db, other clients keep their own"""
+        self._selected.db = self._db_index(index)
+        return "OK"
+
+    def _db_index(self, index) -> int:
+        index = int(index)
+        if not 0 <= index < len(self.dbs):
+            raise ValueError("DB index is out of range")
+        return index
+
+    def swapdb(self, a, b) -> str:
+        a, b = self._db_index(a), self._db_index(b)
+        # clients see the other dataset on their next command, no keys are copied
+        self.dbs[a], self.dbs[b] = self.dbs[b], self.dbs[a]
+        for keyspace in (self.dbs[a], self.dbs[b]):
+            keyspace.epoch = next(Keyspace.epochs)
+        self._invalidate_all()
+        return "OK"
+
+    def flushdb(self, *_) -> str:
+        self.dbs[self.db].flush()
+        self._invalidate_all()
+        return "OK"
+
+    def flushall(self, *_) -> str:
+        for keyspace in self.dbs:
+            keyspace.flush()
+        self._invalidate_all()
+        return "OK"
+
+    def dbsize(self) -> int:
+        return len(self.store)
+
+    def move(self, key: str, db) -> int:
+        target = self.dbs[self._db_index(db)]
+        if target is self.dbs[self.db]:
+            raise ValueError("source and destination objects are the same")
+
+        val = self._get(key)
+        expiry = target.ts.get(key)
+        if val is None or (
+            key in target.store and not (expiry and expiry <= datetime.now())
+        ):
+            return 0
+
+        target.store[key] = self.store.pop(key)
+        target.ts.pop(key, None)
+        if key in self._ts:
+            target.ts[key] = self._ts.pop(key)
+        target.versions[key] = target.versions.get(key, 0) + 1
+        return 1
+
+    def hottest(self, *args) -> list:
+        """HOTKEYS [COUNT n]: flat key, estimated accesses pairs, hottest first"""
+        n = 10
+        match [str(x).upper() for x in args]:
+            case []:
+                pass
+            case ["COUNT", _]:
+                n = int(args[1])
+            case _:
+                raise ValueError("syntax error")
+
+        return [x for kv in self.hotkeys.most_common(n) for x in kv]
+
+    def info(self, section: str | None = None) -> str:
+        now = time.time()
+        sections = {
+            "server": {
+                "redis_version": "7.2.0",
+                "process_id": os.getpid(),
+                "uptime_in_seconds": int(now - self._started),
+                "io_threads_active": int(bool(self.config.get("io-threads"))),
+            },
+            "keyspace": {
+                f"db{i}": f"keys={len(ks.store)},expires={len(ks.ts)}"
+                for i, ks in enumerate(self.dbs)
+                if ks.store
+            },
+            "hotkeys": {
+                "hotkeys_sketch": f"width={self.hotkeys.sketch.width},depth={self.hotkeys.sketch.depth}",
+                "hotkeys_accesses": self.hotkeys.accesses,
+                **{
+                    f"hotkey_{i}": f"key={key},count={count_}"
+                    for i, (key, count_) in enumerate(self.hotkeys.most_common(10))
+                },
+            },
+        }
+        wanted = str(section or "all").lower()
+        if wanted not in ("all", "everything", "default"):
+            sections = {k: v for k, v in sections.items() if k == wanted}
+
+        return "\r\n".join(
+            f"# {name.capitalize()}\r\n"
+            + "".join(f"{k}:{v}\r\n" for k, v in fields.items())
+            for name, fields in sections.items()
+        )
+
+    def touch(self, keys: list):
+        versions = self.dbs[self.db].versions
+        for key in keys:
+            versions[key] = versions.get(key, 0) + 1
+
+        if self.tracking or self.bcast:
+            self._invalidate(keys)
+
+    def track(self, keys: list, session: "Session"):
+        with self._tracking_lock:
+            for key in keys:
+                self.tracking.setdefault(key, set()).add(session)
+
+    def untrack(self, session: "Session"):
+        with self._tracking_lock:
+            for table in (self.tracking, self.bcast):
+                for key in list(table):
+                    table[key].discard(session)
+                    if not table[key]:
+                        del table[key]
+
+    def _invalidate(self, keys: list):
+        targets: dict = {}
+        with self._tracking_lock:
+            for key in keys:
+                # default mode tracking is one shot, the client has to read again
+                for session in self.tracking.pop(key, ()):
+                    targets.setdefault(session, []).append(key)
+                for prefix, sessions in self.bcast.items():
+                    if str(key).startswith(prefix):
+                        for session in sessions:
+                            targets.setdefault(session, []).append(key)
+
+        pushes = [
+            (session, Push(["invalidate", list(dict.fromkeys(keys_))]))
+            for session, keys_ in targets.items()
+        ]
+        self._send_pushes(pushes)
+
+    def _invalidate_all(self):
+        """a null invalidation tells every tracking client to drop its whole cache"""
+        with self._tracking_lock:
+            sessions = set().union(*self.tracking.values(), *self.bcast.values())
+            self.tracking.clear()
+
+        self._send_pushes(
+            [(session, Push(["invalidate", None])) for session in sessions]
+        )
+
+    def _send_pushes(self, pushes: list[tuple]):
+        if self._outbox.depth:
+            self._outbox.pushes.extend(pushes)
+            return
+
+        for session, push in pushes:
+            session.push(push)
+
+    def version(self, key: str, db: int | None = None) -> tuple[int, int]:
+        keyspace = self.dbs[self.db if db is None else db]
+        return keyspace.epoch, keyspace.versions.get(key, 0)
+
+    def handle_config(self, subcmd: str, *args):
+        assert subcmd, f"Invalid sub command to CONFIG: {subcmd!r} with {args=}"
+        match subcmd.upper():
+            case "GET":
+                key = args[0]
+                val = self.config.get(args[0], CONFIG_DEFAULTS.get(key))
+                return [key, val]
+            case "RESETSTAT":
+                raise NotImplementedError(f"{subcmd!r} not implemented")
+            case "REWRITE":
+                raise NotImplementedError(f"{subcmd!r} not implemented")
+            case "SET":
+                for key, val in zip(args[::2], args[1::2]):
+                    self.config[key] = val
+                return "OK"
+            case _:
+                raise NotImplementedError(f"{subcmd!r} not implemented")
+
+    def _config_int(self, name: str) -> int:
+        return int(self.config.get(name, CONFIG_DEFAULTS[name]))
+
+    def keys(self, item: str, *args):
+        match item:
+            case "*":
+                keys = list(self.store.keys())
+                rem = filter(lambda x: self.get(x) is not None, keys)
+                return list(rem)
+            case _:
+                raise NotImplementedError("Not handling case: {item!r}")
+
+    def entry_type(self, key: str):
+        match self.store.get(key):
+            case str() | int() | bytearray():
+                return "string"
+            case list() | deque():
+                return "list"
+            case set() | IntSet() | ListPackSet():
+                return "set"
+            case dict() | ListPack():
+                return "hash"
+            case Trie():
+                return "stream"
+            case None:
+                return "none"
+            case x:
+                raise NotImplementedError("[entry_type]", f"{x!r} not yet parsed")
+
+    def set(self, key, val, expiry: int | datetime | None = None) -> str:
+        if isinstance(val, str) and is_int_member(val):
+            # int encoded strings, GET renders them back to the same text
+            val = int(val)
+
+        self.store[key] = val
+        if isinstance(expiry, int):
+            now = time.time_ns() // 1000
+            expiry = now + expiry
+            expiry = to_datetime(expiry)
+
+        if isinstance(expiry, datetime):
+            self._ts[key] = expiry
+            curr = datetime.now()
+            if expiry < curr:
+                logger.warning(
+                    f"Not setting {key=}, {val=} since its expiry {expiry} <= {curr=}"
+                )
+                del self.store[key]
+                del self._ts[key]
+
+        return "OK"
+
+    def pexpireat(self, key: str, when_ms: int) -> int:
+        """expires `key` at a unix time in ms, 0 if there is no such key"""
+        if self._get(key) is None:
+            return 0
+
+        self._ts[key] = to_datetime(when_ms * 1000)
+        self._get(key)  # drops it right away if that time has passed
+        return 1
+
+    def _get(self, key: str):
+        ts = self._ts.get(key)
+        # TODO: handle passive removal of keys
+        if ts and ts <= datetime.now():
+            del self._ts[key]
+            del self.store[key]
+            return None
+
+        return self.store.get(key)
+
+    def _bulk(self, item) -> BulkString | None:
+        match item:
+            case None:
+                return None
+            case bytearray():
+                # the reverse of the promotion in _bitmap, text reads back unchanged
+                item = item.decode("utf-8", WIRE_ERRORS)
+
+        item = str(item)
+        return bulk_string(item)
+
+    def get(self, key: str) -> BulkString | None:
+        return self._bulk(self._get(key))
+
+    def mget(self, keys: list) -> list:
+        rv = []
+        for key in keys:
+            item = self._get(key)
+            # keys holding lists, hashes, ... read as nil instead of failing
+            if not isinstance(item, (str, int, bytearray)):
+                item = None
+            rv.append(self._bulk(item))
+
+        return rv
+
+    def mset(self, vals: list) -> str:
+        assert len(vals) % 2 == 0, "wrong number of arguments for MSET"
+        for key, val in zip(vals[::2], vals[1::2]):
+            self._ts.pop(key, None)
+            self.set(key, val)
+
+        return "OK"
+
+    def msetnx(self, vals: list) -> int:
+        if self.exists(vals[::2]):
+            return 0
+
+        self.mset(vals)
+        return 1
+
+    def exists(self, keys: list) -> int:
+        return sum(self._get(key) is not None for key in keys)
+
+    def del_keys(self, keys: list) -> int:
+        rv = 0
+        for key in keys:
+            if self.store.pop(key, None) is not None:
+                rv += 1
+            self._ts.pop(key, None)
+
+        return rv
+
+    def incrby(self, key: str, by: int) -> int | None:
+        match self._get(key):
+            case None:
+                val = 0
+            case int() as val:
+                pass
+            case str() as val if is_int_member(val):
+                val = int(val)
+            case _:
+                return None
+
+        val += by
+        if not INT64_MIN <= val <= INT64_MAX:
+            raise ValueError("increment or decrement would overflow")
+
+        self.store[key] = val
+        return val
+
+    def incr(self, key: str) -> int | None:
+        return self.incrby(key, 1)
+
+    def decr(self, key: str) -> int | None:
+        return self.incrby(key, -1)
+
+    def incrbyfloat(self, key: str, by: float) -> BulkString | None:
+        match self._get(key):
+            case None:
+                val = 0.0
+            case int() | str() as val:
+                try:
+                    val = float(val)
+                except ValueError:
+                    return None
+            case _:
+                return None
+
+        val += by
+        if math.isnan(val) or math.isinf(val):
+            raise ValueError("increment would produce NaN or Infinity")
+
+        text = str(int(val)) if val.is_integer() and abs(val) < 1e17 else repr(val)
+        self.set(key, text)
+        return bulk_string(text)
+
+    def _bitmap(self, key: str, create=False) -> bytearray | None:
+        item = self._get(key)
+        if item is None:
+            if not create:
+                return bytearray()
+            item = bytearray()
+            self.store[key] = item
+
+        if isinstance(item, (str, int)):
+            # promote plain strings in place so subsequent bit ops are binary-safe
+            item = bytearray(str(item).encode("utf-8", WIRE_ERRORS))
+            self.store[key] = item
+
+        if not isinstance(item, bytearray):
+            return None
+
+        return item
+
+    def setbit(self, key: str, offset: int, bit: int) -> int | None:
+        if not 0 <= offset < BITMAP_MAX_BITS:
+            raise ValueError("bit offset is not an integer or out of range")
+        if bit not in (0, 1):
+            raise ValueError("bit is not an integer or out of range")
+
+        bitmap = self._bitmap(key, create=True)
+        if bitmap is None:
+            return None
+
+        byte, shift = divmod(offset, 8)
+        mask = 0x80 >> shift
+        if byte >= len(bitmap):
+            bitmap.extend(bytes(byte + 1 - len(bitmap)))
+
+        old = int(bool(bitmap[byte] & mask))
+        if bit:
+            bitmap[byte] |= mask
+        else:
+            bitmap[byte] &= ~mask & 0xFF
+
+        return old
+
+    def getbit(self, key: str, offset: int) -> int | None:
+        if not 0 <= offset < BITMAP_MAX_BITS:
+            raise ValueError("bit offset is not an integer or out of range")
+
+        bitmap = self._bitmap(key)
+        if bitmap is None:
+            return None
+
+        byte, shift = divmod(offset, 8)
+        if byte >= len(bitmap):
+            return 0
+
+        return int(bool(bitmap[byte] & (0x80 >> shift)))
+
+    def bitcount(
+        self, key: str, start: int | None = None, end: int | None = None, unit="BYTE"
+    ) -> int | None:
+        bitmap = self._bitmap(key)
+        if bitmap is None:
+            return None
+
+        if start is None or end is None:
+            return int.from_bytes(bitmap, "big").bit_count()
+
+        if unit.upper() == "BIT":
+            low, high = clamp_range(start, end, len(bitmap) * 8)
+            if low > high:
+                return 0
+            chunk = int.from_bytes(bitmap[low // 8 : high // 8 + 1], "big")
+            # drop the bits before `low` and after `high` inside the edge bytes
+            nbits = (high // 8 - low // 8 + 1) * 8
+            chunk >>= 7 - high % 8
+            chunk &= (1 << (nbits - low % 8 - (7 - high % 8))) - 1
+            return chunk.bit_count()
+
+        low, high = clamp_range(start, end, len(bitmap))
+        if low > high:
+            return 0
+
+        return int.from_bytes(bitmap[low : high + 1], "big").bit_count()
+
+    def bitop(self, op: str, dest: str, keys: list[str]) -> int | None:
+        op = op.upper()
+        if op not in BITOPS:
+            raise ValueError(f"syntax error, unknown BITOP {op!r}")
+        if op == "NOT" and len(keys) != 1:
+            raise ValueError("BITOP NOT must be called with a single source key.")
+
+        bitmaps = []
+        for key in keys:
+            bitmap = self._bitmap(key)
+            if bitmap is None:
+                return None
+            bitmaps.append(bitmap)
+
+        size = max(map(len, bitmaps), default=0)
+        if not size:
+            self.store.pop(dest, None)
+            self._ts.pop(dest, None)
+            return 0
+
+        # python ints act as arbitrarily wide machine words, so each operand
+        # is combined in a single pass instead of byte by byte
+        words = [int.from_bytes(b.ljust(size, b"\x00"), "big") for b in bitmaps]
+        if op == "NOT":
+            result = ~words[0] & ((1 << (size * 8)) - 1)
+        else:
+            result = reduce(BITOPS[op], words)
+
+        self.store[dest] = bytearray(result.to_bytes(size, "big"))
+        self._ts.pop(dest, None)
+        return size
+
+    def bitpos(
+        self, key: str, bit: int, start: int | None = None, end: int | None = None
+    ) -> int | None:
+        if bit not in (0, 1):
+            raise ValueError("The bit argument must be 1 or 0.")
+
+        bitmap = self._bitmap(key)
+        if bitmap is None:
+            return None
+
+        if not bitmap:
+            return -1 if bit else 0
+
+        has_end = end is not None
+        low, high = clamp_range(start or 0, end if has_end else -1, len(bitmap))
+        if low > high:
+            return -1
+
+        skip = 0x00 if bit else 0xFF
+        for idx in range(low, high + 1):
+            byte = bitmap[idx]
+            if byte == skip:
+                continue
+
+            if not bit:
+                byte = ~byte & 0xFF
+            return idx * 8 + (8 - byte.bit_length())
+
+        # looking for a clear bit past the end of the string finds the zero padding
+        if not bit and not has_end:
+            return (high + 1) * 8
+
+        return -1
+
+    def object_encoding(self, key: str) -> str | None:
+        match self._get(key):
+            case None:
+                return None
+            case int():
+                return "int"
+            case str() as val if is_int_member(val):
+                return "int"
+            case str() as val:
+                return "embstr" if len(val) <= 44 else "raw"
+            case bytearray():
+                return "raw"
+            case list() | ListPackSet() | ListPack():
+                return "listpack"
+            case deque():
+                return "quicklist"
+            case IntSet():
+                return "intset"
+            case set() | dict():
+                return "hashtable"
+            case Trie():
+                return "stream"
+            case x:
+                raise NotImplementedError("[object_encoding]", f"{x!r} not yet parsed")
+
+    def _fit_list(self, item: list | deque, n: int) -> list | deque:
+        if isinstance(item, list) and len(item) + n > self._config_int(
+            "list-max-listpack-size"
+        ):
+            return deque(item)
+
+        return item
+
+    def _fit_hash(self, m: dict | ListPack, vals: list) -> dict | ListPack:
+        if not isinstance(m, ListPack):
+            return m
+
+        max_value = self._config_int("hash-max-listpack-value")
+        # fields that are already there only change their value
+        size = len(m) + len({f for f in vals[::2] if f not in m})
+        fits = size <= self._config_int("hash-max-listpack-entries")
+        if fits and all(len(str(v)) <= max_value for v in vals):
+            return m
+
+        return dict(m.items())
+
+    def _fit_set(self, s: "set | IntSet | ListPackSet", vals: list):
+        size = len(s) + len({v for v in vals if v not in s})
+        if isinstance(s, IntSet):
+            max_entries = self._config_int("set-max-intset-entries")
+            if size <= max_entries and all(map(is_int_member, vals)):
+                return s
+            s = ListPackSet(s)
+
+        if isinstance(s, ListPackSet):
+            max_value = self._config_int("set-max-listpack-value")
+            fits = size <= self._config_int("set-max-listpack-entries")
+            if fits and all(len(str(v)) <= max_value for v in vals):
+                return s
+            s = set(s)
+
+        return s
+
+    def _encode_set(self, members: set) -> "set | IntSet | ListPackSet":
+        encoded = self._fit_set(IntSet(), list(members))
+        if isinstance(encoded, set):
+            return members
+
+        for member in members:
+            encoded.add(member)
+        return encoded
+
+    # https://web.archive.org/web/20201108091210/http://effbot.org/pyfaq/what-kinds-of-global-value-mutation-are-thread-safe.htm
+    def lpush(self, key: str, vals: list) -> int | None:
+        item = self._get(key)  # type: ignore
+        if item is None:
+            self.set(key, [])
+
+        if not isinstance(self._get(key), LIST_TYPES):
+            return None
+
+        item = self.store[key] = self._fit_list(self._get(key), len(vals))  # type: ignore
+        if isinstance(item, deque):
+            item.extendleft(vals)
+        else:
+            item[0:0] = vals[::-1]
+        return len(item)
+
+    def rpush(self, key: str, vals: list) -> int | None:
+        item = self._get(key)  # type: ignore
+        if item is None:
+            self.set(key, [])
+
+        if not isinstance(self._get(key), LIST_TYPES):
+            return None
+
+        item = self.store[key] = self._fit_list(self._get(key), len(vals))  # type: ignore
+        item.extend(vals)
+        return len(item)
+
+    def llen(self, key: str) -> int | None:
+        if self._get(key) is None:
+            self.set(key, [])
+
+        if not isinstance(self._get(key), LIST_TYPES):
+            return None
+
+        return len(self._get(key))  # type: ignore
+
+    def lrange(self, key: str, low: int, high: int) -> list | None:
+        if self._get(key) is None:
+            self.set(key, [])
+
+        item = self._get(key)
+        if not isinstance(item, LIST_TYPES):
+            return None
+
+        if isinstance(item, deque):
+            low, high = clamp_range(low, high, len(item))
+            return list(islice(item, low, high + 1)) if low <= high else []
+
+        if high == -1:
+            return item[low:]
+
+        return item[low : high + 1]
+
+    def hset(self, key: str, vals: list) -> int | None:
+        if self._get(key) is None:
+            self.set(key, ListPack())
+
+        if not isinstance(self._get(key), HASH_TYPES):
+            return None
+
+        m = self.store[key] = self._fit_hash(self._get(key), vals)  # type: ignore
+        for name, val in zip(vals[::2], vals[1::2]):
+            m[name] = val
+
+        return len(m)
+
+    def hmset(self, key: str, vals: list) -> str | None:
+        if self.hset(key, vals) is None:
+            return None
+
+        return "OK"
+
+    def hget(self, key: str, mkey: str):
+        stored = self._get(key) or {}
+        return stored.get(mkey)
+
+    def hmget(self, key: str, mkeys: list):
+        stored = self._get(key) or {}
+        rv = [stored.get(k) for k in mkeys]
+        return rv
+
+    def hgetall(self, key: str) -> list:
+        stored = self._get(key) or {}
+        rv = []
+        for k, v in stored.items():
+            rv.append(k)
+            rv.append(v)
+
+        return rv
+
+    def hincrby(self, key: str, mkey: str, by: int) -> int:
+        stored = self._get(key) or {}
+        stored[mkey] = stored.get(mkey, 0) + by
+
+        return stored[mkey]
+
+    def sadd(self, key: str, vals: list) -> int | None:
+        if self._get(key) is None:
+            self.set(key, IntSet())
+
+        if not isinstance(self._get(key), SET_TYPES):
+            return None
+
+        s = self.store[key] = self._fit_set(self._get(key), vals)  # type: ignore
+        n = 0
+        for val in vals:
+            n += int(val not in s)
+            s.add(val)
+
+        return n
+
+    def srem(self, key: str, vals: list) -> int | None:
+        if self._get(key) is None:
+            self.set(key, IntSet())
+
+        if not isinstance(self._get(key), SET_TYPES):
+            return None
+
+        s: set = self._get(key)  # type: ignore
+        logger.debug(f"Set: {s!r}")
+        n = 0
+        for val in vals:
+            if val not in s:
+                continue
+
+            n += 1
+            s.remove(val)
+
+        return n
+
+    def sismember(self, key: str, val: str) -> int | None:
+        if self._get(key) is None:
+            self.set(key, IntSet())
+
+        if not isinstance(self._get(key), SET_TYPES):
+            return None
+
+        s: set = self._get(key)  # type: ignore
+        return int(val in s)
+
+    def _sets(self, keys: list[str]) -> list[set] | None:
+        rv = []
+        for key in keys:
+            item = self._get(key)
+            if item is None:
+                item = set()
+            if not isinstance(item, SET_TYPES):
+                return None
+            # compact encodings are small, a throwaway copy keeps the algebra on sets
+            rv.append(item if isinstance(item, set) else set(item))
+
+        return rv
+
+    def _store_set(self, dest: str, result: set) -> int:
+        self._ts.pop(dest, None)
+        if not result:
+            self.store.pop(dest, None)
+            return 0
+
+        self.store[dest] = self._encode_set(result)
+        return len(result)
+
+    def sinter(self, s1: str, sets: list[str]) -> list | None:
+        operands = self._sets([s1, *sets])
+        if operands is None:
+            return None
+
+        return list(set_inter(operands))
+
+    def sintercard(self, keys: list[str], limit: int = 0) -> int | None:
+        operands = self._sets(keys)
+        if operands is None:
+            return None
+
+        return len(set_inter(operands, limit))
+
+    def sunion(self, keys: list[str]) -> list | None:
+        operands = self._sets(keys)
+        if operands is None:
+            return None
+
+        return list(set_union(operands))
+
+    def sdiff(self, keys: list[str]) -> list | None:
+        operands = self._sets(keys)
+        if operands is None:
+            return None
+
+        return list(set_diff(operands))
+
+    def sinterstore(self, dest: str, keys: list[str]) -> int | None:
+        operands = self._sets(keys)
+        if operands is None:
+            return None
+
+        return self._store_set(dest, set_inter(operands))
+
+    def sunionstore(self, dest: str, keys: list[str]) -> int | None:
+        operands = self._sets(keys)
+        if operands is None:
+            return None
+
+        return self._store_set(dest, set_union(operands))
+
+    def sdiffstore(self, dest: str, keys: list[str]) -> int | None:
+        operands = self._sets(keys)
+        if operands is None:
+            return None
+
+        return self._store_set(dest, set_diff(operands))
+
+    def scard(self, key: str) -> int | None:
+        if self._get(key) is None:
+            self.set(key, IntSet())
+
+        if not isinstance(self._get(key), SET_TYPES):
+            return None
+
+        s: set = self._get(key)  # type: ignore
+        return len(s)
+
+    def smembers(self, key: str) -> list | None:
+        if self._get(key) is None:
+            self.set(key, IntSet())
+
+        if not isinstance(self._get(key), SET_TYPES):
+            return None
+
+        s: set = self._get(key)  # type: ignore
+        return list(s)
+
+    def xadd(self, key: str, node_key: str, *data, trim: tuple | None = None):
+        assert data, f"Got invalid {data=} to be stored for {key=} and ts={node_key!r}"
+        if key not in self.store:
+            self.store[key] = Trie()
+
+        trie_: Trie = self.store[key]
+        data_ = {k: v for k, v in zip(data[::2], data[1::2])}
+        node_key = trie_.insert(node_key, data_)
+        if trim:
+            trie_.trim(*trim)
+        return node_key
+
+    def xlen(self, key: str) -> int | None:
+        trie = self._get(key)
+        if trie is None:
+            return 0
+
+        if not isinstance(trie, Trie):
+            return None
+
+        return len(trie)
+
+    def xtrim(self, key: str, *trim) -> int | None:
+        trie = self._get(key)
+        if trie is None:
+            return 0
+
+        if not isinstance(trie, Trie):
+            return None
+
+        return trie.trim(*trim)
+
+    def dict_to_list(self, data: dict):
+        rv = []
+        for k, v in data.items():
+            rv.extend([k, v])
+
+        return rv
+
+    def xrange(
+        self, key: str, start: str, end: str, start_xlsv=False, count: int | None = None
+    ):
+        trie: Trie = self.store.get(key)  # type: ignore
+        if trie is None:
+            raise ValueError(f"{key=} is not set currently")
+
+        start_i = parse_stream_id(start, 0)
+        end_i = parse_stream_id(end, MAX_SEQ)
+        return [
+            [key, self.dict_to_list(data)]
+            for key, data in trie.range(start_i, end_i, start_xlsv, count)
+        ]
+
+    def xread(
+        self, count: int | None, block: int | None, *streams
+    ) -> list | Generator[list, None, None] | None:
+        def query(pairs: list[tuple]):
+            rv = []
+            with self.locked([name for name, _ in pairs]):
+                for name, start in pairs:
+                    # consider parsing '$' as the special flag instead of a key inside the trie
+                    got = self.xrange(
+                        name, start, "+", start_xlsv=True, count=count or None
+                    )
+                    if got:
+                        rv.append([name, got])
+
+            return rv or None
+
+        def block_call(pairs: list[tuple]):
+            while True:
+                time.sleep(0.1)
+                got = query(pairs)
+                if got:
+                    yield got
+
+        n = len(streams)
+        assert (
+            n % 2 == 0
+        ), "There should be even number of streams and corresponding Ids"
+        pairs = [
+            (name, start) for name, start in zip(streams[: n // 2], streams[n // 2 :])
+        ]
+        logger.debug(f"xread: {count=} | {block=} | {pairs=}")
+        if block:  # ignore 0 and None
+            logger.debug(f"xread: Blocking for {block!r}")
+            time.sleep(block // int(1e3))  # ms -> sec
+
+        if block == 0:
+            # TODO: handle 0 where the wait should be inf
+            logger.debug(f"xread: Blocking indefinitely")
+            return block_call(pairs)
+
+        got = query(pairs)
+        logger.debug(f"xread: returning response: {got!r}")
+        return got
+
+    def _stream_group(self, key: str, group: str) -> tuple[Trie, ConsumerGroup]:
+        trie = self._get(key)
+        if not isinstance(trie, Trie) or group not in trie.groups:
+            raise ValueError(f"NOGROUP No such key {key!r} or consumer group {group!r}")
+
+        return trie, trie.groups[group]
+
+    def xgroup(self, subcmd: str, key: str, group: str, *args) -> str | int:
+        trie = self._get(key)
+        match subcmd.upper():
+            case "CREATE":
+                mkstream = any(str(x).upper() == "MKSTREAM" for x in args[1:])
+                if trie is None and mkstream:
+                    trie = self.store[key] = Trie()
+                if not isinstance(trie, Trie):
+                    raise ValueError(
+                        "The XGROUP subcommand requires the key to exist."
+                        " Note that for CREATE you may want to use the MKSTREAM option"
+                    )
+                if group in trie.groups:
+                    raise ValueError("BUSYGROUP Consumer Group name already exists")
+
+                start = args[0] if args else "$"
+                last_id = MIN_ID
+                if start == "$":
+                    last_id = MIN_ID if trie.empty else trie.last_key
+                else:
+                    last_id = parse_stream_id(start)
+
+                trie.groups[group] = ConsumerGroup(group, last_id)
+                return "OK"
+            case "SETID":
+                _, cgroup = self._stream_group(key, group)
+                start = args[0]
+                if start == "$":
+                    cgroup.last_id = MIN_ID if trie.empty else trie.last_key  # type: ignore
+                else:
+                    cgroup.last_id = parse_stream_id(start)
+                return "OK"
+            case "DESTROY":
+                if not isinstance(trie, Trie):
+                    raise ValueError(f"NOGROUP No such key {key!r}")
+                return int(trie.groups.pop(group, None) is not None)
+            case "CREATECONSUMER":
+                _, cgroup = self._stream_group(key, group)
+                created = args[0] not in cgroup.consumers
+                cgroup.consumer(args[0])
+                return int(created)
+            case "DELCONSUMER":
+                _, cgroup = self._stream_group(key, group)
+                pending = cgroup.consumers.pop(args[0], None)
+                if pending is None:
+                    return 0
+
+                for id_ in list(pending):
+                    cgroup.pel.remove(id_)
+                return len(pending)
+            case _:
+                raise NotImplementedError(f"XGROUP {subcmd!r} not implemented")
+
+    def xreadgroup(
+        self,
+        group: str,
+        consumer: str,
+        count: int | None,
+        block: int | None,
+        noack: bool,
+        *streams,
+    ) -> list | None:
+        n = len(streams)
+        assert (
+            n % 2 == 0
+        ), "There should be even number of streams and corresponding Ids"
+        pairs = list(zip(streams[: n // 2], streams[n // 2 :]))
+
+        def query():
+            # the group and its pending entries are only touched under the stripes
+            with self.locked([name for name, _ in pairs]):
+                return _query()
+
+        def _query():
+            now = int(time.time() * 1000)
+            rv = []
+            for name, start in pairs:
+                trie, cgroup = self._stream_group(name, group)
+                if start == ">":
+                    got = trie.range(
+                        cgroup.last_id, MAX_ID, start_xlsv=True, count=count or None
+                    )
+                    for key, _ in got:
+                        id_ = parse_stream_id(key)
+                        cgroup.last_id = id_
+                        if not noack:
+                            cgroup.deliver(id_, consumer, now)
+                    cgroup.consumer(consumer)
+                    if got:
+                        rv.append(
+                            [name, [[key, self.dict_to_list(d)] for key, d in got]]
+                        )
+                    continue
+
+                # an explicit id replays this consumer's own pending history
+                history = cgroup.consumer(consumer).range(
+                    parse_stream_id(start), start_xlsv=True
+                )
+                entries = []
+                for id_, _ in history:
+                    if count and len(entries) >= count:
+                        break
+                    key = ser_stream_id(id_)
+                    data = trie.get(key)
+                    entries.append(
+                        [key, None if data is None else self.dict_to_list(data)]
+                    )
+                rv.append([name, entries])
+
+            return rv or None
+
+        got = query()
+        if got is not None or block is None:
+            return got
+
+        # block == 0 waits until something arrives
+        deadline = time.monotonic() + block / 1e3
+        while got is None and (not block or time.monotonic() < deadline):
+            time.sleep(0.1)
+            got = query()
+
+        return got
+
+    def xack(self, key: str, group: str, ids: list[str]) -> int:
+        trie = self._get(key)
+        if not isinstance(trie, Trie) or group not in trie.groups:
+            return 0
+
+        cgroup = trie.groups[group]
+        return sum(cgroup.ack(parse_stream_id(id_)) for id_ in ids)
+
+    def xpending(self, key: str, group: str, *args) -> list:
+        _, cgroup = self._stream_group(key, group)
+        pel = cgroup.pel
+        if not args:
+            if not pel:
+                return [0, None, None, None]
+
+            consumers = [
+                [name, str(len(pending))]
+                for name, pending in cgroup.consumers.items()
+                if pending
+            ]
+            return [
+                len(pel),
+                ser_stream_id(pel.first()),
+                ser_stream_id(pel.last()),
+                consumers,
+            ]
+
+        args = list(args)
+        min_idle = 0
+        if str(args[0]).upper() == "IDLE":
+            min_idle = int(args[1])
+            args = args[2:]
+
+        start, end, count = args[0], args[1], int(args[2])
+        if len(args) > 3:
+            pel = cgroup.consumers.get(args[3], PendingEntries())
+
+        now = int(time.time() * 1000)
+        rv = []
+        for id_, (consumer, delivered, deliveries) in pel.range(
+            parse_stream_id(start, 0), parse_stream_id(end, MAX_SEQ)
+        ):
+            if len(rv) >= count:
+                break
+            idle = now - delivered
+            if idle < min_idle:
+                continue
+            rv.append([ser_stream_id(id_), consumer, idle, deliveries])
+
+        return rv
+
+    def xclaim(
+        self,
+        key: str,
+        group: str,
+        consumer: str,
+        min_idle: int,
+        ids: list[str],
+        justid=False,
+        idle: int | None = None,
+        time_ms: int | None = None,
+        retrycount: int | None = None,
+        force=False,
+        lastid: str | None = None,
+    ) -> list:
+        trie, cgroup = self._stream_group(key, group)
+        now = int(time.time() * 1000)
+        if lastid is not None:
+            cgroup.last_id = max(cgroup.last_id, parse_stream_id(lastid))
+        rv = []
+        for key_ in ids:
+            id_ = parse_stream_id(key_)
+            entry = cgroup.pel.entries.get(id_)
+            if entry is None and not force:
+                continue
+            if entry is not None and now - entry[1] < min_idle:
+                continue
+
+            data = trie.get(ser_stream_id(id_))
+            if data is None and not force:
+                # the entry was removed from the stream, drop it from the PEL
+                cgroup.ack(id_)
+                continue
+
+            entry = cgroup.deliver(id_, consumer, now)
+            if justid:
+                entry[2] -= 1
+            if idle is not None:
+                entry[1] = now - idle
+            if time_ms is not None:
+                entry[1] = time_ms
+            if retrycount is not None:
+                entry[2] = retrycount
+            if justid:
+                rv.append(ser_stream_id(id_))
+            else:
+                data = None if data is None else self.dict_to_list(data)
+                rv.append([ser_stream_id(id_), data])
+
+        return rv
+
+    def xsetid(self, key: str, last_id: str) -> str:
+        trie = self._get(key)
+        if not isinstance(trie, Trie):
+            raise ValueError("no such key")
+
+        id_ = parse_stream_id(last_id)
+        if len(trie) and id_ < trie.last_key:
+            raise ValueError(
+                "The ID specified in XSETID is smaller than the target stream top item"
+            )
+        trie.last_key = id_
+        return "OK"
+
+    def script_load(self, src: str) -> str:
+        sha = hashlib.sha1(str(src).encode("utf-8")).hexdigest()
+        if sha not in self.scripts:
+            self.scripts[sha] = compile_script(str(src))
+            self.script_sources[sha] = str(src)
+
+        return sha
+
+    def evalsha(self, sha: str, keys: list, argv: list):
+        script = self.scripts.get(str(sha).lower())
+        if script is None:
+            raise ValueError("NOSCRIPT No matching script. Please use EVAL.")
+
+        def call(command, *args):
+            rv = pcall(command, *args)
+            if isinstance(rv, Error):
+                raise ValueError(f"Error running script: {rv.msg}")
+            return rv
+
+        def pcall(command, *args):
+            args = [a if isinstance(a, str) else str(a) for a in args]
+            ctype, rv = handle_command(str(command), args, self)
+            if ctype == CommandType.Blocking:
+                return Error("blocking commands are not allowed from scripts")
+
+            rv = parse_data(parse_crlf(rv))
+            if isinstance(rv, Error) and rv.msg.startswith("ERR "):
+                rv = Error(rv.msg.removeprefix("ERR "))
+            return rv
+
+        return script_reply(script(list(keys), list(argv), call, pcall))
+
+    def eval(self, src: str, keys: list, argv: list):
+        return self.evalsha(self.script_load(src), keys, argv)
+
+    def handle_script(self, subcmd: str, *args):
+        match subcmd.upper():
+            case "LOAD":
+                return self.script_load(args[0])
+            case "EXISTS":
+                return [int(str(sha).lower() in self.scripts) for sha in args]
+            case "FLUSH":
+                self.scripts.clear()
+                self.script_sources.clear()
+                return "OK"
+            case _:
+                raise NotImplementedError(f"SCRIPT {subcmd!r} not implemented")
+
+    @classmethod
+    def _aof_file(cls):
+        return Path(cls.config.get("aof", "redis.aof"))
+
+    @classmethod
+    def _rdb_file(cls) -> PathLike:
+        fname = cls.config.get("dbfilename", "redis.rdb")
+        direc = cls.config.get("dir", "/tmp/redis-files")
+        return Path(direc) / fname
+
+    @contextmanager
+    def _aof(self):
+        aof = self._aof_file()
+        if not aof.exists():
+            aof.write_text("")
+
+        with aof.open("a", encoding="utf-8", errors=WIRE_ERRORS, newline="") as f:
+            yield f
+
+    def save(self, query: str) -> str:
+        """appends a write to the AOF, callers decide what is one with command_keys"""
+        with self._aof_lock, self._aof() as f:
+            f.write(self._aof_select(self.db) + query)
+            size = f.tell()
+        self._maybe_rewrite_aof(size)
+        return "OK"
+
+    def save_batch(self, queries: list[tuple[int, str]]) -> str:
+        """persist a transaction's (db, query) pairs with a single write"""
+        if not queries:
+            return "OK"
+
+        with self._aof_lock, self._aof() as f:
+            f.write("".join(self._aof_select(db) + q for db, q in queries))
+            size = f.tell()
+        self._maybe_rewrite_aof(size)
+        return "OK"
+
+    def _aof_select(self, db: int) -> str:
+        """SELECT entry switching the replay to `db`, empty if the log is already there"""
+        if db == self._aof_db:
+            return ""
+
+        self._aof_db = db
+        return serialize_data(list(map(bulk_string, ("SELECT", str(db)))))
+
+    def _maybe_rewrite_aof(self, size: int):
+        growth = self._config_int("auto-aof-rewrite-percentage")
+        if not growth or size < self._config_int("auto-aof-rewrite-min-size"):
+            return
+
+        if size >= self._aof_base_size * (100 + growth) // 100:
+            # the caller holds only some lock stripes, the rewrite needs them all
+            self._rewrite_due = True
+
+    def maybe_rewrite_aof(self):
+        """runs an auto rewrite flagged by save, call without holding any stripe"""
+        if not self._rewrite_due:
+            return
+
+        with self.locked():
+            if self._rewrite_due:
+                self.rewrite_aof()
+
+    def rewrite_commands(self, key: str) -> list[list]:
+        """commands rebuilding the current value of `key` from scratch"""
+        cmds = self._rewrite_value(key, self._get(key))
+        if cmds and key in self._ts:
+            # absolute, a replay later on must not extend the ttl
+            ms = (self._ts[key] - RdbWriter.epoch) // timedelta(milliseconds=1)
+            cmds.append(["PEXPIREAT", key, str(ms)])
+        return cmds
+
+    def _rewrite_value(self, key: str, item) -> list[list]:
+        batch = 64  # items per command, keeps single AOF lines bounded
+        match item:
+            case None:
+                return []
+            case bytearray():
+                # the raw bytes go out as one value, like the GET reply
+                return [["SET", key, item.decode("utf-8", WIRE_ERRORS)]]
+            case str() | int():
+                return [["SET", key, str(item)]]
+            case list() | deque():
+                vals = [str(v) for v in item]
+                return [
+                    ["RPUSH", key, *vals[i : i + batch]]
+                    for i in range(0, len(vals), batch)
+                ]
+            case set() | IntSet() | ListPackSet():
+                vals = [str(v) for v in item]
+                return [
+                    ["SADD", key, *vals[i : i + batch]]
+                    for i in range(0, len(vals), batch)
+                ]
+            case dict() | ListPack():
+                pairs = [str(x) for kv in item.items() for x in kv]
+                return [
+                    ["HSET", key, *pairs[i : i + batch * 2]]
+                    for i in range(0, len(pairs), batch * 2)
+                ]
+            case Trie():
+                cmds = [
+                    ["XADD", key, id_, *map(str, self.dict_to_list(data))]
+                    for id_, data in item.range()
+                ]
+                top = ser_stream_id(item.last_key)
+                if not cmds:
+                    # like redis, an emptied stream is recreated by a trimmed XADD
+                    cmds.append(["XADD", key, "MAXLEN", "0", top, "x", "y"])
+                # trimmed entries may have been past the last one left
+                cmds.append(["XSETID", key, top])
+                for name, group in item.groups.items():
+                    last_id = ser_stream_id(group.last_id)
+                    cmds.append(["XGROUP", "CREATE", key, name, last_id, "MKSTREAM"])
+                    for consumer in group.consumers:
+                        cmds.append(["XGROUP", "CREATECONSUMER", key, name, consumer])
+                    # delivered but unacked entries, with their owner and counters
+                    for id_, (consumer, delivered, count) in group.pel.range():
+                        cmds.append(
+                            ["XCLAIM", key, name, consumer, "0", ser_stream_id(id_)]
+                            + ["TIME", str(delivered), "RETRYCOUNT", str(count)]
+                            + ["FORCE", "JUSTID"]
+                        )
+                return cmds
+            case x:
+                raise NotImplementedError("[rewrite_value]", f"{x!r} not yet parsed")
+
+    def rewrite_aof(self) -> str:
+        """
+        compacts the AOF down to the current dataset. with aof-use-rdb-preamble
+        the file starts with an RDB snapshot and later writes are appended as
+        commands after it, otherwise every key is rewritten as commands.
+        callers hold every lock stripe so the snapshot is consistent
+        """
+        aof = self._aof_file()
+        tmp = aof.with_name(aof.name + ".tmp")
+        preamble = str(self.config.get("aof-use-rdb-preamble", "yes")) == "yes"
+        current, self._aof_db = self.db, 0
+        with tmp.open("wb") as f:
+            if preamble:
+                # streams have no RDB encoding here, they follow as commands
+                RdbWriter(self).dump(f, skip=(Trie,))
+            try:
+                for db, keyspace in enumerate(self.dbs):
+                    self.select(db)
+                    for key in list(keyspace.store):
+                        if preamble and not isinstance(keyspace.store[key], Trie):
+                            continue
+                        for cmd in self.rewrite_commands(key):
+                            query = serialize_data(list(map(bulk_string, cmd)))
+                            query = self._aof_select(db) + query
+                            f.write(query.encode("utf-8", WIRE_ERRORS))
+            finally:
+                self.select(current)
+            size = f.tell()
+
+        tmp.replace(aof)
+        self._aof_base_size = size
+        self._rewrite_due = False
+        logger.info(f"Rewrote {aof} to {size} bytes, {preamble=}")
+        return "OK"
+
+
+class rdb_consts:
+    OPCODE_EOF = 0xFF
+    OPCODE_SELECTDB = 0xFE
+    OPCODE_EXPIRETIME = 0xFD
+    OPCODE_EXPIRETIME_MS = 0xFC
+    OPCODE_RESIZEDB = 0xFB
+    OPCODE_AUX = 0xFA
+    # OPCODE_MODULE_AUX = 247
+    # OPCODE_IDLE = 0xF8
+    # OPCODE_FREQ = 0xF9
+
+    LEN_6BIT = 0b00
+    LEN_14BIT = 0b01
+    LEN_32BIT = 0b10
+    ENCVAL = 0b11
+
+    ENC_INT8 = 0
+    ENC_INT16 = 1
+    ENC_INT32 = 2
+    ENC_LZF = 3
+
+    TYPE_STRING = 0
+    TYPE_LIST = 1
+    TYPE_SET = 2
+    TYPE_ZSET = 3
+    TYPE_HASH = 4
+    TYPE_HASH_ZIPMAP = 9
+    TYPE_LIST_ZIPLIST = 10
+    TYPE_SET_INTSET = 11
+    TYPE_ZSET_ZIPLIST = 12
+    TYPE_HASH_ZIPLIST = 13
+    TYPE_LIST_QUICKLIST = 14
+    TYPE_STREAM_LISTPACKS = 15
+
+    DATA_TYPE_MAPPING = {
+        0: "string",
+        1: "list",
+        2: "set",
+        3: "sortedset",
+        4: "hash",
+        9: "hash",
+        10: "list",
+        11: "set",
+        12: "sortedset",
+        13: "hash",
+        14: "list",
+        15: "stream",
+    }
+
+
+class RdbParser:
+    """
+    ----------------------------#
+    52 45 44 49 53              # Magic String "REDIS"
+    30 30 30 33                 # RDB Version Number as ASCII string. "0003" = 3
+    ----------------------------
+    FA                          # Auxiliary field
+    $string-encoded-key         # May contain arbitrary metadata
+    $string-encoded-value       # such as Redis version, creation time, used memory, ...
+    ----------------------------
+    FE 00                       # Indicates database selector. db number = 00
+    FB                          # Indicates a resizedb field
+    $length-encoded-int         # Size of the corresponding hash table
+    $length-encoded-int         # Size of the corresponding expire hash table
+    ----------------------------# Key-Value pair starts
+    FD $unsigned-int            # "expiry time in seconds", followed by 4 byte unsigned int
+    $value-type                 # 1 byte flag indicating the type of value
+    $string-encoded-key         # The key, encoded as a redis string
+    $encoded-value              # The value, encoding depends on $value-type
+    ----------------------------
+    FC $unsigned long           # "expiry time in ms", followed by 8 byte unsigned long
+    $value-type                 # 1 byte flag indicating the type of value
+    $string-encoded-key         # The key, encoded as a redis string
+    $encoded-value              # The value, encoding depends on $value-type
+    ----------------------------
+    $value-type                 # key-value pair without expiry
+    $string-encoded-key
+    $encoded-value
+    ----------------------------
+    FE $length-encoding         # Previous db ends, next db starts.
+    ----------------------------
+    ...                         # Additional key-value pairs, databases, ...
+
+    FF                          ## End of RDB file indicator
+    8-byte-checksum             ## CRC64 checksum of the entire file.
+    """
+
+    def __init__(self, path: str | PathLike, store: Redis | None = None) -> None:
+        self._f = Path(path)
+        self._store = store or Redis()
+        self.aux_data = {}
+
+    def parse(self):
+        if not self._f.exists():
+            return self._store
+
+        with self._f.open("rb") as f:
+            return self.load(f)
+
+    def load(self, f: io.BufferedReader) -> Redis:
+        """reads one RDB payload, leaving `f` positioned right after it"""
+        self._verify_magic_string(f)
+        self._verify_version(f)
+        current = self._store.db
+        try:
+            return self._parse(f)
+        finally:
+            self._store.select(current)
+
+    def _parse(self, f: io.BufferedReader) -> Redis:
+        while True:
+            aux_byte = read_uchar(f)  # holds the opcode else the value_type
+            match aux_byte:
+                case rdb_consts.OPCODE_EOF:
+                    if self.rdb_version >= 5:
+                        checksum = f.read(8)
+                        logger.debug(f"{checksum=}")
+                    return self._store
+                case rdb_consts.OPCODE_SELECTDB:
+                    logger.debug("parsing db selector")
+                    db_number = self._parse_db_selector(f)
+                    logger.debug(f"{db_number=}")
+                    self._store.select(db_number)
+                case rdb_consts.OPCODE_EXPIRETIME:
+                    logger.debug("parsing expiry time")
+                    expiry = to_datetime(read_uint(f) * int(1e6))
+                    logger.debug(f"SECONDS: {expiry=}")
+                    value_type = read_uchar(f)
+                    self._parse_key_value(f, value_type, expiry)
+                case rdb_consts.OPCODE_EXPIRETIME_MS:
+                    logger.debug("parsing expiry time in millis")
+                    expiry = read_ms_time(f)
+                    logger.debug(f"MILLI SECS: {expiry=}")
+                    value_type = read_uchar(f)
+                    self._parse_key_value(f, value_type, expiry)
+                case rdb_consts.OPCODE_RESIZEDB:
+                    logger.debug("parsing resizedb")
+                    db_size, expiry_db_size = self._parse_resizedb(f)
+                    logger.debug(f"{db_size=}, {expiry_db_size=}")
+                case rdb_consts.OPCODE_AUX:
+                    logger.debug("parsing auxiliary fields")
+                    aux_kv = self._parse_aux(f)
+                    self.aux_data.update(aux_kv)
+                    logger.debug(f"{self.aux_data=}")
+                case _:
+                    # key value pairs
+                    logger.debug("Parsing key value pairs")
+                    self._parse_key_value(f, aux_byte)
+
+    def _verify_magic_string(self, f: io.BufferedReader):
+        logger.debug(f"Parsing magic string")
+        magic_string = f.read(5)
+        logger.debug(f"{magic_string=}")
+        if magic_string != b"REDIS":
+            raise Exception("verify_magic_string", "Invalid File Format")
+
+    def _verify_version(self, f: io.BufferedReader):
+        logger.debug(f"Parsing version")
+        version_str = f.read(4)
+        version = int(version_str)
+        logger.debug(f"{version_str=} | {version=}")
+        if version < 1 or version > 9:
+            raise Exception("verify_version", "Invalid RDB version number %d" % version)
+        self.rdb_version = version
+
+    def _parse_db_selector(self, f: io.BufferedReader):
+        # skip the opcode
+        length, _ = self._parse_length(f)
+        return length
+
+    def _parse_resizedb(self, f: io.BufferedReader) -> tuple[int, int]:
+        db_size, _ = self._parse_length(f)
+        expiry_db_size, _ = self._parse_length(f)
+        return db_size, expiry_db_size
+
+    def _parse_aux(self, f: io.BufferedReader) -> dict:
+        key = self._parse_str(f)
+        logger.debug(f"Aux string {key=}")
+        value = self._parse_str(f)
+        logger.debug(f"Aux string {value=}")
+        return {key: value}
+
+    def _parse_key_value(
+        self, f: io.BufferedReader, value_type, expiry: datetime | None = None
+    ):
+        # TODO: parse expired values
+        logger.debug(f"{value_type=}")
+        key = str(self._parse_str(f))
+        logger.debug(f"{key=}")
+
+        match value_type:
+            case rdb_consts.TYPE_STRING:
+                value = self._parse_str(f)
+                logger.debug(f"PARSING TYPE STRING: {key=} {value=} {expiry=}")
+                self._store.set(key, value, expiry)
+                return
+            case rdb_consts.TYPE_LIST:
+                self._store.rpush(key, self._parse_members(f))
+            case rdb_consts.TYPE_SET:
+                self._store.sadd(key, self._parse_members(f))
+            case rdb_consts.TYPE_HASH:
+                length, _ = self._parse_length(f)
+                pairs = [str(self._parse_str(f)) for _ in range(length * 2)]
+                self._store.hset(key, pairs)
+            case x:
+                raise NotImplementedError(
+                    "[_parse_key_value]", f"not implemented yet! {x!r}"
+                )
+
+        if expiry is not None:
+            if expiry <= datetime.now():
+                self._store.store.pop(key, None)
+            else:
+                self._store._ts[key] = expiry
+
+    def _parse_members(self, f: io.BufferedReader) -> list[str]:
+        length, _ = self._parse_length(f)
+        return [str(self._parse_str(f)) for _ in range(length)]
+
+    def _parse_str(self, f: io.BufferedReader):
+        length, is_encoded = self._parse_length(f)
+        logger.debug(f"Parsing string: {length=} | {is_encoded=}")
+        if not is_encoded:
+            content = f.read(length)
+            logger.debug(f"Got string {content=}")
+            try:
+                return content.decode("utf-8")
+            except UnicodeDecodeError:
+                # raw bytes, e.g. a bitmap
+                return bytearray(content)
+
+        match length:
+            case rdb_consts.ENC_INT8:
+                return read_char(f)
+            case rdb_consts.ENC_INT16:
+                return read_short(f)
+            case rdb_consts.ENC_INT32:
+                return read_int(f)
+            case rdb_consts.ENC_LZF:
+                # The compressed length clen is read from the stream using Length Encoding
+                # The uncompressed length is read from the stream using Length Encoding
+                # The next clen bytes are read from the stream
+                # Finally, these bytes are decompressed using LZF algorithm
+                clen, _ = self._parse_length(f)
+                uncomp_len, _ = self._parse_length(f)
+                bytes_ = f.read(clen)
+                # val = lzf.decompress(f.read(clen), uncomp_len)
+                raise NotImplementedError(
+                    "_parse_str",
+                    f"compressed string: {rdb_consts.ENC_LZF!r} {clen=}, {uncomp_len=}, {bytes_=}",
+                )
+            case x:
+                raise NotImplementedError("_parse_str", f"Unknown string type: {x!r}")
+
+    def _parse_length(self, f: io.BufferedReader) -> tuple[int, bool]:
+        first_byte = read_uchar(f)
+        msb = first_byte >> 6
+        logger.debug(f"Parsing length: {first_byte=} {msb=}")
+        lsb6 = 0b00111111
+        match msb:
+            case rdb_consts.LEN_6BIT:
+                # next six bits represent the length
+                length = first_byte & lsb6
+                return length, False
+            case rdb_consts.LEN_14BIT:
+                # read one additional byte. the combined 14 bits represents the length
+                next_byte = read_uchar(f)
+                length = ((first_byte & lsb6) << 8) | next_byte
+                return length, False
+            case rdb_consts.LEN_32BIT:
+                # discard the remaining 6 bits. the next 4 bytes represents the length
+                length = read_uint_be(f)
+                return length, False
+            case rdb_consts.ENCVAL:
+                # the next object is encoded in a special format
+                # the remaining 6 bits indicate the format
+                return (first_byte & lsb6), True
+            case x:
+                raise NotImplementedError(f"[_parse_length] Unknown msb: {x!r}")
+
+
+class RdbWriter:
+    """
+    dumps a Redis into the layout RdbParser reads, see its docstring.
+    strings holding canonical int32 values use the integer encoding, lists,
+    sets and hashes are written in their plain (non listpack) encodings
+    """
+
+    version = 9
+    epoch = datetime(1970, 1, 1)
+
+    def __init__(self, store: Redis) -> None:
+        self._store = store
+
+    def dump(self, f: io.BufferedWriter, skip: tuple = ()):
+        f.write(b"REDIS%04d" % self.version)
+        self._write_aux(f, "redis-ver", "7.2.0")
+        self._write_aux(f, "aof-base", "1")
+        now = datetime.now()
+        for db, keyspace in enumerate(self._store.dbs):
+            ts = keyspace.ts
+            keys = [
+                k
+                for k, v in keyspace.store.items()
+                if not isinstance(v, skip) and not (k in ts and ts[k] <= now)
+            ]
+            if not keys:
+                continue
+
+            f.write(bytes([rdb_consts.OPCODE_SELECTDB]))
+            self._write_length(f, db)
+            f.write(bytes([rdb_consts.OPCODE_RESIZEDB]))
+            self._write_length(f, len(keys))
+            self._write_length(f, sum(k in ts for k in keys))
+            for key in keys:
+                if key in ts:
+                    ms = (ts[key] - self.epoch) // timedelta(milliseconds=1)
+                    f.write(bytes([rdb_consts.OPCODE_EXPIRETIME_MS]))
+                    f.write(struct.pack("<Q", ms))
+                self._write_key_value(f, key, keyspace.store[key])
+
+        f.write(bytes([rdb_consts.OPCODE_EOF]))
+        # a zero checksum tells loaders that checksumming was disabled
+        f.write(bytes(8))
+
+    def _write_aux(self, f: io.BufferedWriter, key: str, val: str):
+        f.write(bytes([rdb_consts.OPCODE_AUX]))
+        self._write_str(f, key)
+        self._write_str(f, val)
+
+    def _write_key_value(self, f: io.BufferedWriter, key: str, val):
+        match val:
+            case str() | int() | bytearray():
+                f.write(bytes([rdb_consts.TYPE_STRING]))
+                self._write_str(f, key)
+                self._write_str(f, val)
+            case list() | deque() | set() | IntSet() | ListPackSet():
+                is_list = isinstance(val, LIST_TYPES)
+                f.write(
+                    bytes([rdb_consts.TYPE_LIST if is_list else rdb_consts.TYPE_SET])
+                )
+                self._write_str(f, key)
+                self._write_length(f, len(val))
+                for member in val:
+                    self._write_str(f, member)
+            case dict() | ListPack():
+                f.write(bytes([rdb_consts.TYPE_HASH]))
+                self._write_str(f, key)
+                self._write_length(f, len(val))
+                for field, value in val.items():
+                    self._write_str(f, field)
+                    self._write_str(f, value)
+            case x:
+                raise NotImplementedError("[_write_key_value]", f"{x!r} not yet parsed")
+
+    def _write_length(self, f: io.BufferedWriter, length: int):
+        if length < 1 << 6:
+            f.write(bytes([length]))
+        elif length < 1 << 14:
+            f.write(bytes([(rdb_consts.LEN_14BIT << 6) | (length >> 8), length & 0xFF]))
+        else:
+            f.write(bytes([rdb_consts.LEN_32BIT << 6]) + struct.pack(">I", length))
+
+    def _write_str(self, f: io.BufferedWriter, val):
+        if is_int_member(val) and -(1 << 31) <= int(val) < 1 << 31:
+            val = int(val)
+            for enc, fmt, bits in (
+                (rdb_consts.ENC_INT8, "<b", 8),
+                (rdb_consts.ENC_INT16, "<h", 16),
+                (rdb_consts.ENC_INT32, "<i", 32),
+            ):
+                if -(1 << (bits - 1)) <= val < 1 << (bits - 1):
+                    f.write(bytes([(rdb_consts.ENCVAL << 6) | enc]))
+                    f.write(struct.pack(fmt, val))
+                    return
+
+        if isinstance(val, bytearray):
+            data = val
+        else:
+            data = str(val).encode("utf-8", WIRE_ERRORS)
+        self._write_length(f, len(data))
+        f.write(data)
+
+
+class CommandType(Enum):
+    NoOp = "NOOP"
+    Ping = "PING"
+    Del = "DEL"
+    Echo = "ECHO"
+    Exists = "EXISTS"
+    Get = "GET"
+    Set = "SET"
+    Mget = "MGET"
+    Mset = "MSET"
+    Msetnx = "MSETNX"
+    Pexpireat = "PEXPIREAT"
+    Incr = "INCR"
+    Decr = "DECR"
+    Incrby = "INCRBY"
+    Decrby = "DECRBY"
+    Incrbyfloat = "INCRBYFLOAT"
+    Save = "SAVE"
+    Bgrewriteaof = "BGREWRITEAOF"
+    Lpush = "LPUSH"
+    Lpop = "LPOP"
+    Rpush = "RPUSH"
+    Rpop = "RPOP"
+    Llen = "LLEN"
+    Lrange = "LRANGE"
+    Hset = "HSET"
+    Hget = "HGET"
+    Hmget = "HMGET"
+    Hmset = "HMSET"
+    Hgetall = "HGETALL"
+    Hincrby = "HINCRBY"
+    Sadd = "SADD"
+    Srem = "Srem"
+    Sismember = "SISMEMBER"
+    Sinter = "SINTER"
+    Sintercard = "SINTERCARD"
+    Sinterstore = "SINTERSTORE"
+    Sunion = "SUNION"
+    Sunionstore = "SUNIONSTORE"
+    Sdiff = "SDIFF"
+    Sdiffstore = "SDIFFSTORE"
+    Scard = "SCARD"
+    Smembers = "SMEMBERS"
+    Setbit = "SETBIT"
+    Getbit = "GETBIT"
+    Bitcount = "BITCOUNT"
+    Bitop = "BITOP"
+    Bitpos = "BITPOS"
+    Client = "CLIENT"
+    Object = "OBJECT"
+    Config = "CONFIG"
+    Keys = "KEYS"
+    Info = "INFO"
+    Hotkeys = "HOTKEYS"
+    Select = "SELECT"
+    Swapdb = "SWAPDB"
+    Flushdb = "FLUSHDB"
+    Flushall = "FLUSHALL"
+    Dbsize = "DBSIZE"
+    Move = "MOVE"
+    Type = "TYPE"
+    Xadd = "XADD"
+    Xrange = "XRANGE"
+    Xread = "XREAD"
+    Xlen = "XLEN"
+    Xtrim = "XTRIM"
+    Xgroup = "XGROUP"
+    Xreadgroup = "XREADGROUP"
+    Xack = "XACK"
+    Xpending = "XPENDING"
+    Xclaim = "XCLAIM"
+    Xsetid = "XSETID"
+
+    Eval = "EVAL"
+    Evalsha = "EVALSHA"
+    Script = "SCRIPT"
+    Hello = "HELLO"
+    Multi = "MULTI"
+    Exec = "EXEC"
+    Discard = "DISCARD"
+    Watch = "WATCH"
+    Unwatch = "UNWATCH"
+
+    # required for internal use
+    Blocking = "BLOCKING"
+    Queued = "QUEUED"
+    Error = "Error"
+
+    def __eq__(self, o):
+        if isinstance(o, str):
+            return self.value.lower() == o.lower()
+
+        return super().__eq__(o)
+
+
+def handle_err(cmd: str | None, args: list[str] | None, error_type: ErrorType) -> str:
+    match error_type:
+        case ErrorType.Command:
+            return f"-ERR unknown command {cmd!r}\r\n"
+        case ErrorType.WrongType:
+            return (
+                "-WRONGTYPE Operation against a key holding the wrong kind"
+                f" of value {args=}\r\n"
+            )
+        case ErrorType.InvalidData:
+            return f"-ERR invalid input, cannot parse data: {cmd!r}"
+
+
+def parse_trim_args(args: list) -> tuple[tuple | None, list]:
+    """
+    Parse a leading `MAXLEN|MINID [=|~] threshold [LIMIT count]` clause.
+    Returns the args for `Trie.trim` and whatever follows the clause.
+    """
+    if not args or str(args[0]).upper() not in ("MAXLEN", "MINID"):
+        return None, args
+
+    strategy, rest = args[0], args[1:]
+    approx = False
+    if rest[0] in ("=", "~"):
+        approx = rest[0] == "~"
+        rest = rest[1:]
+
+    threshold, rest = rest[0], rest[1:]
+    limit = None
+    if rest and str(rest[0]).upper() == "LIMIT":
+        if not approx:
+            raise ValueError(
+                "syntax error, LIMIT cannot be used without the special ~ option"
+            )
+        limit, rest = int(rest[1]), rest[2:]
+
+    return (strategy, threshold, approx, limit), rest
+
+
+def parse_xclaim_args(args: list) -> tuple[list, dict]:
+    """
+    Split XCLAIM's `id [id ...] [IDLE ms] [TIME ms] [RETRYCOUNT n] [FORCE]
+    [JUSTID] [LASTID id]` into the ids and the keyword args of `Redis.xclaim`.
+    """
+    ids, options = [], {}
+    numeric = {"IDLE": "idle", "TIME": "time_ms", "RETRYCOUNT": "retrycount"}
+    i = 0
+    while i < len(args):
+        word = str(args[i]).upper()
+        if word in ("FORCE", "JUSTID"):
+            options[word.lower()] = True
+        elif word in numeric:
+            options[numeric[word]] = int(args[i + 1])
+            i += 1
+        elif word == "LASTID":
+            options["lastid"] = str(args[i + 1])
+            i += 1
+        else:
+            ids.append(args[i])
+        i += 1
+
+    return ids, options
+
+
+def command_echo(data: list[str]) -> tuple[CommandType, str]:
+    rdata = " ".join(data)
+    resp = f"+{rdata}\r\n"
+    return CommandType.Echo, resp
+
+
+def command_ping() -> tuple[CommandType, str]:
+    return CommandType.Ping, "+PONG\r\n"
+
+
+def parse_crlf(data: str) -> Generator[str, None, None]:
+    """
+    splits RESP into its CRLF terminated tokens. the payload after a bulk
+    header is cut by the header's byte length instead, so it can hold CR/LF
+    """
+    buf = data.encode("utf-8", WIRE_ERRORS)
+    pos = 0
+    while (eol := buf.find(b"\r\n", pos)) >= 0:
+        token = buf[pos:eol].decode("utf-8", WIRE_ERRORS)
+        yield token
+        pos = eol + 2
+        if token[:1] in ("$", "!") and token[1:].isdigit():
+            size = int(token[1:])
+            yield buf[pos : pos + size].decode("utf-8", WIRE_ERRORS)
+            pos += size + 2
+
+
+def _next(gen: Generator) -> str | None:
+    try:
+        return next(gen)
+    except StopIteration:
+        return None
+
+
+def next_token(data: Generator) -> str | None:
+    return _next(data)
+
+
+def parse_nulls() -> None:
+    return None
+
+
+def parse_int(token):
+    match (token[0], token[1:]):
+        case ("+", rest):
+            return int(rest)
+        case ("-", rest):
+            return -int(rest)
+        case _:
+            return int(token)
+
+
+def parse_bool(token):
+    match token:
+        case "t":
+            return True
+        case "f":
+            return False
+        case x:
+            raise ValueError(f"Given input is not boolean : {x=}")
+
+
+def parse_bulk_strings(sz, tokens) -> BulkString | None:
+    if sz == -1:
+        return None
+    token = next(tokens)
+    assert len(token.encode("utf-8", WIRE_ERRORS)) == sz
+    return BulkString(sz, token)
+
+
+def parse_bulk_errors(sz, tokens) -> BulkError:
+    token = next(tokens)
+    assert len(token.encode("utf-8", WIRE_ERRORS)) == sz
+    return BulkError(sz, token)
+
+
+def parse_array(sz, tokens) -> list | None:
+    if sz == -1:
+        return None
+
+    rv = []
+    for _ in range(sz):
+        parsed_token = parse_data(tokens)
+        rv.append(parsed_token)
+
+    return rv
+
+
+def parse_sets(sz, tokens) -> set:
+    rv = set()
+    for _ in range(sz):
+        parsed_token = parse_data(tokens)
+        rv.add(parsed_token)
+
+    return rv
+
+
+def parse_maps(sz, tokens) -> dict:
+    rv = {}
+    for _ in range(sz):
+        key = parse_data(tokens)
+        val = parse_data(tokens)
+        rv[key] = val
+
+    return rv
+
+
+def parse_pushes(sz, tokens) -> Push:
+    return Push(parse_array(sz, tokens) or [])
+
+
+def parse_simple_strings(token):
+    return token
+
+
+def parse_errors(token):
+    return Error(token)
+
+
+def parse_data(tokens):
+    token = next_token(tokens)
+    if token is None:
+        return
+
+    match (token[0], token[1:]):
+        case ("+", rest):
+            return parse_simple_strings(rest)
+        case ("-", rest):
+            return parse_errors(rest)
+        case (":", rest):
+            return parse_int(rest)
+        case ("_", _):
+            return parse_nulls()
+        case ("#", rest):
+            return parse_bool(rest)
+        case ("!", rest):
+            return parse_bulk_errors(int(rest), tokens)  # Simple
+        case ("$", rest):
+            return parse_bulk_strings(int(rest), tokens)
+        case ("*", rest):
+            return parse_array(int(rest), tokens)
+        case ("%", rest):
+            return parse_maps(int(rest), tokens)
+        case ("~", rest):
+            return parse_sets(int(rest), tokens)
+        case (">", rest):
+            return parse_pushes(int(rest), tokens)
+        # case (",", _):
+        #     # return doubles()
+        # case ("(", _):
+        #     # return big_numbers()
+        # case ("=", _):
+        #     # return verbatim_strings()
+        case _:
+            return None
+
+
+# replies for the most common small integers (counters, lengths, 0/1 flags) are
+# built once and shared instead of being formatted on every call
+OBJ_SHARED_INTEGERS = 10000
+SHARED_INTEGERS = [":{val}\r\n".format(val=i) for i in range(OBJ_SHARED_INTEGERS)]
+
+
+def serialize_int(val: int) -> str:
+    if 0 <= val < OBJ_SHARED_INTEGERS:
+        return SHARED_INTEGERS[val]
+
+    return ":{val}\r\n".format(val=str(val))
+
+
+def serialize_str(val: str) -> str:
+    return "+{val}\r\n".format(val=val)
+
+
+def serialize_bulk_str(val: BulkString) -> str:
+    return val.ser()
+
+
+def serialize_bool(val: bool) -> str:
+    return "#{val}\r\n".format(val="t" if val is True else "f")
+
+
+def serialize_null() -> str:
+    return "$-1\r\n"
+    return "*-1\r\n"
+    return "_\r\n"
+
+
+# aggregates are built with a single join rather than repeated concatenation,
+# multi-key replies (MGET, HGETALL, ...) stay linear in the reply size
+def serialize_dict(data: dict) -> str:
+    parts = [f"%{len(data)}\r\n"]
+    for key, val in data.items():
+        parts.append(serialize_data(key))
+        parts.append(serialize_data(val))
+
+    return "".join(parts)
+
+
+def serialize_push(data: Push) -> str:
+    return f">{len(data)}\r\n" + "".join(map(serialize_data, data))
+
+
+def serialize_list(data: list) -> str:
+    return f"*{len(data)}\r\n" + "".join(map(serialize_data, data))
+
+
+def serialize_set(data: set) -> str:
+    return f"~{len(data)}\r\n" + "".join(map(serialize_data, data))
+
+
+def serialize_error(data: Error) -> str:
+    return data.ser()
+
+
+def serialize_bulk_error(data: BulkError) -> str:
+    return data.ser()
+
+
+def serialize_data(data) -> str:
+    match data:
+        case int():
+            return serialize_int(data)
+        case BulkString():
+            return serialize_bulk_str(data)
+        case str():
+            return serialize_str(data)
+        case bool():
+            return serialize_bool(data)
+        case None:
+            return serialize_null()
+        case dict():
+            return serialize_dict(data)
+        case Push():
+            return serialize_push(data)
+        case list():
+            return serialize_list(data)
+        case set():
+            return serialize_set(data)
+        case BulkError():
+            return serialize_bulk_error(data)  # Simple
+        case Error():
+            return serialize_error(data)
+        # case float():
+        #     return float():
+        # case ("(", _):
+        #     # return big_numbers()
+        # case ("=", _):
+        #     # return verbatim_strings()
+        # case ("~", _):
+        #     # return sets()
+        case _:
+            return serialize_null()
+
+
+def handle_exceptions(func):
+    @wraps(func)
+    def inner(*args, **kwargs):
+        try:
+            rv = func(*args, **kwargs)
+            return rv
+        except Exception as e:
+            return CommandType.Error, serialize_error(Error(str(e)))
+
+    return inner
+
+
+def command_keys(command: str, body: list) -> tuple[list, bool]:
+    """keys a command reads or writes, and whether it writes them"""
+    match command.upper():
+        case (
+            CommandType.Set
+            | CommandType.Pexpireat
+            | CommandType.Incr
+            | CommandType.Decr
+            | CommandType.Incrby
+            | CommandType.Decrby
+            | CommandType.Incrbyfloat
+            | CommandType.Lpush
+            | CommandType.Rpush
+            | CommandType.Lpop
+            | CommandType.Rpop
+            | CommandType.Hset
+            | CommandType.Hmset
+            | CommandType.Hincrby
+            | CommandType.Sadd
+            | CommandType.Srem
+            | CommandType.Setbit
+            | CommandType.Xadd
+            | CommandType.Xtrim
+            | CommandType.Xack
+            | CommandType.Xclaim
+            | CommandType.Xsetid
+            | CommandType.Sinterstore
+            | CommandType.Sunionstore
+            | CommandType.Sdiffstore
+            | CommandType.Move
+        ):
+            return body[:1], True
+        case CommandType.Del:
+            return list(body), True
+        case CommandType.Mset | CommandType.Msetnx:
+            return body[::2], True
+        case CommandType.Bitop | CommandType.Xgroup:
+            return body[1:2], True
+        case CommandType.Xreadgroup:
+            streams = body[[str(x).lower() for x in body].index("streams") + 1 :]
+            return streams[: len(streams) // 2], True
+        case CommandType.Xread:
+            streams = body[[str(x).lower() for x in body].index("streams") + 1 :]
+            return streams[: len(streams) // 2], False
+        case (
+            CommandType.Get
+            | CommandType.Llen
+            | CommandType.Lrange
+            | CommandType.Hget
+            | CommandType.Hmget
+            | CommandType.Hgetall
+            | CommandType.Sismember
+            | CommandType.Scard
+            | CommandType.Smembers
+            | CommandType.Getbit
+            | CommandType.Bitcount
+            | CommandType.Bitpos
+            | CommandType.Type
+            | CommandType.Xrange
+            | CommandType.Xlen
+            | CommandType.Xpending
+        ):
+            return body[:1], False
+        case (
+            CommandType.Mget
+            | CommandType.Exists
+            | CommandType.Sinter
+            | CommandType.Sunion
+            | CommandType.Sdiff
+        ):
+            return list(body), False
+        case CommandType.Sintercard:
+            return body[1 : int(body[0]) + 1], False
+        case CommandType.Eval | CommandType.Evalsha:
+            # scripts may write any of their keys
+            return body[2 : int(body[1]) + 2], True
+        case CommandType.Object:
+            return body[1:2], False
+        case CommandType.Flushdb | CommandType.Flushall | CommandType.Swapdb:
+            # no single key, they take every stripe and are logged like any write
+            return [], True
+        case _:
+            return [], False
+
+
+# keyless commands that never touch the keyspace, the rest lock every stripe
+UNLOCKED_COMMANDS = {
+    CommandType.Ping.value,
+    CommandType.Echo.value,
+    CommandType.Config.value,
+    CommandType.Info.value,
+    CommandType.Hotkeys.value,
+    CommandType.Script.value,
+    CommandType.Select.value,
+}
+
+
+def lock_keys(command: str, body: list) -> list | None:
+    """keys whose lock stripes a command needs, None when it needs all of them"""
+    match command.upper():
+        case CommandType.Sinterstore | CommandType.Sunionstore | CommandType.Sdiffstore:
+            # command_keys only lists what is written, the sources are read too
+            return list(body)
+        case CommandType.Bitop:
+            return body[1:]
+        case CommandType.Eval | CommandType.Evalsha:
+            # call/pcall may reach keys the script never declared, it runs alone
+            return None
+        case x:
+            keys, _ = command_keys(command, body)
+            if keys or x in UNLOCKED_COMMANDS:
+                return keys
+            return None
+
+
+@handle_exceptions
+def handle_command(
+    command: str, body: list, store: Redis
+) -> tuple[CommandType, str | map]:
+    keys, write = command_keys(command, body)
+    if keys:
+        store.hotkeys.record(keys)
+    rv = dispatch_command(command, body, store)
+    if write and rv[0] != CommandType.Error:
+        store.touch(keys)
+
+    return rv
+
+
+def dispatch_command(
+    command: str, body: list, store: Redis
+) -> tuple[CommandType, str | map]:
+    match command.upper():
+        case CommandType.Ping:
+            return CommandType.Ping, serialize_data("PONG")
+        case CommandType.Echo:
+            rv = serialize_data(body[0])
+            return CommandType.Echo, rv
+        case CommandType.Exists:
+            resp = store.exists(body)
+            rv = serialize_data(resp)
+            return CommandType.Exists, rv
+        case CommandType.Del:
+            resp = store.del_keys(body)
+            return CommandType.Del, serialize_data(resp)
+        case CommandType.Mget:
+            resp = store.mget(body)
+            return CommandType.Mget, serialize_data(resp)
+        case CommandType.Mset:
+            resp = store.mset(body)
+            return CommandType.Mset, serialize_data(resp)
+        case CommandType.Msetnx:
+            resp = store.msetnx(body)
+            return CommandType.Msetnx, serialize_data(resp)
+        case CommandType.Set:
+            args = body[2:]
+            expiry = None
+            if args and args[0].lower() == "px":
+                expiry = int(args[1]) * 1000
+
+            resp = store.set(body[0], body[1], expiry)
+            rv = serialize_data(resp)
+            return CommandType.Set, rv
+        case CommandType.Pexpireat:
+            resp = store.pexpireat(body[0], int(body[1]))
+            return CommandType.Pexpireat, serialize_data(resp)
+        case CommandType.Get:
+            rv = serialize_data(store.get(body[0]))
+            return CommandType.Get, rv
+        case CommandType.Incr:
+            resp = store.incr(body[0])
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = serialize_data(
+                    Error(
+                        f"Cannot increment data for key={body[0]}."
+                        f" Current value stored: {store.get(body[0])!r}"
+                    )
+                )
+            return CommandType.Incr, rv
+        case CommandType.Decr:
+            resp = store.decr(body[0])
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = serialize_data(
+                    Error(
+                        f"Cannot decrement data for key={body[0]}."
+                        f" Current value stored: {store.get(body[0])!r}"
+                    )
+                )
+            return CommandType.Decr, rv
+        case CommandType.Incrby | CommandType.Decrby:
+            ctype = CommandType(command.upper())
+            by = int(body[1]) if ctype == CommandType.Incrby else -int(body[1])
+            resp = store.incrby(body[0], by)
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = serialize_data(
+                    Error(
+                        f"Cannot increment data for key={body[0]}."
+                        f" Current value stored: {store.get(body[0])!r}"
+                    )
+                )
+            return ctype, rv
+        case CommandType.Incrbyfloat:
+            resp = store.incrbyfloat(body[0], float(body[1]))
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = serialize_data(
+                    Error(
+                        f"Cannot increment data for key={body[0]}."
+                        f" Current value stored: {store.get(body[0])!r}"
+                    )
+                )
+            return CommandType.Incrbyfloat, rv
+        case CommandType.Lpush:
+            resp = store.lpush(body[0], body[1:])
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = serialize_data(
+                    Error(
+                        f"Cannot perform LPUSH for key={body[0]}."
+                        f" Current value stored: {store.get(body[0])!r}"
+                    )
+                )
+            return CommandType.Lpush, rv
+        case CommandType.Rpush:
+            resp = store.rpush(body[0], body[1:])
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = serialize_data(
+                    Error(
+                        f"Cannot perform RPUSH for key={body[0]}."
+                        f" Current value stored: {store.get(body[0])!r}"
+                    )
+                )
+            return CommandType.Rpush, rv
+        case CommandType.Lpop:
+            raise NotImplementedError()
+        case CommandType.Rpop:
+            raise NotImplementedError()
+        case CommandType.Llen:
+            resp = store.llen(body[0])
+            rv = serialize_data(resp)
+            return CommandType.Llen, rv
+        case CommandType.Lrange:
+            resp = store.lrange(body[0], int(body[1]), int(body[2]))
+            rv = serialize_data(resp)
+            return CommandType.Lrange, rv
+        case CommandType.Hset:
+            resp = store.hset(body[0], body[1:])
+            rv = serialize_data(resp)
+            return CommandType.Hset, rv
+        case CommandType.Hmset:
+            resp = store.hmset(body[0], body[1:])
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = handle_err(CommandType.Hmset.value, body, ErrorType.WrongType)
+            return CommandType.Hmset, rv
+        case CommandType.Hget:
+            resp = store.hget(body[0], body[1])
+            rv = serialize_data(resp)
+            return CommandType.Hget, rv
+        case CommandType.Hmget:
+            resp = store.hmget(body[0], body[1:])
+            rv = serialize_data(resp)
+            return CommandType.Hmget, rv
+        case CommandType.Hgetall:
+            resp = store.hgetall(body[0])
+            rv = serialize_data(resp)
+            return CommandType.Hgetall, rv
+        case CommandType.Hincrby:
+            raise NotImplementedError("Not yet implemented: HINCRBY")
+        case CommandType.Sadd:
+            resp = store.sadd(body[0], body[1:])
+            rv = serialize_data(resp)
+            return CommandType.Sadd, rv
+        case CommandType.Srem:
+            resp = store.srem(body[0], body[1:])
+            rv = serialize_data(resp)
+            return CommandType.Srem, rv
+        case CommandType.Sismember:
+            resp = store.sismember(body[0], body[1])
+            rv = serialize_data(resp)
+            return CommandType.Sismember, rv
+        case CommandType.Sinter:
+            resp = store.sinter(body[0], body[1:])
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = handle_err(CommandType.Sinter.value, body, ErrorType.WrongType)
+            return CommandType.Sinter, rv
+        case CommandType.Sintercard:
+            numkeys = int(body[0])
+            keys, rest = body[1 : numkeys + 1], body[numkeys + 1 :]
+            limit = 0
+            if rest and str(rest[0]).upper() == "LIMIT":
+                limit = int(rest[1])
+            resp = store.sintercard(keys, limit)
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = handle_err(CommandType.Sintercard.value, body, ErrorType.WrongType)
+            return CommandType.Sintercard, rv
+        case CommandType.Sunion:
+            resp = store.sunion(body)
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = handle_err(CommandType.Sunion.value, body, ErrorType.WrongType)
+            return CommandType.Sunion, rv
+        case CommandType.Sdiff:
+            resp = store.sdiff(body)
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = handle_err(CommandType.Sdiff.value, body, ErrorType.WrongType)
+            return CommandType.Sdiff, rv
+        case CommandType.Sinterstore:
+            resp = store.sinterstore(body[0], body[1:])
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = handle_err(
+                    CommandType.Sinterstore.value, body, ErrorType.WrongType
+                )
+            return CommandType.Sinterstore, rv
+        case CommandType.Sunionstore:
+            resp = store.sunionstore(body[0], body[1:])
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = handle_err(
+                    CommandType.Sunionstore.value, body, ErrorType.WrongType
+                )
+            return CommandType.Sunionstore, rv
+        case CommandType.Sdiffstore:
+            resp = store.sdiffstore(body[0], body[1:])
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = handle_err(CommandType.Sdiffstore.value, body, ErrorType.WrongType)
+            return CommandType.Sdiffstore, rv
+        case CommandType.Scard:
+            resp = store.scard(body[0])
+            rv = serialize_data(resp)
+            return CommandType.Scard, rv
+        case CommandType.Smembers:
+            resp = store.smembers(body[0])
+            rv = serialize_data(resp)
+            return CommandType.Smembers, rv
+        case CommandType.Setbit:
+            resp = store.setbit(body[0], int(body[1]), int(body[2]))
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = handle_err(CommandType.Setbit.value, body, ErrorType.WrongType)
+            return CommandType.Setbit, rv
+        case CommandType.Getbit:
+            resp = store.getbit(body[0], int(body[1]))
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = handle_err(CommandType.Getbit.value, body, ErrorType.WrongType)
+            return CommandType.Getbit, rv
+        case CommandType.Bitcount:
+            start, end = None, None
+            unit = "BYTE"
+            if len(body) >= 3:
+                start, end = int(body[1]), int(body[2])
+            if len(body) >= 4:
+                unit = body[3]
+            resp = store.bitcount(body[0], start, end, unit)
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = handle_err(CommandType.Bitcount.value, body, ErrorType.WrongType)
+            return CommandType.Bitcount, rv
+        case CommandType.Bitop:
+            resp = store.bitop(body[0], body[1], body[2:])
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = handle_err(CommandType.Bitop.value, body, ErrorType.WrongType)
+            return CommandType.Bitop, rv
+        case CommandType.Bitpos:
+            start = int(body[2]) if len(body) >= 3 else None
+            end = int(body[3]) if len(body) >= 4 else None
+            resp = store.bitpos(body[0], int(body[1]), start, end)
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = handle_err(CommandType.Bitpos.value, body, ErrorType.WrongType)
+            return CommandType.Bitpos, rv
+        case CommandType.Eval | CommandType.Evalsha:
+            ctype = CommandType(command.upper())
+            numkeys = int(body[1])
+            keys, argv = body[2 : numkeys + 2], body[numkeys + 2 :]
+            if ctype == CommandType.Eval:
+                resp = store.eval(body[0], keys, argv)
+            else:
+                resp = store.evalsha(body[0], keys, argv)
+            return ctype, serialize_data(resp)
+        case CommandType.Script:
+            resp = store.handle_script(body[0], *body[1:])
+            return CommandType.Script, serialize_data(resp)
+        case CommandType.Client:
+            return CommandType.Client, serialize_data("Ok")
+        case CommandType.Object:
+            match body[0].upper():
+                case "ENCODING":
+                    resp = store.object_encoding(body[1])
+                case x:
+                    raise NotImplementedError(f"OBJECT {x!r} not implemented")
+            return CommandType.Object, serialize_data(resp)
+        case CommandType.Config:
+            resp = store.handle_config(body[0], *body[1:])
+            return CommandType.Config, serialize_data(resp)
+        case CommandType.Bgrewriteaof:
+            # runs inline, keyless commands hold every lock stripe
+            resp = store.rewrite_aof()
+            return CommandType.Bgrewriteaof, serialize_data(resp)
+        case CommandType.Keys:
+            resp = store.keys(body[0], *body[1:])
+            return CommandType.Keys, serialize_data(resp)
+        case CommandType.Info:
+            resp = store._bulk(store.info(*body[:1]))
+            return CommandType.Info, serialize_data(resp)
+        case CommandType.Hotkeys:
+            resp = store.hottest(*body)
+            return CommandType.Hotkeys, serialize_data(resp)
+        case CommandType.Select:
+            resp = store.select(body[0])
+            return CommandType.Select, serialize_data(resp)
+        case CommandType.Swapdb:
+            resp = store.swapdb(body[0], body[1])
+            return CommandType.Swapdb, serialize_data(resp)
+        case CommandType.Flushdb:
+            resp = store.flushdb(*body)
+            return CommandType.Flushdb, serialize_data(resp)
+        case CommandType.Flushall:
+            resp = store.flushall(*body)
+            return CommandType.Flushall, serialize_data(resp)
+        case CommandType.Dbsize:
+            resp = store.dbsize()
+            return CommandType.Dbsize, serialize_data(resp)
+        case CommandType.Move:
+            resp = store.move(body[0], body[1])
+            return CommandType.Move, serialize_data(resp)
+        case CommandType.Type:
+            resp = store.entry_type(body[0])
+            return CommandType.Type, serialize_str(resp)
+        case CommandType.Xadd:
+            trim, rest = parse_trim_args(body[1:])
+            resp = store.xadd(body[0], rest[0], *rest[1:], trim=trim)
+            return CommandType.Xadd, serialize_data(resp)
+        case CommandType.Xlen:
+            resp = store.xlen(body[0])
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = handle_err(CommandType.Xlen.value, body, ErrorType.WrongType)
+            return CommandType.Xlen, rv
+        case CommandType.Xtrim:
+            trim, _ = parse_trim_args(body[1:])
+            if trim is None:
+                raise ValueError("syntax error, expected MAXLEN or MINID")
+            resp = store.xtrim(body[0], *trim)
+            rv = serialize_data(resp)
+            if resp is None:
+                rv = handle_err(CommandType.Xtrim.value, body, ErrorType.WrongType)
+            return CommandType.Xtrim, rv
+        case CommandType.Xrange:
+            resp = store.xrange(body[0], body[1], body[2])
+            return CommandType.Xrange, serialize_data(resp)
+        case CommandType.Xread:
+            block, count = None, None
+            lowered = [x.lower() for x in body]
+            stream_start = lowered.index("streams") + 1
+            if "block" in lowered:
+                block = int(lowered[lowered.index("block") + 1])
+
+            if "count" in lowered:
+                count = int(lowered[lowered.index("count") + 1])
+
+            logger.debug(
+                f"[handle_command]: XREAD: {block=} | {count=} | {stream_start=} | {lowered=}"
+            )
+            resp = store.xread(count, block, *body[stream_start:])
+            logger.debug(f"[handle_command]: XREAD: got {resp=}")
+            if isinstance(resp, Generator):
+                return CommandType.Blocking, map(serialize_data, resp)
+
+            return CommandType.Xread, serialize_data(resp)
+        case CommandType.Xgroup:
+            resp = store.xgroup(body[0], body[1], body[2], *body[3:])
+            return CommandType.Xgroup, serialize_data(resp)
+        case CommandType.Xreadgroup:
+            block, count = None, None
+            lowered = [str(x).lower() for x in body]
+            assert lowered[0] == "group", f"Expected GROUP, got {body[0]!r}"
+            stream_start = lowered.index("streams") + 1
+            options = lowered[3 : stream_start - 1]
+            if "block" in options:
+                block = int(options[options.index("block") + 1])
+
+            if "count" in options:
+                count = int(options[options.index("count") + 1])
+
+            resp = store.xreadgroup(
+                body[1], body[2], count, block, "noack" in options, *body[stream_start:]
+            )
+            return CommandType.Xreadgroup, serialize_data(resp)
+        case CommandType.Xack:
+            resp = store.xack(body[0], body[1], body[2:])
+            return CommandType.Xack, serialize_data(resp)
+        case CommandType.Xpending:
+            resp = store.xpending(body[0], body[1], *body[2:])
+            return CommandType.Xpending, serialize_data(resp)
+        case CommandType.Xclaim:
+            ids, options = parse_xclaim_args(body[4:])
+            resp = store.xclaim(body[0], body[1], body[2], int(body[3]), ids, **options)
+            return CommandType.Xclaim, serialize_data(resp)
+        case CommandType.Xsetid:
+            resp = store.xsetid(body[0], body[1])
+            return CommandType.Xsetid, serialize_data(resp)
+        case x:
+            raise NotImplementedError("[handle_command]", f"NotImplementedError: {x=}")
+
+
+def replay_aof(store: Redis, hist: str) -> list:
+    """
+    runs the commands of an AOF tail. entries are raw RESP framed by their
+    lengths, so values may hold newlines. older logs kept one entry per line
+    with escaped CRLFs, those are unescaped and the line breaks skipped
+    """
+    if "\r\n" not in hist:
+        hist = hist.replace("\\r\\n", "\r\n")
+
+    buf = hist.encode("utf-8", WIRE_ERRORS)
+    rv, pos = [], 0
+    while pos < len(buf):
+        if buf[pos : pos + 1] == b"\n":
+            pos += 1
+            continue
+        try:
+            end = frame_resp(buf, pos)
+        except ValueError:
+            end = -1
+        if end < 0:
+            logger.warning(f"Truncated AOF, dropping {len(buf) - pos} trailing bytes")
+            break
+
+        query = buf[pos:end].decode("utf-8", WIRE_ERRORS)
+        pos = end
+        res: list = parse_data(parse_crlf(query))  # type: ignore
+        try:
+            # logs from before BLOCK was stripped must not wait during recovery
+            res = without_block(res)
+            got = handle_command(res[0], res[1:], store)
+            rv.append(got)
+        except Exception as e:
+            logger.warning(f"Failed to recover {query=} with error: {e=}")
+
+    return rv
+
+
+def parse_aof(store: Redis):
+    aof = Redis._aof_file()
+    if not aof.exists():
+        return
+
+    with aof.open("rb") as f:
+        if f.read(5) == b"REDIS":
+            # hybrid file: bulk load the RDB preamble, then replay the command tail
+            f.seek(0)
+            RdbParser(aof, store).load(f)
+        else:
+            f.seek(0)
+        hist = f.read().decode("utf-8", WIRE_ERRORS)
+        store._aof_base_size = f.tell()
+
+    rv = replay_aof(store, hist)
+    # the log continues in whichever db its last SELECT left the replay
+    store._aof_db = store.db
+    store.select(0)
+    return rv
+
+
+def recover(store: Redis):
+    # the snapshot is older than anything the AOF recorded, so it goes first
+    RdbParser(store._rdb_file(), store).parse()
+    parse_aof(store)
+
+
+def is_blocking(res: list) -> bool:
+    command = str(res[0]).upper()
+    if command not in (CommandType.Xread.value, CommandType.Xreadgroup.value):
+        return False
+
+    return "block" in [str(x).lower() for x in res[1:]]
+
+
+def aof_entry(data: str, res: list, store: Redis) -> str:
+    """the query as logged, EVALSHA becomes EVAL so a replay needs no script cache"""
+    if str(res[0]).upper() != CommandType.Evalsha.value:
+        return data
+
+    src = store.script_sources.get(str(res[1]).lower())
+    if src is None:
+        return data
+
+    return serialize_data([bulk_string(str(x)) for x in ["EVAL", src, *res[2:]]])
+
+
+def without_block(res: list) -> list:
+    """the command with its BLOCK option dropped, what gets logged and replayed"""
+    lowered = [str(x).lower() for x in res]
+    end = lowered.index("streams") if "streams" in lowered else len(res)
+    if "block" not in lowered[:end]:
+        return res
+
+    i = lowered.index("block")
+    return res[:i] + res[i + 2 :]
+
+
+def block_xreadgroup(res: list, keys: list | None, store: Redis):
+    """
+    polls XREADGROUP without BLOCK until it delivers or times out. every poll
+    holds the stripe locks like any write, and the final one is logged under
+    the same hold, so the AOF never sees BLOCK and keeps the delivery ordered
+    against XACK/XCLAIM from other clients
+    """
+    lowered = [str(x).lower() for x in res]
+    block = int(res[lowered.index("block") + 1])
+    cmd = without_block(res)
+    query = serialize_data([bulk_string(str(x)) for x in cmd])
+    deadline = time.monotonic() + block / 1e3
+    while True:
+        with store.locked(keys):
+            ctype, rv = handle_command(cmd[0], cmd[1:], store)
+            done = rv != serialize_null() or (block and time.monotonic() >= deadline)
+            if ctype != CommandType.Error and done:
+                store.save(query)
+        if ctype == CommandType.Error or done:
+            store.maybe_rewrite_aof()
+            return ctype, rv
+        time.sleep(0.1)
+
+
+class Session:
+    """per connection state: protocol version, MULTI queue, WATCHed keys, tracking"""
+
+    ids = count(1)
+    queue: list[tuple[str, list]] | None
+    watched: dict[tuple[int, str], tuple[int, int]]
+
+    def __init__(self, client: socket.socket | None = None):
+        self.id = next(self.ids)
+        self.client = client
+        self.protocol = 2
+        self.db = 0
+        self.tracking = False
+        self.queue = None
+        self.watched = {}
+        # replaces the direct socket write when an io thread owns the socket
+        self.writer = None
+        # invalidations are pushed from other clients' threads
+        self._send_lock = Lock()
+
+    def reset(self):
+        self.queue = None
+        self.watched = {}
+
+    def send(self, data: str):
+        if self.writer is not None:
+            return self.writer(data)
+
+        if self.client is None:
+            return
+
+        with self._send_lock:
+            self.client.sendall(data.encode("utf-8", WIRE_ERRORS))
+
+    def push(self, data: "Push"):
+        try:
+            self.send(serialize_data(data))
+        except OSError as e:
+            logger.warning(f"Failed to push {data!r} to client {self.id}: {e}")
+
+
+def hello(session: Session, protover=None) -> dict | list:
+    if protover is not None:
+        if str(protover) not in ("2", "3"):
+            raise ValueError("NOPROTO unsupported protocol version")
+        session.protocol = int(protover)
+
+    info = {
+        "server": "literedis",
+        "version": "0.0.1",
+        "proto": session.protocol,
+        "id": session.id,
+        "mode": "standalone",
+        "role": "master",
+        "modules": [],
+    }
+    if session.protocol == 3:
+        return info
+
+    rv = []
+    for key, val in info.items():
+        rv.extend([key, val])
+    return rv
+
+
+def client_tracking(store: Redis, session: Session, args: list) -> str:
+    options = [str(x).upper() for x in args]
+    assert options and options[0] in ("ON", "OFF"), f"Invalid {args=}"
+    store.untrack(session)
+    session.tracking = False
+    if options[0] == "OFF":
+        return "OK"
+
+    if session.protocol != 3:
+        raise ValueError("CLIENT TRACKING needs RESP3, switch with HELLO 3")
+
+    prefixes = [args[i + 1] for i, x in enumerate(options) if x == "PREFIX"]
+    if "BCAST" in options:
+        with store._tracking_lock:
+            for prefix in prefixes or [""]:
+                store.bcast.setdefault(prefix, set()).add(session)
+        return "OK"
+
+    if prefixes:
+        raise ValueError("PREFIX option requires BCAST mode to be enabled")
+
+    session.tracking = True
+    return "OK"
+
+
+def exec_transaction(store: Redis, session: Session) -> tuple[CommandType, str]:
+    queue = session.queue or []
+    watched = session.watched
+    session.reset()
+    keys: list | None = [key for _, key in watched]
+    for _, res in queue:
+        needed = lock_keys(res[0], res[1:])
+        keys = None if needed is None or keys is None else keys + needed
+
+    with store.locked(keys):
+        changed = (store.version(key, db) != ver for (db, key), ver in watched.items())
+        if any(changed):
+            # a watched key changed since WATCH, abort without running anything
+            return CommandType.Exec, serialize_null()
+
+        store.select(session.db)
+        replies = []
+        writes = []
+        for data, res in queue:
+            _, rv = handle_command(res[0], res[1:], store)
+            replies.append(rv)
+            if command_keys(res[0], res[1:])[1]:
+                writes.append((store.db, aof_entry(data, res, store)))
+        # a queued SELECT sticks for the connection, like it would outside MULTI
+        session.db = store.db
+
+        store.save_batch(writes)
+
+    store.maybe_rewrite_aof()
+    return CommandType.Exec, f"*{len(replies)}\r\n" + "".join(replies)
+
+
+def handle_session(
+    data: str, res: list, store: Redis, session: Session
+) -> tuple[CommandType, str] | None:
+    """handles commands acting on the connection itself, None for everything else"""
+    command = str(res[0]).upper()
+    in_multi = session.queue is not None
+    match command:
+        case CommandType.Hello:
+            resp = hello(session, *res[1:2])
+            return CommandType.Hello, serialize_data(resp)
+        case CommandType.Client if len(res) > 1 and str(res[1]).upper() == "TRACKING":
+            resp = client_tracking(store, session, res[2:])
+            return CommandType.Client, serialize_str(resp)
+        case CommandType.Multi:
+            if in_multi:
+                raise ValueError("MULTI calls can not be nested")
+            session.queue = []
+            return CommandType.Multi, serialize_str("OK")
+        case CommandType.Exec:
+            if not in_multi:
+                raise ValueError("EXEC without MULTI")
+            return exec_transaction(store, session)
+        case CommandType.Discard:
+            if not in_multi:
+                raise ValueError("DISCARD without MULTI")
+            session.reset()
+            return CommandType.Discard, serialize_str("OK")
+        case CommandType.Watch:
+            if in_multi:
+                raise ValueError("WATCH inside MULTI is not allowed")
+            for key in res[1:]:
+                session.watched.setdefault(
+                    (session.db, key), store.version(key, session.db)
+                )
+            return CommandType.Watch, serialize_str("OK")
+        case CommandType.Select if not in_multi:
+            session.db = store._db_index(res[1])
+            return CommandType.Select, serialize_str("OK")
+        case CommandType.Unwatch:
+            session.watched = {}
+            return CommandType.Unwatch, serialize_str("OK")
+        case _ if in_multi:
+            if is_blocking(res):
+                # EXEC holds the stripes, like redis a queued BLOCK never waits
+                res = without_block(res)
+                data = serialize_data([bulk_string(str(x)) for x in res])
+            session.queue.append((data, res))  # type: ignore
+            return CommandType.Queued, serialize_str("QUEUED")
+        case _:
+            return None
+
+
+def get_response(data, store: Redis, session: Session | None = None):
+    tokens = parse_crlf(data)
+    res = parse_data(tokens)
+    logger.debug(f"{res=}")
+    match res:
+        case list() if len(res) > 0:
+            if session is not None:
+                rv = handle_exceptions(handle_session)(data, res, store, session)
+                if rv is not None:
+                    return rv
+                store.select(session.db)
+
+            keys = lock_keys(res[0], res[1:])
+            if is_blocking(res):
+                # blocking reads poll for other clients' writes, holding the
+                # lock while waiting would starve them
+                if str(res[0]).upper() == CommandType.Xreadgroup.value:
+                    return block_xreadgroup(res, keys, store)
+                # XREAD changes nothing, so it is not logged
+                return handle_command(res[0], res[1:], store)
+
+            with store.locked(keys):
+                rv = handle_command(res[0], res[1:], store)
+                keys, write = command_keys(res[0], res[1:])
+                if write:
+                    # logged after running, an auto rewrite then snapshots this write too
+                    store.save(aof_entry(data, res, store))
+                elif session is not None and session.tracking:
+                    store.track(keys, session)
+            store.maybe_rewrite_aof()
+            return rv
+        case _:
+            return (
+                None,
+                Error(
+                    f"Invalid data recieved from client. Expected list, got {data=}"
+                ).ser(),
+            )
+
+
+def read_requests(client: socket.socket) -> Generator[list[str], None, None]:
+    """yields the complete requests of every read, a pipelined batch comes as one list"""
+    buf = bytearray()
+    client.settimeout(60.0)
+    while chunk := client.recv(65536):
+        buf += chunk
+        pos, batch = 0, []
+        while (end := frame_resp(buf, pos)) > 0:
+            batch.append(buf[pos:end].decode("utf-8", WIRE_ERRORS))
+            pos = end
+        del buf[:pos]
+        if batch:
+            yield batch
+
+
+def handle_client(client: socket.socket, store: Redis):
+    logger.info(f"Client connected: {client.getpeername()}")
+    session = Session(client)
+    for batch in read_requests(client):
+        logger.debug(f"Got data: {batch=}")
+        replies = []
+        try:
+            for data in batch:
+                ctype, res = get_response(data, store, session)
+                # handle blocking commands like xread with block = 0
+                if ctype == CommandType.Blocking:
+                    logger.debug(f"handle_client: blocking call got {res=}")
+                    if replies:
+                        session.send("".join(replies))
+                        replies.clear()
+                    for item in res:
+                        session.send(item)
+                else:
+                    logger.debug(f"handle_client: Response: {res=}")
+                    replies.append(res)
+            # pipelined replies go back in a single write
+            if replies:
+                session.send("".join(replies))
+        except Exception as e:
+            logger.exception(f"Invalid command: {batch}. Failed with error: {e}")
+            break
+
+    store.untrack(session)
+    client.close()
+
+
+def frame_resp(buf: bytes | bytearray, pos: int = 0) -> int:
+    """offset just past the RESP value starting at `pos`, -1 if it is incomplete"""
+    eol = buf.find(b"\r\n", pos)
+    if eol < 0:
+        return -1
+
+    kind = buf[pos : pos + 1]
+    if kind in (b"$", b"!", b"="):
+        size = int(buf[pos + 1 : eol])
+        end = eol + 2 if size < 0 else eol + 2 + size + 2
+        return end if len(buf) >= end else -1
+
+    if kind in (b"*", b"~", b"%", b">"):
+        size = int(buf[pos + 1 : eol])
+        end = eol + 2
+        for _ in range(size * 2 if kind == b"%" else max(size, 0)):
+            end = frame_resp(buf, end)
+            if end < 0:
+                return -1
+        return end
+
+    return eol + 2
+
+
+class Connection:
+    """a client socket owned by an IOThread, with its own in/out buffers"""
+
+    def __init__(self, client: socket.socket, io: "IOThread"):
+        self.client = client
+        self.io = io
+        self.session = Session(client)
+        self.session.writer = self.write
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.closed = False
+        # jobs held back while a blocking read of this client runs, replies stay in order
+        self.parked: deque | None = None
+
+    def write(self, data: str):
+        self.io.reply(self, data.encode("utf-8", WIRE_ERRORS))
+
+
+class IOThread(Thread):
+    """
+    Reads and frames requests for a batch of clients and writes their
+    replies back. Commands are never run here: every framed request is put
+    on `jobs` for the single executor (see `execute_jobs`).
+    """
+
+    def __init__(self, jobs: Queue):
+        super().__init__(daemon=True)
+        self.jobs = jobs
+        self.selector = selectors.DefaultSelector()
+        self.pending: Queue = Queue()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ)
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b"\0")
+        except BlockingIOError:
+            pass
+
+    def add(self, client: socket.socket) -> Connection:
+        conn = Connection(client, self)
+        self.pending.put((conn, None))
+        self._wake()
+        return conn
+
+    def reply(self, conn: Connection, data: bytes):
+        self.pending.put((conn, data))
+        self._wake()
+
+    def run(self):
+        while True:
+            for key, mask in self.selector.select():
+                if key.fileobj is self._wake_r:
+                    self._wake_r.recv(4096)
+                    continue
+
+                conn: Connection = key.data
+                if mask & selectors.EVENT_READ:
+                    self._read(conn)
+                if mask & selectors.EVENT_WRITE:
+                    self._flush(conn)
+
+            while not self.pending.empty():
+                conn, data = self.pending.get_nowait()
+                if conn.closed:
+                    continue
+                if data is None:
+                    conn.client.setblocking(False)
+                    self.selector.register(conn.client, selectors.EVENT_READ, conn)
+                    continue
+                conn.outbuf += data
+                self._flush(conn)
+
+    def _read(self, conn: Connection):
+        try:
+            data = conn.client.recv(1 << 16)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+
+        if not data:
+            return self._close(conn)
+
+        conn.inbuf += data
+        while conn.inbuf:
+            try:
+                end = frame_resp(conn.inbuf)
+            except ValueError:
+                # not RESP, hand over everything and let the parser reject it
+                end = len(conn.inbuf)
+            if end < 0:
+                break
+
+            self.jobs.put((conn, conn.inbuf[:end].decode("utf-8", WIRE_ERRORS)))
+            del conn.inbuf[:end]
+
+    def _flush(self, conn: Connection):
+        try:
+            sent = conn.client.send(conn.outbuf)
+            del conn.outbuf[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            return self._close(conn)
+
+        events = selectors.EVENT_READ
+        if conn.outbuf:
+            events |= selectors.EVENT_WRITE
+        self.selector.modify(conn.client, events, conn)
+
+    def _close(self, conn: Connection):
+        conn.closed = True
+        self.selector.unregister(conn.client)
+        conn.client.close()
+        # cleanup touches the store, so it goes through the executor too
+        self.jobs.put((conn, None))
+
+
+# queued by run_blocking once it is done, releases the jobs parked behind it
+RESUME = object()
+
+
+def execute_jobs(store: Redis, jobs: Queue):
+    """the single command executor fed by the io threads, runs commands in order"""
+    while True:
+        conn, data = jobs.get()
+        if data is RESUME:
+            backlog, conn.parked = conn.parked, None
+            while backlog and conn.parked is None:
+                execute_job(store, jobs, conn, backlog.popleft())
+            if conn.parked is not None:
+                conn.parked.extend(backlog)
+            continue
+
+        if conn.parked is not None:
+            conn.parked.append(data)
+            continue
+
+        execute_job(store, jobs, conn, data)
+
+
+def execute_job(store: Redis, jobs: Queue, conn: Connection, data: str | None):
+    if data is None:
+        store.untrack(conn.session)
+        return
+
+    if "block" in data.lower() and is_blocking(parse_data(parse_crlf(data))):
+        # a blocking read would stall every client, let it wait on its own and
+        # park this client's later commands until it replied
+        conn.parked = deque()
+        Thread(target=run_blocking, args=(data, store, conn, jobs), daemon=True).start()
+        return
+
+    try:
+        _, res = get_response(data, store, conn.session)
+        conn.session.send(res)
+    except Exception as e:
+        logger.exception(f"Invalid command: {data}. Failed with error: {e}")
+
+
+def run_blocking(data: str, store: Redis, conn: Connection, jobs: Queue):
+    try:
+        ctype, res = get_response(data, store, conn.session)
+        if ctype != CommandType.Blocking:
+            return conn.session.send(res)
+
+        for item in res:
+            if conn.closed:
+                break
+            conn.session.send(item)
+    except Exception as e:
+        logger.exception(f"Invalid command: {data}. Failed with error: {e}")
+    finally:
+        jobs.put((conn, RESUME))
+
+
+def serve_io_threads(sock: socket.socket, store: Redis, io_threads: int):
+    jobs: Queue = Queue()
+    ios = [IOThread(jobs) for _ in range(io_threads)]
+    for io in ios:
+        io.start()
+
+    def accept():
+        n = 0
+        while True:
+            client, _ = sock.accept()
+            ios[n % len(ios)].add(client)
+            n += 1
+
+    Thread(target=accept, daemon=True).start()
+    execute_jobs(store, jobs)
+
+
+def serve(host: str, port: int, store: Redis, io_threads: int = 0):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    addr = (host, port)
+    sock.bind(addr)
+    sock.listen(5)
+    if io_threads:
+        return serve_io_threads(sock, store, io_threads)
+
+    while True:
+        client, _ = sock.accept()
+        # TODO: get rid of threads
+        t = Thread(target=handle_client, args=(client, store))
+        t.start()
+
+
+# key prefixes keep each command on its own type so the mix never hits WRONGTYPE
+BENCH_COMMANDS = {
+    "set": lambda key, val: ["SET", f"key:{key}", val],
+    "get": lambda key, val: ["GET", f"key:{key}"],
+    "incr": lambda key, val: ["INCR", f"counter:{key}"],
+    "lpush": lambda key, val: ["LPUSH", f"list:{key}", val],
+    "xadd": lambda key, val: ["XADD", f"stream:{key}", "*", "field", val],
+}
+
+
+def parse_mix(spec: str) -> dict[str, int]:
+    """'set:3,get:7' -> {'set': 3, 'get': 7}, weights default to 1"""
+    mix = {}
+    for item in filter(None, spec.lower().split(",")):
+        name, _, weight = item.partition(":")
+        if name not in BENCH_COMMANDS:
+            raise ValueError(f"unknown bench command {name!r}")
+        mix[name] = int(weight or 1)
+
+    return mix
+
+
+def percentile(sorted_vals: list[float], q: float) -> float:
+    """nearest rank percentile of an already sorted list"""
+    if not sorted_vals:
+        return 0.0
+
+    rank = max(math.ceil(q * len(sorted_vals)), 1)
+    return sorted_vals[min(rank, len(sorted_vals)) - 1]
+
+
+def latency_summary(latencies: list[float]) -> dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        name: round(percentile(latencies, q) * 1000, 3)
+        for name, q in (("p50", 0.5), ("p99", 0.99), ("p999", 0.999), ("max", 1.0))
+    }
+
+
+def bench_client(
+    address: tuple[str, int],
+    mix: dict[str, int],
+    requests: int,
+    pipeline: int,
+    keyspace: int,
+    value: str,
+    seed: int | None,
+    start: Barrier,
+) -> tuple[dict[str, list[float]], int]:
+    """
+    sends `requests` commands in batches of `pipeline`, every command of a batch
+    is charged the batch round trip, like redis-benchmark does
+    """
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    latencies: dict[str, list[float]] = {name: [] for name in names}
+    errors = 0
+    with socket.create_connection(address) as sock:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        start.wait()
+        done = 0
+        while done < requests:
+            batch = rng.choices(names, weights, k=min(pipeline, requests - done))
+            payload = "".join(
+                serialize_data(
+                    list(
+                        map(
+                            bulk_string,
+                            BENCH_COMMANDS[name](rng.randrange(keyspace), value),
+                        )
+                    )
+                )
+                for name in batch
+            )
+            began = time.perf_counter()
+            sock.sendall(payload.encode("utf-8"))
+            buf, pos, pending = bytearray(), 0, len(batch)
+            while pending:
+                end = frame_resp(buf, pos)
+                if end < 0:
+                    chunk = sock.recv(65536)
+                    if not chunk:
+                        raise ConnectionError("server closed the connection")
+                    buf += chunk
+                    continue
+                errors += buf[pos : pos + 1] == b"-"
+                pos, pending = end, pending - 1
+            took = time.perf_counter() - began
+            for name in batch:
+                latencies[name].append(took)
+            done += len(batch)
+
+    return latencies, errors
+
+
+def run_bench(
+    host="localhost",
+    port=6379,
+    clients=50,
+    requests=100000,
+    pipeline=1,
+    keyspace=10000,
+    mix: dict[str, int] | None = None,
+    data_size=3,
+    seed: int | None = None,
+) -> dict:
+    mix = mix or {name: 1 for name in BENCH_COMMANDS}
+    value = "x" * data_size
+    # all connections are open before the clock starts
+    start = Barrier(clients + 1)
+    results: list = []
+    failures: list[str] = []
+
+    def run_client(args: tuple):
+        try:
+            results.append(bench_client(*args))
+        except BrokenBarrierError:
+            pass  # another client could not connect, nothing was sent
+        except OSError as e:
+            failures.append(f"{type(e).__name__}: {e}")
+            # a client that never reaches the barrier would hold everyone at it
+            start.abort()
+
+    threads = []
+    for i in range(clients):
+        share = requests // clients + (i < requests % clients)
+        args = (
+            (host, port),
+            mix,
+            share,
+            pipeline,
+            keyspace,
+            value,
+            None if seed is None else seed + i,
+            start,
+        )
+        t = Thread(target=run_client, args=(args,), daemon=True)
+        t.start()
+        threads.append(t)
+
+    try:
+        start.wait()
+    except BrokenBarrierError:
+        pass
+    began = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - began
+
+    by_command: dict[str, list[float]] = {name: [] for name in mix}
+    for latencies, _ in results:
+        for name, vals in latencies.items():
+            by_command[name].extend(vals)
+    every = [x for vals in by_command.values() for x in vals]
+    return {
+        "clients": clients,
+        "requests": len(every),
+        "pipeline": pipeline,
+        "keyspace": keyspace,
+        "data_size": data_size,
+        "mix": mix,
+        "elapsed_s": round(elapsed, 6),
+        "ops_per_sec": round(len(every) / elapsed, 2) if elapsed else 0.0,
+        "errors": sum(errors for _, errors in results),
+        "connection_errors": failures,
+        "latency_ms": latency_summary(every),
+        "commands": {
+            name: {"ops": len(vals), "latency_ms": latency_summary(vals)}
+            for name, vals in by_command.items()
+        },
+    }
+
+
+def bench(argv: list[str] | None = None):
+    parser = ArgumentParser(prog="literedis-bench")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("-p", "--port", type=int, default=6379)
+    parser.add_argument("-c", "--clients", type=int, default=50)
+    parser.add_argument("-n", "--requests", type=int, default=100000)
+    parser.add_argument("-P", "--pipeline", type=int, default=1)
+    parser.add_argument("-r", "--keyspace", type=int, default=10000)
+    parser.add_argument("-d", "--data-size", type=int, default=3)
+    parser.add_argument(
+        "-t",
+        "--tests",
+        default=",".join(BENCH_COMMANDS),
+        help="comma separated command mix with optional weights, e.g. set:3,get:7",
+    )
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("-o", "--output", help="write the JSON report here too")
+    args = parser.parse_args(argv)
+
+    report = run_bench(
+        args.host,
+        args.port,
+        args.clients,
+        args.requests,
+        args.pipeline,
+        args.keyspace,
+        parse_mix(args.tests),
+        args.data_size,
+        args.seed,
+    )
+    out = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(out + "\n")
+    print(out)
+    return report
+
+
+def main(argv: list[str] | None = None):
+    parser = ArgumentParser()
+    parser.add_argument("--serve", action="store_true")
+    parser.add_argument("--dir")
+    parser.add_argument("--dbfilename")
+    parser.add_argument(
+        "--io-threads",
+        type=int,
+        default=0,
+        help="socket io threads feeding a single command executor, 0 keeps a thread per client",
+    )
+    args = parser.parse_args(argv)
+
+    store = Redis()
+    if args.dir or args.dbfilename:
+        Redis.config["dir"] = args.dir
+        Redis.config["dbfilename"] = args.dbfilename
+
+    if args.serve:
+        host = "localhost"
+        port = 6379
+        logger.info(f"Server listening on {host=}, {port=}")
+        recover(store)
+        Redis.config["io-threads"] = args.io_threads
+        serve(host, port, store, args.io_threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+"""
+small literedis client, speaks RESP with the server's own encoder and parser
+
+    client = Client("localhost", 6379)
+    client.set("Foo", "1")
+    with client.pipeline() as pipe:
+        pipe.incr("Foo").get("Foo")
+    pipe.result  # [2, '2']
+
+AsyncClient mirrors it for asyncio code.
+"""
+
+import asyncio
+import socket
+from contextlib import asynccontextmanager, contextmanager
+from threading import Condition
+
+from literedis import (
+    WIRE_ERRORS,
+    Error,
+    bulk_string,
+    frame_resp,
+    parse_crlf,
+    parse_data,
+    serialize_data,
+)
+
+
+class ResponseError(Exception):
+    pass
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+def encode_command(args: tuple) -> bytes:
+    items = [x if isinstance(x, str) else str(x) for x in args]
+    return serialize_data(list(map(bulk_string, items))).encode("utf-8", WIRE_ERRORS)
+
+
+def decode_reply(frame: bytes | bytearray):
+    return parse_data(parse_crlf(frame.decode("utf-8", WIRE_ERRORS)))
+
+
+def check_reply(reply):
+    if isinstance(reply, Error):
+        raise ResponseError(reply.msg)
+
+    return reply
+
+
+class Commands:
+    """command helpers shared by clients and pipelines, all go through execute_command"""
+
+    def execute_command(self, *args):
+        raise NotImplementedError
+
+    def ping(self):
+        return self.execute_command("PING")
+
+    def echo(self, msg: str):
+        return self.execute_command("ECHO", msg)
+
+    def get(self, key: str):
+        return self.execute_command("GET", key)
+
+    def set(self, key: str, val, px: int | None = None):
+        extra = ("PX", px) if px is not None else ()
+        return self.execute_command("SET", key, val, *extra)
+
+    def mget(self, *keys: str):
+        return self.execute_command("MGET", *keys)
+
+    def mset(self, mapping: dict):
+        return self.execute_command("MSET", *[x for kv in mapping.items() for x in kv])
+
+    def delete(self, *keys: str):
+        return self.execute_command("DEL", *keys)
+
+    def exists(self, *keys: str):
+        return self.execute_command("EXISTS", *keys)
+
+    def incr(self, key: str):
+        return self.execute_command("INCR", key)
+
+    def incrby(self, key: str, amount: int):
+        return self.execute_command("INCRBY", key, amount)
+
+    def lpush(self, key: str, *vals):
+        return self.execute_command("LPUSH", key, *vals)
+
+    def rpush(self, key: str, *vals):
+        return self.execute_command("RPUSH", key, *vals)
+
+    def lrange(self, key: str, start: int, end: int):
+        return self.execute_command("LRANGE", key, start, end)
+
+    def hset(self, key: str, mapping: dict):
+        return self.execute_command(
+            "HSET", key, *[x for kv in mapping.items() for x in kv]
+        )
+
+    def hget(self, key: str, field: str):
+        return self.execute_command("HGET", key, field)
+
+    def hgetall(self, key: str):
+        return self.execute_command("HGETALL", key)
+
+    def sadd(self, key: str, *members):
+        return self.execute_command("SADD", key, *members)
+
+    def xadd(self, key: str, fields: dict, id_: str = "*"):
+        return self.execute_command(
+            "XADD", key, id_, *[x for kv in fields.items() for x in kv]
+        )
+
+
+class Connection:
+    def __init__(self, host: str, port: int, timeout: float | None = None):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buf = bytearray()
+
+    def send(self, payload: bytes):
+        self.sock.sendall(payload)
+
+    def read_reply(self):
+        while (end := frame_resp(self.buf)) < 0:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("server closed the connection")
+            self.buf += chunk
+
+        frame = self.buf[:end]
+        del self.buf[:end]
+        return decode_reply(frame)
+
+    def close(self):
+        self.sock.close()
+
+
+class ConnectionPool:
+    """thread safe LIFO pool, callers block once max_connections are checked out"""
+
+    def __init__(
+        self,
+        host="localhost",
+        port=6379,
+        max_connections: int | None = None,
+        timeout: float | None = None,
+    ):
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._idle: list[Connection] = []
+        self._in_use = 0
+        self._cond = Condition()
+
+    def get_connection(self) -> Connection:
+        with self._cond:
+            full = lambda: self.max_connections and self._in_use >= self.max_connections
+            if not self._cond.wait_for(lambda: self._idle or not full(), self.timeout):
+                raise PoolExhausted(f"no connection free after {self.timeout}s")
+
+            self._in_use += 1
+            if self._idle:
+                return self._idle.pop()
+
+        try:
+            # connect outside the lock, a slow handshake should not stall other threads
+            return Connection(self.host, self.port, self.timeout)
+        except BaseException:
+            self.release(None)
+            raise
+
+    def release(self, conn: Connection | None):
+        with self._cond:
+            self._in_use -= 1
+            if conn is not None:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.get_connection()
+        try:
+            yield conn
+        except BaseException:
+            # the reply stream may be out of sync, never hand this one out again
+            conn.close()
+            self.release(None)
+            raise
+        self.release(conn)
+
+    def disconnect(self):
+        with self._cond:
+            for conn in self._idle:
+                conn.close()
+            self._idle.clear()
+
+
+class Pipeline(Commands):
+    """
+    queues commands and sends them in a single write, replies come back in order.
+    leaving the `with` block executes whatever is still queued
+    """
+
+    def __init__(self, pool: ConnectionPool, raise_on_error=True):
+        self.pool = pool
+        self.raise_on_error = raise_on_error
+        self.commands: list[tuple] = []
+        self.result: list = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None and self.commands:
+            self.execute()
+
+    def __len__(self):
+        return len(self.commands)
+
+    def execute_command(self, *args):
+        self.commands.append(args)
+        return self
+
+    def execute(self) -> list:
+        commands, self.commands = self.commands, []
+        if not commands:
+            return []
+
+        payload = b"".join(map(encode_command, commands))
+        with self.pool.connection() as conn:
+            conn.send(payload)
+            replies = [conn.read_reply() for _ in commands]
+
+        if self.raise_on_error:
+            replies = [check_reply(reply) for reply in replies]
+        self.result = replies
+        return replies
+
+
+class Client(Commands):
+    def __init__(
+        self, host="localhost", port=6379, pool: ConnectionPool | None = None, **kwargs
+    ):
+        self.pool = pool or ConnectionPool(host, port, **kwargs)
+
+    def execute_command(self, *args):
+        with self.pool.connection() as conn:
+            conn.send(encode_command(args))
+            reply = conn.read_reply()
+        return check_reply(reply)
+
+    def pipeline(self, raise_on_error=True) -> Pipeline:
+        return Pipeline(self.pool, raise_on_error)
+
+    def close(self):
+        self.pool.disconnect()
+
+
+class AsyncConnection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.buf = bytearray()
+
+    @classmethod
+    async def open(cls, host: str, port: int) -> "AsyncConnection":
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def send(self, payload: bytes):
+        self.writer.write(payload)
+        await self.writer.drain()
+
+    async def read_reply(self):
+        while (end := frame_resp(self.buf)) < 0:
+            chunk = await self.reader.read(65536)
+            if not chunk:
+                raise ConnectionError("server closed the connection")
+            self.buf += chunk
+
+        frame = self.buf[:end]
+        del self.buf[:end]
+        return decode_reply(frame)
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+class AsyncConnectionPool:
+    def __init__(self, host="localhost", port=6379, max_connections: int | None = None):
+        self.host = host
+        self.port = port
+        self._idle: list[AsyncConnection] = []
+        self._slots = asyncio.Semaphore(max_connections) if max_connections else None
+
+    async def get_connection(self) -> AsyncConnection:
+        if self._slots:
+            await self._slots.acquire()
+        if self._idle:
+            return self._idle.pop()
+
+        try:
+            return await AsyncConnection.open(self.host, self.port)
+        except BaseException:
+            self.release(None)
+            raise
+
+    def release(self, conn: AsyncConnection | None):
+        if conn is not None:
+            self._idle.append(conn)
+        if self._slots:
+            self._slots.release()
+
+    @asynccontextmanager
+    async def connection(self):
+        conn = await self.get_connection()
+        try:
+            yield conn
+        except BaseException:
+            await conn.close()
+            self.release(None)
+            raise
+        self.release(conn)
+
+    async def disconnect(self):
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await conn.close()
+
+
+class AsyncPipeline(Pipeline):
+    def __init__(self, pool: AsyncConnectionPool, raise_on_error=True):
+        super().__init__(pool, raise_on_error)  # type: ignore
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, *_):
+        if exc_type is None and self.commands:
+            await self.execute()
+
+    async def execute(self) -> list:  # type: ignore
+        commands, self.commands = self.commands, []
+        if not commands:
+            return []
+
+        payload = b"".join(map(encode_command, commands))
+        async with self.pool.connection() as conn:  # type: ignore
+            await conn.send(payload)
+            replies = [await conn.read_reply() for _ in commands]
+
+        if self.raise_on_error:
+            replies = [check_reply(reply) for reply in replies]
+        self.result = replies
+        return replies
+
+
+class AsyncClient(Commands):
+    """every command helper returns a coroutine"""
+
+    def __init__(
+        self,
+        host="localhost",
+        port=6379,
+        pool: AsyncConnectionPool | None = None,
+        **kwargs,
+    ):
+        self.pool = pool or AsyncConnectionPool(host, port, **kwargs)
+
+    async def execute_command(self, *args):
+        async with self.pool.connection() as conn:
+            await conn.send(encode_command(args))
+            reply = await conn.read_reply()
+        return check_reply(reply)
+
+    def pipeline(self, raise_on_error=True) -> AsyncPipeline:
+        return AsyncPipeline(self.pool, raise_on_error)
+
+    async def close(self):
+        await self.pool.disconnect()
@@ -6,7 +6,12 @@ setup(
     description="small implementation of redis",
     author="creepysta",
     author_email="travisparker.thechoice93@gmail.com",
-    py_modules=["literedis"],
+    packages=["literedis"],
     python_requires=">=3.10",
-    entry_points={"console_scripts": ["literedis = literedis:main"]},
+    entry_points={
+        "console_scripts": [
+            "literedis = literedis:main",
+            "literedis-bench = literedis:bench",
+        ]
+    },
 )
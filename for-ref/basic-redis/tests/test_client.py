@@ -0,0 +1,108 @@
+import asyncio
+import socket
+import threading
+from pathlib import Path
+
+import pytest
+
+from literedis import Error, Redis, serve
+from literedis.client import (
+    AsyncClient,
+    Client,
+    ConnectionPool,
+    PoolExhausted,
+    ResponseError,
+)
+
+
+@pytest.fixture
+def port():
+    with socket.socket() as probe:
+        probe.bind(("localhost", 0))
+        port = probe.getsockname()[1]
+
+    threading.Thread(
+        target=serve, args=("localhost", port, Redis()), daemon=True
+    ).start()
+    for _ in range(50):
+        try:
+            socket.create_connection(("localhost", port)).close()
+            break
+        except ConnectionRefusedError:
+            threading.Event().wait(0.02)
+
+    yield port
+    Path("redis.aof").write_text("")
+
+
+def test_client(port):
+    client = Client(port=port)
+    assert client.ping() == "PONG"
+    assert client.set("Foo", "bar") == "OK"
+    assert client.get("Foo") == "bar"
+    assert client.set("Name", "héllo") == "OK"
+    assert client.get("Name") == "héllo"
+    assert client.execute_command("SETBIT", "bits", 0, 1) == 0
+    assert client.get("bits").encode("utf-8", "surrogateescape") == b"\x80"
+    assert client.incr("Count") == 1
+    assert client.rpush("list", "a", "b") == 2
+    assert client.lrange("list", 0, -1) == ["a", "b"]
+    with pytest.raises(ResponseError):
+        client.incr("Foo")
+    # the error reply left the connection usable and it went back to the pool
+    assert len(client.pool._idle) == 1
+    assert client.get("Foo") == "bar"
+    client.close()
+
+
+def test_pipeline(port):
+    client = Client(port=port)
+    with client.pipeline() as pipe:
+        pipe.set("Foo", "1").incr("Foo").incrby("Foo", 5).get("Foo")
+        assert len(pipe) == 4
+    assert pipe.result == ["OK", 2, 7, "7"]
+
+    pipe = client.pipeline(raise_on_error=False)
+    pipe.rpush("Foo", "x").get("Foo")
+    err, val = pipe.execute()
+    assert isinstance(err, Error)
+    assert val == "7"
+
+
+def test_pool_threads(port):
+    pool = ConnectionPool(port=port, max_connections=2)
+    client = Client(pool=pool)
+
+    def work():
+        for _ in range(50):
+            client.incr("Count")
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert client.get("Count") == "200"
+    assert len(pool._idle) <= 2
+
+
+def test_pool_exhausted(port):
+    pool = ConnectionPool(port=port, max_connections=1, timeout=0.05)
+    with pool.connection():
+        with pytest.raises(PoolExhausted):
+            pool.get_connection()
+    pool.disconnect()
+
+
+def test_async_client(port):
+    async def main():
+        client = AsyncClient(port=port, max_connections=2)
+        assert await client.set("Foo", "1") == "OK"
+        await asyncio.gather(*[client.incr("Foo") for _ in range(10)])
+        async with client.pipeline() as pipe:
+            pipe.incr("Foo").get("Foo")
+        await client.close()
+        return pipe.result
+
+    assert asyncio.run(main()) == [12, "12"]
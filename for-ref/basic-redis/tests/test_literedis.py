@@ -1,20 +1,43 @@
+import io
+import random
+import socket
+import threading
+import time
 from pathlib import Path
+from queue import Queue
 
 import pytest
 
 from literedis import (
     BulkString,
     CommandType,
+    CountMinSketch,
     Error,
+    HotKeys,
+    IOThread,
+    PendingEntries,
+    Push,
     RdbParser,
+    RdbWriter,
     Redis,
+    Session,
+    ShardedDict,
     Trie,
+    execute_jobs,
+    frame_resp,
+    get_response,
     handle_command,
+    lock_keys,
     parse_crlf,
     parse_data,
+    parse_mix,
+    percentile,
     recover,
+    run_bench,
     serialize_data,
+    serve,
 )
+from literedis.client import encode_command
 
 int_data = [
     (":+123\r\n", 123),
@@ -37,6 +60,7 @@ bulk_string_data = [
     ("$-1\r\n", None),
     ("$5\r\nhello\r\n", BulkString(5, "hello")),
     ("$11\r\nhello world\r\n", BulkString(11, "hello world")),
+    ("$6\r\nhéllo\r\n", BulkString(6, "héllo")),
 ]
 array_data = [
     ("*0\r\n", []),
@@ -254,6 +278,72 @@ def test_decr_with_prev(store: Redis):
     assert rv == 998
 
 
+def test_mset_mget(store: Redis):
+    cmd_type, res = handle_command("MSET", ["Foo", "1", "Bar", "baz"], store)
+    assert cmd_type == CommandType.Mset
+    assert parse_data(parse_crlf(res)) == "OK"
+    store.lpush("List", ["a"])
+    cmd_type, res = handle_command("MGET", ["Foo", "Missing", "Bar", "List"], store)
+    rv = parse_data(parse_crlf(res))
+    assert cmd_type == CommandType.Mget
+    assert rv == ["1", None, "baz", None]
+
+
+def test_msetnx(store: Redis):
+    store.set("Foo", "1")
+    cmd_type, res = handle_command("MSETNX", ["Foo", "2", "Bar", "3"], store)
+    assert cmd_type == CommandType.Msetnx
+    assert parse_data(parse_crlf(res)) == 0
+    assert store.get("Bar") is None
+    _, res = handle_command("MSETNX", ["Bar", "2", "Baz", "3"], store)
+    assert parse_data(parse_crlf(res)) == 1
+    assert store.mget(["Bar", "Baz"]) == ["2", "3"]
+
+
+def test_del(store: Redis):
+    store.mset(["Foo", "1", "Bar", "2"])
+    cmd_type, res = handle_command("DEL", ["Foo", "Bar", "Baz"], store)
+    assert cmd_type == CommandType.Del
+    assert parse_data(parse_crlf(res)) == 2
+    assert store.exists(["Foo", "Bar"]) == 0
+
+
+def test_int_encoded_string(store: Redis):
+    handle_command("SET", ["Foo", BulkString(2, "42")], store)
+    assert store.store["Foo"] == 42
+    assert store.get("Foo") == "42"
+    handle_command("SET", ["Bar", BulkString(3, "042")], store)
+    assert store.store["Bar"] == "042", "non canonical ints stay strings"
+
+
+@pytest.mark.parametrize(
+    "cmd,by,expected", [("INCRBY", "5", 15), ("DECRBY", "20", -10)]
+)
+def test_incrby(store: Redis, cmd, by, expected):
+    store.set("Foo", "10")
+    cmd_type, res = handle_command(cmd, ["Foo", by], store)
+    rv = parse_data(parse_crlf(res))
+    assert cmd_type == cmd
+    assert rv == expected
+    assert store.store["Foo"] == expected
+
+
+def test_incr_not_int(store: Redis):
+    store.set("Foo", "bar")
+    _, res = handle_command("INCR", ["Foo"], store)
+    assert isinstance(parse_data(parse_crlf(res)), Error)
+
+
+def test_incrbyfloat(store: Redis):
+    store.set("Foo", "10")
+    cmd_type, res = handle_command("INCRBYFLOAT", ["Foo", "0.5"], store)
+    assert cmd_type == CommandType.Incrbyfloat
+    assert parse_data(parse_crlf(res)) == "10.5"
+    _, res = handle_command("INCRBYFLOAT", ["Foo", "0.5"], store)
+    assert parse_data(parse_crlf(res)) == "11"
+    assert store.store["Foo"] == 11
+
+
 def test_lpush_no_prev(store: Redis):
     cmd_type, res = handle_command("LPUSH", [BulkString(3, "Foo"), 1, 2, 3], store)
     rv = parse_data(parse_crlf(res))
@@ -346,6 +436,13 @@ def test_hset_with_prev(store: Redis):
     assert store._get("foo:bar:baz") == {"foo": "bar", "hello": "world", "baz": "boo"}
 
 
+def test_hmset(store: Redis):
+    cmd_type, res = handle_command("HMSET", ["foo", "a", "1", "b", "2"], store)
+    assert cmd_type == CommandType.Hmset
+    assert parse_data(parse_crlf(res)) == "OK"
+    assert store.hmget("foo", ["a", "b"]) == ["1", "2"]
+
+
 def test_hget(store: Redis):
     store.hset("foo:bar:baz", ["foo", "bar", "baz", "boo"])
     cmd_type, res = handle_command("HGET", ["foo:bar:baz", "foo"], store)
@@ -392,6 +489,60 @@ def test_sinter(store: Redis):
     }, '"bar" is only common'
 
 
+def test_sinter_missing_key(store: Redis):
+    store.sadd("foo:bar", ["foo:1", "bar"])
+    _, res = handle_command("SINTER", ["foo:bar", "missing"], store)
+    rv = parse_data(parse_crlf(res))
+    assert rv == []
+    assert "missing" not in store.store, "reads must not create keys"
+
+
+@pytest.mark.parametrize(
+    "cmd,args,expected",
+    [
+        ("SUNION", ["a", "b", "missing"], {"1", "2", "3", "4"}),
+        ("SDIFF", ["a", "b"], {"1"}),
+        ("SDIFF", ["a", "missing"], {"1", "2", "3"}),
+        ("SDIFF", ["missing", "a"], set()),
+    ],
+)
+def test_set_algebra(store: Redis, cmd, args, expected):
+    store.sadd("a", ["1", "2", "3"])
+    store.sadd("b", ["2", "3", "4"])
+    cmd_type, res = handle_command(cmd, args, store)
+    rv = parse_data(parse_crlf(res))
+    assert cmd_type == cmd
+    assert set(rv) == expected
+
+
+@pytest.mark.parametrize(
+    "cmd,expected",
+    [
+        ("SINTERSTORE", {"2", "3"}),
+        ("SUNIONSTORE", {"1", "2", "3", "4"}),
+        ("SDIFFSTORE", {"1"}),
+    ],
+)
+def test_set_algebra_store(store: Redis, cmd, expected):
+    store.sadd("a", ["1", "2", "3"])
+    store.sadd("b", ["2", "3", "4"])
+    cmd_type, res = handle_command(cmd, ["dest", "a", "b"], store)
+    rv = parse_data(parse_crlf(res))
+    assert cmd_type == cmd
+    assert rv == len(expected)
+    assert store._get("dest") == expected
+
+
+@pytest.mark.parametrize("args,expected", [([], 2), (["LIMIT", "1"], 1)])
+def test_sintercard(store: Redis, args, expected):
+    store.sadd("a", ["1", "2", "3"])
+    store.sadd("b", ["2", "3", "4"])
+    cmd_type, res = handle_command("SINTERCARD", ["2", "a", "b", *args], store)
+    rv = parse_data(parse_crlf(res))
+    assert cmd_type == CommandType.Sintercard
+    assert rv == expected
+
+
 def test_sismember(store: Redis):
     store.sadd("foo:bar", ["foo:1", "bar"])
     cmd_type, res = handle_command("SISMEMBER", ["foo:bar", "foo:1"], store)
@@ -420,6 +571,79 @@ def test_smembers(store: Redis):
     assert set(rv) == {"foo:1", "bar"}, '"foo:1", "bar" are the elements'
 
 
+def test_setbit_getbit(store: Redis):
+    cmd_type, res = handle_command("SETBIT", ["foo:bits", "7", "1"], store)
+    rv = parse_data(parse_crlf(res))
+    assert cmd_type == CommandType.Setbit
+    assert rv == 0, "bit was previously unset"
+    assert store._get("foo:bits") == bytearray(b"\x01")
+    cmd_type, res = handle_command("GETBIT", ["foo:bits", "7"], store)
+    assert cmd_type == CommandType.Getbit
+    assert parse_data(parse_crlf(res)) == 1
+    cmd_type, res = handle_command("GETBIT", ["foo:bits", "100"], store)
+    assert parse_data(parse_crlf(res)) == 0, "bits past the end read as 0"
+
+
+def test_get_bitmap(store: Redis, aof_file: Path):
+    session = Session()
+    run(store, session, "SET", "text", "é")
+    assert run(store, session, "SETBIT", "text", "7", "1") == 1
+    assert run(store, session, "GET", "text") == "é", "promoted and read as utf-8"
+    run(store, session, "SETBIT", "bits", "0", "1")
+    _, res = get_response(serialize_data(["GET", "bits"]), store, session)
+    assert res.encode("utf-8", "surrogateescape") == b"$1\r\n\x80\r\n"
+
+
+def test_setbit_wrong_type(store: Redis):
+    store.lpush("foo", ["bar"])
+    _, res = handle_command("SETBIT", ["foo", "1", "1"], store)
+    rv = parse_data(parse_crlf(res))
+    assert isinstance(rv, Error)
+
+
+@pytest.mark.parametrize(
+    "args,expected",
+    [([], 26), (["0", "0"], 4), (["1", "1"], 6), (["5", "30", "BIT"], 17)],
+)
+def test_bitcount(store: Redis, args, expected):
+    store.set("foo", "foobar")
+    cmd_type, res = handle_command("BITCOUNT", ["foo", *args], store)
+    rv = parse_data(parse_crlf(res))
+    assert cmd_type == CommandType.Bitcount
+    assert rv == expected
+
+
+@pytest.mark.parametrize(
+    "op,keys,expected",
+    [
+        ("AND", ["a", "b"], b"\x00\x02\x00"),
+        ("OR", ["a", "b"], b"\xff\x0f\x00"),
+        ("XOR", ["a", "b"], b"\xff\x0d\x00"),
+        ("NOT", ["a"], b"\x00\xf8"),
+    ],
+)
+def test_bitop(store: Redis, op, keys, expected):
+    store.set("a", bytearray(b"\xff\x07"))
+    store.set("b", bytearray(b"\x00\x0a\x00"))
+    cmd_type, res = handle_command("BITOP", [op, "dest", *keys], store)
+    rv = parse_data(parse_crlf(res))
+    assert cmd_type == CommandType.Bitop
+    assert rv == len(expected)
+    assert store._get("dest") == bytearray(expected)
+
+
+@pytest.mark.parametrize(
+    "args,expected",
+    [(["0"], 12), (["1"], 0), (["1", "2"], -1), (["0", "0", "0"], -1)],
+)
+def test_bitpos(store: Redis, args, expected):
+    store.set("foo", bytearray(b"\xff\xf0\x00"))
+    cmd_type, res = handle_command("BITPOS", ["foo", *args], store)
+    rv = parse_data(parse_crlf(res))
+    assert cmd_type == CommandType.Bitpos
+    assert rv == expected
+
+
 def test_xadd(store: Redis):
     cmd_type, res = handle_command("XADD", ["stream_key", "0-1", "foo", "bar"], store)
     rv = parse_data(parse_crlf(res))
@@ -460,3 +684,871 @@ def test_exp_rdb():
     assert store.get("blueberry") == "apple"
     assert store.get("orange") == "strawberry"
     assert set(store.store.keys()) == {"pineapple", "blueberry", "orange"}
+
+
+def test_rdb_roundtrip(store: Redis):
+    store.set("str", "pineapple")
+    store.set("num", "-70000")
+    store.set("ttl", "grape", 60 * 10**6)
+    store.rpush("list", ["a", "1", "b"])
+    store.sadd("ints", ["3", "1", "2"])
+    store.sadd("strs", ["x", "y"])
+    store.hset("hash", ["f", "v", "n", "300"])
+    store.setbit("bits", 7, 1)
+    store.setbit("bits", 8, 1)
+    buf = io.BytesIO()
+    RdbWriter(store).dump(buf)
+    buf.seek(0)
+    loaded = RdbParser("unused.rdb").load(buf)
+    assert loaded.store == store.store
+    assert loaded._ts.keys() == {"ttl"}
+    assert abs(loaded._ts["ttl"] - store._ts["ttl"]).total_seconds() < 0.001
+    assert loaded.object_encoding("ints") == "intset"
+    assert buf.read() == b""
+
+
+def test_rdb_dbs(store: Redis):
+    store.set("Foo", "0")
+    store.dbs[3].store["Foo"] = "three"
+    buf = io.BytesIO()
+    RdbWriter(store).dump(buf)
+    buf.seek(0)
+    loaded = RdbParser("unused.rdb").load(buf)
+    assert [db.store for db in loaded.dbs[:4]] == [{"Foo": 0}, {}, {}, {"Foo": "three"}]
+    assert loaded.db == 0
+
+
+@pytest.mark.parametrize("preamble", ["yes", "no"])
+def test_aof_rewrite(store: Redis, aof_file: Path, preamble):
+    store.handle_config("SET", "aof-use-rdb-preamble", preamble)
+    try:
+        run(store, None, "SET", "Foo", "1")
+        run(store, None, "INCR", "Foo")
+        run(store, None, "RPUSH", "list", "a", "b")
+        run(store, None, "XADD", "stream", "1-1", "f", "v")
+        run(store, None, "XGROUP", "CREATE", "stream", "g", "0")
+        assert run(store, None, "BGREWRITEAOF") == "OK"
+        assert aof_file.read_bytes().startswith(b"REDIS") == (preamble == "yes")
+        run(store, None, "INCR", "Foo")
+        run(store, None, "RPUSH", "list", "c")
+
+        restored = Redis()
+        recover(restored)
+        assert restored.store["Foo"] == 3
+        assert list(restored.store["list"]) == ["a", "b", "c"]
+        stream = restored.store["stream"]
+        assert [id_ for id_, _ in stream.range()] == ["1-1"]
+        assert stream.groups.keys() == {"g"}
+    finally:
+        Redis.config.pop("aof-use-rdb-preamble")
+
+
+def test_aof_rewrite_commands(store: Redis, aof_file: Path):
+    store.handle_config("SET", "aof-use-rdb-preamble", "no")
+    try:
+        run(store, None, "RPUSH", "list", "a", "b")
+        run(store, None, "SETBIT", "bits", "0", "1")
+        run(store, None, "SETBIT", "bits", "9", "1")
+        later = int(time.time() * 1000) + 60_000
+        for key in ("list", "bits"):
+            assert run(store, None, "PEXPIREAT", key, str(later)) == 1
+        assert run(store, None, "PEXPIREAT", "missing", str(later)) == 0
+        assert store.rewrite_commands("bits")[0] == ["SET", "bits", "\udc80@"]
+        run(store, None, "BGREWRITEAOF")
+        assert aof_file.read_bytes().count(b"SETBIT") == 0
+
+        restored = Redis()
+        recover(restored)
+        assert list(restored.store["list"]) == ["a", "b"]
+        assert restored.getbit("bits", 9) == 1
+        for key in ("list", "bits"):
+            assert restored._ts[key] == store._ts[key], "the ttl survives"
+
+        run(store, None, "PEXPIREAT", "list", "1")
+        assert store.get("list") is None
+    finally:
+        Redis.config.pop("aof-use-rdb-preamble")
+
+
+@pytest.mark.parametrize("preamble", ["yes", "no"])
+def test_aof_rewrite_stream_groups(store: Redis, aof_file: Path, preamble):
+    store.handle_config("SET", "aof-use-rdb-preamble", preamble)
+    try:
+        for id_ in ("1-1", "2-1"):
+            run(store, None, "XADD", "s", id_, "f", "v")
+        run(store, None, "XGROUP", "CREATE", "s", "g", "0")
+        args = ["GROUP", "g", "c1", "COUNT", "1", "STREAMS", "s", ">"]
+        run(store, None, "XREADGROUP", *args)
+        run(store, None, "XREADGROUP", *args)
+        run(store, None, "XACK", "s", "g", "2-1")
+        run(store, None, "XADD", "s", "3-1", "f", "v")
+        run(store, None, "XTRIM", "s", "MAXLEN", "0")
+        assert store.xpending("s", "g") == [1, "1-1", "1-1", [["c1", "1"]]]
+        run(store, None, "BGREWRITEAOF")
+
+        restored = Redis()
+        recover(restored)
+        assert restored.xpending("s", "g") == [1, "1-1", "1-1", [["c1", "1"]]]
+        pel = store.store["s"].groups["g"].pel.entries
+        assert restored.store["s"].groups["g"].pel.entries == pel, "time and count"
+        assert restored.xlen("s") == 0
+        assert isinstance(run(restored, None, "XADD", "s", "3-1", "f", "v"), Error)
+    finally:
+        Redis.config.pop("aof-use-rdb-preamble")
+
+
+def test_aof_auto_rewrite(store: Redis, aof_file: Path):
+    store.handle_config("SET", "auto-aof-rewrite-min-size", "200")
+    try:
+        for _ in range(20):
+            run(store, None, "INCR", "Foo")
+        # every rewrite shrinks the log back down to a single snapshot
+        assert aof_file.stat().st_size < 200
+        restored = Redis()
+        recover(restored)
+        assert restored.store["Foo"] == 20
+    finally:
+        Redis.config.pop("auto-aof-rewrite-min-size")
+
+
+def test_xreadgroup(store: Redis):
+    cmd_type, res = handle_command(
+        "XGROUP", ["CREATE", "stream_key", "grp", "$", "MKSTREAM"], store
+    )
+    assert cmd_type == CommandType.Xgroup
+    assert parse_data(parse_crlf(res)) == "OK"
+    handle_command("XADD", ["stream_key", "9-1", "foo", "bar"], store)
+    handle_command("XADD", ["stream_key", "10-1", "bar", "baz"], store)
+    args = ["GROUP", "grp", "alice", "COUNT", "1", "STREAMS", "stream_key", ">"]
+    cmd_type, res = handle_command("XREADGROUP", args, store)
+    rv = parse_data(parse_crlf(res))
+    assert cmd_type == CommandType.Xreadgroup
+    assert rv == [["stream_key", [["9-1", ["foo", "bar"]]]]]
+    _, res = handle_command("XREADGROUP", args, store)
+    rv = parse_data(parse_crlf(res))
+    assert rv == [["stream_key", [["10-1", ["bar", "baz"]]]]], "ids sort numerically"
+    args = ["GROUP", "grp", "alice", "STREAMS", "stream_key", "0"]
+    _, res = handle_command("XREADGROUP", args, store)
+    rv = parse_data(parse_crlf(res))
+    assert [key for key, _ in rv[0][1]] == ["9-1", "10-1"], "pending history"
+
+
+def test_xreadgroup_block(store: Redis, aof_file: Path):
+    aof_file.write_text("")
+    session = Session()
+    run(store, session, "XGROUP", "CREATE", "stream_key", "grp", "$", "MKSTREAM")
+    xadd = ("XADD", "stream_key", "1-0", "foo", "bar")
+    timer = threading.Timer(0.15, run, (store, Session(), *xadd))
+    timer.start()
+    args = ["GROUP", "grp", "alice", "BLOCK", "0", "STREAMS", "stream_key", ">"]
+    rv = run(store, session, "XREADGROUP", *args)
+    assert rv == [["stream_key", [["1-0", ["foo", "bar"]]]]]
+    timer.join()
+    assert b"BLOCK" not in aof_file.read_bytes()
+
+    restored = Redis()
+    began = time.monotonic()
+    recover(restored)
+    assert time.monotonic() - began < 1, "replay must not wait for new entries"
+    assert restored.xpending("stream_key", "grp")[0] == 1
+
+
+def test_xack_xpending(store: Redis):
+    store.xgroup("CREATE", "stream_key", "grp", "0", "MKSTREAM")
+    for i in range(1, 4):
+        store.xadd("stream_key", f"{i}-0", "foo", "bar")
+    store.xreadgroup("grp", "alice", None, None, False, "stream_key", ">")
+    cmd_type, res = handle_command("XACK", ["stream_key", "grp", "2-0", "9-0"], store)
+    assert cmd_type == CommandType.Xack
+    assert parse_data(parse_crlf(res)) == 1
+    cmd_type, res = handle_command("XPENDING", ["stream_key", "grp"], store)
+    rv = parse_data(parse_crlf(res))
+    assert cmd_type == CommandType.Xpending
+    assert rv == [2, "1-0", "3-0", [["alice", "2"]]]
+    _, res = handle_command("XPENDING", ["stream_key", "grp", "-", "+", "1"], store)
+    rv = parse_data(parse_crlf(res))
+    assert [[key, consumer, count] for key, consumer, _, count in rv] == [
+        ["1-0", "alice", 1]
+    ]
+
+
+def test_pending_entries():
+    rng = random.Random(7)
+    pel, ids = PendingEntries(), set()
+    for _ in range(2000):
+        id_ = (rng.randrange(300), rng.randrange(3))
+        if rng.random() < 0.6:
+            pel.add(id_, ["alice", 0, 1])
+            ids.add(id_)
+        else:
+            assert (pel.remove(id_) is not None) == (id_ in ids)
+            ids.discard(id_)
+    want = sorted(ids)
+    assert list(pel) == want and len(pel) == len(want)
+    assert (pel.first(), pel.last()) == (want[0], want[-1])
+    got = [id_ for id_, _ in pel.range(want[10], want[20], start_xlsv=True)]
+    assert got == want[11:21]
+    for id_, _ in pel.range():
+        pel.remove(id_)
+    assert not pel and pel.first() is pel.last() is None
+
+
+def test_stream_range_count(store: Redis):
+    for i in range(1, 6):
+        store.xadd("stream_key", f"{i}-0", "foo", "bar")
+    trie: Trie = store.store["stream_key"]
+    assert [key for key, _ in trie.range(count=2)] == ["1-0", "2-0"]
+    got = store.xread(3, None, "stream_key", "1-0")
+    assert [key for key, _ in got[0][1]] == ["2-0", "3-0", "4-0"]
+
+
+def test_xclaim(store: Redis):
+    store.xgroup("CREATE", "stream_key", "grp", "0", "MKSTREAM")
+    store.xadd("stream_key", "1-0", "foo", "bar")
+    store.xreadgroup("grp", "alice", None, None, False, "stream_key", ">")
+    cmd_type, res = handle_command(
+        "XCLAIM", ["stream_key", "grp", "bob", "0", "1-0"], store
+    )
+    rv = parse_data(parse_crlf(res))
+    assert cmd_type == CommandType.Xclaim
+    assert rv == [["1-0", ["foo", "bar"]]]
+    rv = store.xpending("stream_key", "grp", "-", "+", 10)
+    assert [[key, consumer, count] for key, consumer, _, count in rv] == [
+        ["1-0", "bob", 2]
+    ]
+    assert store.xpending("stream_key", "grp", "-", "+", 10, "alice") == []
+
+
+@pytest.mark.parametrize(
+    "args,removed,first",
+    [
+        (["MAXLEN", "120"], 130, "131-0"),
+        (["MAXLEN", "~", "120"], 100, "101-0"),
+        (["MAXLEN", "~", "120", "LIMIT", "50"], 0, "1-0"),
+        (["MINID", "200"], 199, "200-0"),
+        (["MINID", "~", "200"], 100, "101-0"),
+        (["MAXLEN", "500"], 0, "1-0"),
+    ],
+)
+def test_xtrim(store: Redis, args, removed, first):
+    for i in range(1, 251):
+        store.xadd("stream_key", f"{i}-0", "foo", "bar")
+    cmd_type, res = handle_command("XTRIM", ["stream_key", *args], store)
+    rv = parse_data(parse_crlf(res))
+    assert cmd_type == CommandType.Xtrim
+    assert rv == removed
+    assert store.xlen("stream_key") == 250 - removed
+    assert store.xrange("stream_key", "-", "+")[0][0] == first
+
+
+def test_xadd_maxlen(store: Redis):
+    for i in range(1, 6):
+        handle_command("XADD", ["stream_key", "MAXLEN", "2", f"{i}-0", "a", "b"], store)
+    cmd_type, res = handle_command("XLEN", ["stream_key"], store)
+    assert cmd_type == CommandType.Xlen
+    assert parse_data(parse_crlf(res)) == 2
+    assert [key for key, _ in store.xrange("stream_key", "-", "+")] == ["4-0", "5-0"]
+    assert store.store["stream_key"].search("1-0") is None
+
+
+@pytest.mark.parametrize(
+    "members,expected",
+    [
+        (["1", "2", "3"], "intset"),
+        (["1", "foo"], "listpack"),
+        (["01"], "listpack"),
+        ([str(i) for i in range(600)], "hashtable"),
+    ],
+)
+def test_set_encoding(store: Redis, members, expected):
+    store.sadd("foo", members)
+    cmd_type, res = handle_command("OBJECT", ["ENCODING", "foo"], store)
+    assert cmd_type == CommandType.Object
+    assert parse_data(parse_crlf(res)) == expected
+    assert set(store.smembers("foo")) == set(members)
+    assert store.sismember("foo", members[-1]) == 1
+
+
+def test_set_encoding_full(store: Redis, monkeypatch):
+    monkeypatch.setitem(Redis.config, "set-max-listpack-entries", 3)
+    store.sadd("foo", ["m0", "m1", "m2"])
+    store.sadd("foo", ["m0", "m1"])
+    assert store.object_encoding("foo") == "listpack", "existing members are no growth"
+    store.sadd("foo", ["m3"])
+    assert store.object_encoding("foo") == "hashtable"
+    assert store.scard("foo") == 4
+
+
+def test_hash_encoding(store: Redis, monkeypatch):
+    monkeypatch.setitem(Redis.config, "hash-max-listpack-entries", 2)
+    store.hset("foo", ["a", "1", "b", "2"])
+    assert store.object_encoding("foo") == "listpack"
+    store.hset("foo", ["a", "0", "a", "1"])
+    assert store.object_encoding("foo") == "listpack", "existing fields are no growth"
+    store.hset("foo", ["c", "3"])
+    assert store.object_encoding("foo") == "hashtable"
+    assert store._get("foo") == {"a": "1", "b": "2", "c": "3"}
+
+
+def test_list_encoding(store: Redis, monkeypatch):
+    monkeypatch.setitem(Redis.config, "list-max-listpack-size", 4)
+    store.rpush("foo", [1, 2, 3])
+    assert store.object_encoding("foo") == "listpack"
+    store.lpush("foo", [0, -1])
+    assert store.object_encoding("foo") == "quicklist"
+    assert store.lrange("foo", 0, -1) == [-1, 0, 1, 2, 3]
+    assert store.lrange("foo", -2, -1) == [2, 3]
+
+
+def run(store: Redis, session: Session, *cmd):
+    _, res = get_response(serialize_data(list(cmd)), store, session)
+    return parse_data(parse_crlf(res))
+
+
+def test_multi_exec(store: Redis, aof_file: Path):
+    session = Session()
+    assert run(store, session, "MULTI") == "OK"
+    assert run(store, session, "SET", "Foo", "1") == "QUEUED"
+    assert run(store, session, "INCR", "Foo") == "QUEUED"
+    assert store.get("Foo") is None, "nothing runs before EXEC"
+    assert run(store, session, "EXEC") == ["OK", 2]
+    assert store.get("Foo") == "2"
+    content = aof_file.read_bytes().decode()
+    end = frame_resp(content.encode())
+    assert parse_data(parse_crlf(content[:end]))[0] == "SET"
+    assert parse_data(parse_crlf(content[end:]))[0] == "INCR"
+
+
+def test_multi_blocking_read(store: Redis, aof_file: Path):
+    session = Session()
+    store.xgroup("CREATE", "stream_key", "grp", "$", "MKSTREAM")
+    run(store, session, "MULTI")
+    args = ["GROUP", "grp", "alice", "BLOCK", "0", "STREAMS", "stream_key", ">"]
+    assert run(store, session, "XREADGROUP", *args) == "QUEUED"
+    xread = ["BLOCK", "0", "STREAMS", "stream_key", "0"]
+    assert run(store, session, "XREAD", *xread) == "QUEUED"
+    assert run(store, session, "EXEC") == [None, None], "BLOCK is ignored in MULTI"
+
+
+def test_multi_discard(store: Redis, aof_file: Path):
+    session = Session()
+    run(store, session, "MULTI")
+    run(store, session, "SET", "Foo", "1")
+    assert run(store, session, "DISCARD") == "OK"
+    assert store.get("Foo") is None
+    assert isinstance(run(store, session, "EXEC"), Error)
+
+
+def test_watch(store: Redis, aof_file: Path):
+    session, other = Session(), Session()
+    run(store, session, "SET", "Foo", "1")
+    assert run(store, session, "WATCH", "Foo") == "OK"
+    run(store, session, "MULTI")
+    run(store, session, "INCR", "Foo")
+    run(store, other, "SET", "Foo", "10")
+    assert run(store, session, "EXEC") is None, "aborted since Foo changed"
+    assert store.get("Foo") == "10"
+    run(store, session, "WATCH", "Foo")
+    run(store, session, "MULTI")
+    run(store, session, "INCR", "Foo")
+    assert run(store, session, "EXEC") == [11]
+
+
+def test_select(store: Redis, aof_file: Path):
+    session, other = Session(), Session()
+    run(store, session, "SET", "Foo", "0")
+    assert run(store, session, "SELECT", "1") == "OK"
+    assert run(store, session, "GET", "Foo") is None
+    run(store, session, "SET", "Foo", "1")
+    assert run(store, other, "GET", "Foo") == "0", "other clients stay on db 0"
+    assert run(store, session, "DBSIZE") == 1
+    assert isinstance(run(store, session, "SELECT", "16"), Error)
+
+    restored = Redis()
+    recover(restored)
+    assert restored.dbs[0].store == {"Foo": 0}
+    assert restored.dbs[1].store == {"Foo": 1}
+    assert restored.db == 0
+
+
+def test_swapdb(store: Redis, aof_file: Path):
+    session, other = Session(), Session()
+    run(store, session, "SET", "Foo", "live")
+    run(store, other, "SELECT", "9")
+    run(store, other, "SET", "Foo", "staged")
+    run(store, session, "WATCH", "Foo")
+    staged = store.dbs[9]
+    assert run(store, other, "SWAPDB", "0", "9") == "OK"
+    assert store.dbs[0] is staged, "swapped by reference"
+    assert run(store, session, "GET", "Foo") == "staged"
+    assert run(store, other, "GET", "Foo") == "live"
+    run(store, session, "MULTI")
+    run(store, session, "GET", "Foo")
+    assert run(store, session, "EXEC") is None, "the swap touched the watched key"
+    assert run(store, other, "FLUSHDB") == "OK"
+    assert run(store, other, "DBSIZE") == 0
+    assert run(store, session, "DBSIZE") == 1
+
+
+def test_multi_swapdb_flushdb(store: Redis, aof_file: Path):
+    aof_file.write_text("")
+    session, tracked = Session(), Session()
+    pushes = []
+    tracked.writer = pushes.append
+    run(store, tracked, "HELLO", "3")
+    run(store, tracked, "CLIENT", "TRACKING", "ON")
+    run(store, session, "SET", "a", "1")
+    run(store, session, "SELECT", "1")
+    run(store, session, "SET", "b", "1")
+    run(store, tracked, "GET", "a")
+    for cmd in (["MULTI"], ["SWAPDB", "0", "1"], ["FLUSHDB"], ["EXEC"]):
+        run(store, session, *cmd)
+    assert store.dbs[0].store == {"b": 1} and store.dbs[1].store == {}
+    assert [parse_data(parse_crlf(x)) for x in pushes] == [
+        Push(["invalidate", None]),
+    ], "tracking is one shot, the flush has nothing left to invalidate"
+
+    restored = Redis()
+    recover(restored)
+    assert restored.dbs[0].store == {"b": 1}
+    assert restored.dbs[1].store == {}
+
+
+def test_move(store: Redis):
+    session = Session()
+    run(store, session, "SET", "Foo", "1", "px", "10000")
+    run(store, session, "SET", "Bar", "1")
+    assert run(store, session, "MOVE", "Foo", "2") == 1
+    assert run(store, session, "MOVE", "Foo", "2") == 0
+    assert "Foo" in store.dbs[2].ts
+    run(store, session, "SELECT", "2")
+    assert run(store, session, "GET", "Foo") == "1"
+    run(store, session, "SET", "Bar", "2")
+    assert run(store, session, "MOVE", "Bar", "0") == 0, "target already has Bar"
+    assert isinstance(run(store, session, "MOVE", "Bar", "2"), Error)
+
+
+rate_limit_script = """
+current = call("GET", KEYS[0])
+if current is None or int(current) < int(ARGV[0]):
+    return call("INCR", KEYS[0])
+return False
+"""
+
+
+def test_eval(store: Redis):
+    got = []
+    for _ in range(3):
+        cmd_type, res = handle_command(
+            "EVAL", [rate_limit_script, "1", "Foo", "2"], store
+        )
+        got.append(parse_data(parse_crlf(res)))
+    assert cmd_type == CommandType.Eval
+    assert got == [1, 2, None]
+
+
+def test_eval_persisted(store: Redis, aof_file: Path):
+    aof_file.write_text("")
+    session = Session()
+    for _ in range(3):
+        run(store, session, "EVAL", rate_limit_script, "1", "Foo", "3")
+    sha = run(store, session, "SCRIPT", "LOAD", rate_limit_script)
+    run(store, session, "EVALSHA", sha, "1", "Foo", "5")
+    assert store.get("Foo") == "4"
+
+    restored = Redis()
+    recover(restored)
+    assert restored.get("Foo") == "4", "the scripts' writes and the EVALSHA replay"
+    assert b"EVALSHA" not in aof_file.read_bytes()
+
+
+def test_evalsha(store: Redis):
+    _, res = handle_command("SCRIPT", ["LOAD", "return [ARGV[0], 2.5, True]"], store)
+    sha = parse_data(parse_crlf(res))
+    cmd_type, res = handle_command("EVALSHA", [sha, "0", "Foo"], store)
+    assert cmd_type == CommandType.Evalsha
+    assert parse_data(parse_crlf(res)) == ["Foo", 2, 1]
+    _, res = handle_command("EVALSHA", ["0" * 40, "0"], store)
+    assert isinstance(parse_data(parse_crlf(res)), Error)
+
+
+@pytest.mark.parametrize(
+    "script",
+    [
+        "import os",
+        "return ().__class__",
+        "return open('redis.aof')",
+        "return 'a'.upper()",
+        "g = (g.gi_frame.f_back for x in [0]); return list(g)[0]",
+        "return [x for x in ARGV]",
+        "f = lambda: 1\nreturn f()",
+        "def f():\n    return 1\nreturn f()",
+        "class A:\n    pass",
+        "f = len\nreturn f(ARGV)",
+        "return sorted(ARGV, key=call)",
+        "return eval('1')",
+        "x, *y = ARGV",
+        "for x in range(2):\n    break\nelse:\n    return 1\nbreak",
+        "while True:\n    pass",
+        "return 2 ** 2 ** 40",
+        "return 1 << 10 ** 9",
+        "x = 3\nwhile True:\n    x = x * x",
+        "s = 'ab'\nwhile True:\n    s += s",
+        "return len(list(range(10 ** 12)))",
+        "return f'{1:999999999}'",
+    ],
+)
+def test_eval_restricted(store: Redis, script):
+    _, res = handle_command("EVAL", [script, "0"], store)
+    assert isinstance(parse_data(parse_crlf(res)), Error)
+
+
+def test_eval_locks_everything():
+    # call may touch keys outside KEYS, so a script holds every stripe
+    assert lock_keys("EVAL", ["return 1", "1", "Foo"]) is None
+    assert lock_keys("EVALSHA", ["0" * 40, "0"]) is None
+
+
+def test_eval_language(store: Redis):
+    script = """
+total, seen = 0, {}
+for i, key in enumerate(KEYS):
+    if key in seen:
+        continue
+    seen[key] = i
+    n = 0
+    while n < int(ARGV[0]):
+        n += 1
+        if n > 2:
+            break
+    total += n * (i + 1)
+return [total, f"{len(seen):03d}", sorted(seen, reverse=True)[::-1], -total // 2]
+"""
+    _, res = handle_command("EVAL", [script, "3", "a", "b", "a", "5"], store)
+    assert parse_data(parse_crlf(res)) == [9, "002", ["a", "b"], -5]
+
+
+def test_eval_multiline(store: Redis, aof_file: Path):
+    aof_file.write_text("")
+    script = "n = call('INCR', KEYS[0])\nif n > 1:\r\n    return n\nreturn 0"
+    data = serialize_data([BulkString(len(x), x) for x in ("EVAL", script, "1", "Foo")])
+    assert frame_resp(data.encode()) == len(data)
+    assert get_response(data, store)[1] == ":0\r\n"
+    assert get_response(data, store)[1] == ":2\r\n"
+
+    restored = Redis()
+    recover(restored)
+    assert restored.get("Foo") == "2"
+
+
+def test_eval_call_error(store: Redis):
+    store.lpush("Foo", ["bar"])
+    _, res = handle_command("EVAL", ["return call('INCR', 'Foo')", "0"], store)
+    assert isinstance(parse_data(parse_crlf(res)), Error)
+    _, res = handle_command("EVAL", ["return pcall('INCR', 'Foo')", "0"], store)
+    assert isinstance(parse_data(parse_crlf(res)), Error)
+
+
+def test_hello(store: Redis):
+    session = Session()
+    rv = run(store, session, "HELLO", "3")
+    assert rv["proto"] == 3
+    assert session.protocol == 3
+    assert isinstance(run(store, session, "HELLO", "4"), Error)
+
+
+def test_ser_push():
+    data = Push(["invalidate", ["Foo"]])
+    got = serialize_data(data)
+    assert got == ">2\r\n+invalidate\r\n*1\r\n+Foo\r\n"
+    assert isinstance(parse_data(parse_crlf(got)), Push)
+
+
+def test_client_tracking(store: Redis, aof_file: Path):
+    server, client = socket.socketpair()
+    client.settimeout(1)
+    session, other = Session(server), Session()
+    assert isinstance(run(store, session, "CLIENT", "TRACKING", "ON"), Error)
+    run(store, session, "HELLO", "3")
+    assert run(store, session, "CLIENT", "TRACKING", "ON") == "OK"
+    run(store, other, "SET", "Foo", "1")
+    run(store, session, "GET", "Foo")
+    run(store, other, "SET", "Foo", "2")
+    rv = parse_data(parse_crlf(client.recv(1024).decode("utf-8")))
+    assert rv == Push(["invalidate", ["Foo"]])
+    assert "Foo" not in store.tracking, "tracking is one shot until read again"
+    server.close()
+    client.close()
+
+
+def test_client_tracking_unlocked(store: Redis, aof_file: Path):
+    def stripes_free():
+        return all(
+            lock.acquire(timeout=0.5) and not lock.release() for lock in store.locks
+        )
+
+    freed = []
+    session = Session()
+    # checked from another thread, the writer's own RLocks would always succeed
+    session.writer = lambda _: freed.append(run_in_thread(stripes_free))
+    run(store, session, "HELLO", "3")
+    run(store, session, "CLIENT", "TRACKING", "ON")
+    run(store, session, "GET", "Foo")
+    run(store, Session(), "MSET", "Foo", "1", "Bar", "2")
+    assert freed == [True], "pushed after the writer let go of its stripes"
+
+
+def run_in_thread(func):
+    rv = []
+    t = threading.Thread(target=lambda: rv.append(func()))
+    t.start()
+    t.join()
+    return rv[0]
+
+
+def test_client_tracking_bcast(store: Redis, aof_file: Path):
+    server, client = socket.socketpair()
+    client.settimeout(1)
+    session, other = Session(server), Session()
+    run(store, session, "HELLO", "3")
+    run(store, session, "CLIENT", "TRACKING", "ON", "BCAST", "PREFIX", "user:")
+    run(store, other, "MSET", "post:1", "a", "user:1", "b")
+    rv = parse_data(parse_crlf(client.recv(1024).decode("utf-8")))
+    assert rv == Push(["invalidate", ["user:1"]])
+    store.untrack(session)
+    assert not store.bcast
+    server.close()
+    client.close()
+
+
+@pytest.mark.parametrize(
+    "data,expected",
+    [
+        (b"+OK\r\n", 5),
+        (b"$5\r\nhel", -1),
+        (b"$5\r\nhello\r\n:1\r\n", 11),
+        (b"*2\r\n$3\r\nGET\r\n$3\r\nFoo\r\n*1\r\n", 22),
+        (b"*2\r\n$3\r\nGET\r\n", -1),
+        (b"%1\r\n+a\r\n:1\r\n", 12),
+        (b"*-1\r\n", 5),
+    ],
+)
+def test_frame_resp(data, expected):
+    assert frame_resp(data) == expected
+
+
+def test_io_threads(store: Redis, aof_file: Path):
+    jobs: Queue = Queue()
+    io = IOThread(jobs)
+    io.start()
+    threading.Thread(target=execute_jobs, args=(store, jobs), daemon=True).start()
+    server, client = socket.socketpair()
+    client.settimeout(1)
+    io.add(server)
+    pipelined = serialize_data(["SET", "Foo", "1"]) + serialize_data(["INCR", "Foo"])
+    data = (pipelined + serialize_data(["GET", "Foo"])).encode("utf-8")
+    # split mid command, the io thread has to wait for the rest of the frame
+    client.sendall(data[:-4])
+    client.sendall(data[-4:])
+    expected = b"+OK\r\n:2\r\n$1\r\n2\r\n"
+    got = b""
+    while len(got) < len(expected):
+        got += client.recv(1024)
+    assert got == expected
+    # sizes are utf-8 byte counts on the way in and out
+    client.sendall(encode_command(("SET", "Name", "héllo")))
+    client.sendall(encode_command(("GET", "Name")))
+    expected = "+OK\r\n$6\r\nhéllo\r\n".encode("utf-8")
+    got = b""
+    while len(got) < len(expected):
+        got += client.recv(1024)
+    assert got == expected
+    client.close()
+
+
+def test_io_threads_blocking_order(store: Redis, aof_file: Path):
+    jobs: Queue = Queue()
+    io = IOThread(jobs)
+    io.start()
+    threading.Thread(target=execute_jobs, args=(store, jobs), daemon=True).start()
+    store.xgroup("CREATE", "stream_key", "grp", "$", "MKSTREAM")
+    server, client = socket.socketpair()
+    client.settimeout(2)
+    io.add(server)
+    args = ("GROUP", "grp", "alice", "BLOCK", "300", "STREAMS", "stream_key", ">")
+    client.sendall(encode_command(("XREADGROUP", *args)) + encode_command(("PING",)))
+    # the PING waits for the blocked read instead of overtaking it
+    expected = b"$-1\r\n+PONG\r\n"
+    got = b""
+    while len(got) < len(expected):
+        got += client.recv(1024)
+    assert got == expected
+    client.close()
+
+
+@pytest.mark.parametrize(
+    "spec,expected",
+    [
+        ("set,get", {"set": 1, "get": 1}),
+        ("SET:3,incr:7,", {"set": 3, "incr": 7}),
+    ],
+)
+def test_parse_mix(spec, expected):
+    assert parse_mix(spec) == expected
+
+
+def test_percentile():
+    vals = [float(x) for x in range(1, 1001)]
+    assert percentile(vals, 0.5) == 500
+    assert percentile(vals, 0.99) == 990
+    assert percentile(vals, 0.999) == 999
+    assert percentile([], 0.5) == 0.0
+
+
+def test_bench(aof_file: Path):
+    with socket.socket() as probe:
+        probe.bind(("localhost", 0))
+        port = probe.getsockname()[1]
+    threading.Thread(
+        target=serve, args=("localhost", port, Redis()), daemon=True
+    ).start()
+    for _ in range(50):
+        try:
+            socket.create_connection(("localhost", port)).close()
+            break
+        except ConnectionRefusedError:
+            threading.Event().wait(0.02)
+
+    report = run_bench(port=port, clients=3, requests=200, pipeline=8, keyspace=10)
+    assert report["requests"] == 200
+    assert report["errors"] == 0
+    assert report["ops_per_sec"] > 0
+    assert set(report["commands"]) == {"set", "get", "incr", "lpush", "xadd"}
+    assert sum(cmd["ops"] for cmd in report["commands"].values()) == 200
+    latency = report["latency_ms"]
+    assert latency["p50"] <= latency["p99"] <= latency["p999"] <= latency["max"]
+    assert report["connection_errors"] == []
+
+
+def test_bench_refused():
+    with socket.socket() as probe:
+        probe.bind(("localhost", 0))
+        port = probe.getsockname()[1]
+
+    report = run_bench(port=port, clients=2, requests=10)
+    assert report["requests"] == 0
+    assert len(report["connection_errors"]) == 2
+    assert "ConnectionRefusedError" in report["connection_errors"][0]
+
+
+def test_count_min_sketch():
+    sketch = CountMinSketch(width=64, depth=4)
+    counts = {f"key:{i}": i % 7 + 1 for i in range(200)}
+    for key, n in counts.items():
+        sketch.add(key, n)
+    # collisions may only inflate the estimate
+    assert all(sketch.estimate(key) >= n for key, n in counts.items())
+    sketch.halve()
+    assert sketch.estimate("key:6") >= counts["key:6"] // 2
+
+
+def test_hotkeys():
+    hot = HotKeys(k=4, decay=1 << 30)
+    for i in range(2000):
+        hot.record([f"cold:{i}", "hot", "warm" if i % 2 else f"cold:{i}"])
+    top = hot.most_common(2)
+    assert [key for key, _ in top] == ["hot", "warm"]
+    assert top[0][1] >= 2000
+    assert len(hot.top) == 4
+
+    hot._age()
+    assert hot.most_common(1)[0] == ("hot", top[0][1] >> 1)
+
+
+def test_hotkeys_threads():
+    hot = HotKeys(k=4, decay=1 << 30)
+
+    def worker(n):
+        for i in range(2000):
+            hot.record([f"cold:{n}:{i}", "hot", f"warm:{n}"])
+            hot.most_common(4)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert hot.accesses == 4 * 2000 * 3, "no increment is lost"
+    assert len(hot.top) == 4
+    assert hot.most_common(1)[0][0] == "hot"
+    assert {key for _, key in hot.heap} >= set(hot.top)
+
+
+def test_hotkeys_command(store: Redis):
+    for _ in range(5):
+        handle_command("INCR", ["Foo"], store)
+    handle_command("GET", ["Bar"], store)
+    _, res = handle_command("HOTKEYS", ["COUNT", "1"], store)
+    assert parse_data(parse_crlf(res)) == ["Foo", 5]
+    # parse_crlf can not read bulk strings holding CRLF, check the raw reply
+    _, res = handle_command("INFO", ["hotkeys"], store)
+    size, _, info = res.partition("\r\n")
+    assert size == f"${len(info) - 2}"
+    assert info.startswith("# Hotkeys\r\n")
+    assert "\r\nhotkey_0:key=Foo,count=5\r\n" in info
+    _, res = handle_command("INFO", [], store)
+    assert "\r\ndb0:keys=1,expires=0\r\n" in res
+
+
+def test_sharded_dict():
+    d = ShardedDict(4)
+    for i in range(20):
+        d[f"k{i}"] = i
+    del d["k0"]
+    assert d.pop("k1") == 1
+    assert d.pop("missing", None) is None
+    assert len(d) == 18
+    assert d == {f"k{i}": i for i in range(2, 20)}
+    assert sum(map(len, d.shards)) == 18
+    assert d.get("k2") == 2 and "k3" in d
+    d.clear()
+    assert not d
+
+
+def test_lock_stripes(store: Redis):
+    a = "Foo"
+    b = next(k for k in map(str, range(100)) if hash(k) % 16 != hash(a) % 16)
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with store.locked([a]):
+            held.set()
+            release.wait(5)
+
+    t = threading.Thread(target=hold)
+    t.start()
+    held.wait(5)
+    # a different stripe is free while Foo's is held
+    with store.locked([b]):
+        pass
+    assert not store.locks[hash(a) % 16].acquire(timeout=0.05)
+    release.set()
+    t.join()
+
+
+def test_concurrent_incr(store: Redis, aof_file: Path):
+    keys = ["Foo", "Bar", "Baz"]
+
+    def work(session):
+        for i in range(200):
+            get_response(serialize_data(["INCR", keys[i % 3]]), store, session)
+            get_response(serialize_data(["RPUSH", "list", "x"]), store, session)
+
+    threads = [threading.Thread(target=work, args=(Session(),)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert [store.get(k) for k in keys] == ["536", "536", "528"]
+    assert store.llen("list") == 1600
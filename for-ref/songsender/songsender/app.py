@@ -1,7 +1,7 @@
 import json
-import re
 from concurrent.futures import ProcessPoolExecutor
 from functools import partial
+from pathlib import Path
 from uuid import uuid4
 
 from litehttp import (
@@ -11,9 +11,10 @@ from litehttp import (
     HTTP_404,
     Loop,
     Request,
+    Router,
     Server,
-    file_response,
     json_response,
+    static_response,
     text_response,
 )
 from redis import Redis
@@ -61,22 +62,6 @@ def search_post(req: Request, store: Redis):
     return text_response(text=resp, status=HTTP_200)
 
 
-def handle_search(req: Request, store: Redis):
-    match req.method:
-        case "GET":
-            return search_get(req, store)
-        case "POST":
-            return search_post(req, store)
-        case _:
-            return text_response(
-                "GET, POST are the only methods defined", status=HTTP_404
-            )
-
-
-def search_path_match(path: str) -> bool:
-    return re.search(r"/search$", path) is not None
-
-
 def download_post(req: Request, store: Redis):
     url: str
     try:
@@ -93,7 +78,9 @@ def download_post(req: Request, store: Redis):
     with download_from_urls([url]) as files:
         logger.debug(f"{files=}")
         if files:
-            return file_response(file_path=files[0], f_type="binary")
+            # opened before the temp dir goes away, sent with sendfile after
+            file = Path(files[0])
+            return static_response(req, file.name, root=file.parent, download=True)
 
     return text_response(status=HTTP_204)
 
@@ -103,62 +90,40 @@ def download_post(req: Request, store: Redis):
     #     future.add_done_callback(lambda x: store.set(uid, x.result()))
 
 
-def handle_download(req: Request, store: Redis):
-    match req.method:
-        case "POST":
-            return download_post(req, store)
-        case _:
-            return text_response("POST is the only method defined", status=HTTP_404)
-
-
-def download_path_match(path: str) -> bool:
-    return re.search(r"/download$", path) is not None
-
-
-def handle_result(req: Request, store: Redis):
-    def get():
-        logger.debug(f"Processing result get {req=} ...")
-        try:
-            uid = req.query["uid"]
-        except Exception as e:
-            logger.exception(
-                f"Invalid query parameters in {req=}. Failed with error: {e}"
-            )
-            return text_response(status=HTTP_400)
-
-        logger.debug(f"Got query {uid=} ...")
-        res = store.get(uid)
-        if not res:
-            return text_response(
-                "The result is either not yet available or has already been consumed",
-                status=HTTP_404,
-            )
+def result_get(req: Request, store: Redis):
+    logger.debug(f"Processing result get {req=} ...")
+    try:
+        uid = req.query["uid"]
+    except Exception as e:
+        logger.exception(f"Invalid query parameters in {req=}. Failed with error: {e}")
+        return text_response(status=HTTP_400)
 
-        store.set(uid, "")
-        return text_response(text=str(res), status=HTTP_200)
+    logger.debug(f"Got query {uid=} ...")
+    res = store.get(uid)
+    if not res:
+        return text_response(
+            "The result is either not yet available or has already been consumed",
+            status=HTTP_404,
+        )
 
-    match req.method:
-        case "GET":
-            return get()
-        case _:
-            return text_response("POST is the only method defined", status=HTTP_404)
+    store.set(uid, "")
+    return text_response(text=str(res), status=HTTP_200)
 
 
-def result_path_match(path: str) -> bool:
-    return re.search(r"/result$", path) is not None
+def make_router(store: Redis) -> Router:
+    router = Router()
+    router.add("GET", "/", handle_root)
+    router.add("GET", "/search", partial(search_get, store=store))
+    router.add("POST", "/search", partial(search_post, store=store))
+    router.add("POST", "/download", partial(download_post, store=store))
+    router.add("GET", "/result", partial(result_get, store=store))
+    return router
 
 
 def run(args):
     host, port = args.host, args.port
     store = Redis(host=args.redis_host, port=6379)
-    handlers = [
-        (lambda x: x == "/", handle_root),
-        (search_path_match, partial(handle_search, store=store)),
-        (download_path_match, partial(handle_download, store=store)),
-        (result_path_match, partial(handle_result, store=store)),
-    ]
-
     logger.info(f"Trying to start server with {host}:{port}...")
-    server = Server(loop=Loop(), handlers=handlers)
+    server = Server(loop=Loop(), handlers=make_router(store))
     server.run(host=host, port=port)
     return 0
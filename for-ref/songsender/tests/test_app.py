@@ -1,28 +1,29 @@
 import pytest
-from songsender.app import search_path_match, Request, handle_root, text_response
-from songsender.utils import fetch_url_from_name, download_from_urls
+
+from songsender.app import Request, handle_root, make_router, text_response
+from songsender.utils import download_from_urls, fetch_url_from_name
 
 
 @pytest.fixture
 def get_request():
-    data = (
-        "GET /search?name=hey+there+delilah HTTP/1.1\r\n"
-        "Host: localhost:5005\r\n"
-        "User-Agent: curl/7.88.1\r\n"
-        "Accept: */*\r\n"
-    )
-    return Request(data)
+    data = "GET /search?name=hey+there+delilah HTTP/1.1"
+    headers = {
+        "host": "localhost:5005",
+        "user-agent": "curl/7.88.1",
+        "accept": "*/*",
+    }
+    return Request(data, headers)
 
 
 @pytest.fixture
 def get_root_request():
-    data = (
-        "GET / HTTP/1.1\r\n"
-        "Host: localhost:5005\r\n"
-        "User-Agent: curl/7.88.1\r\n"
-        "Accept: */*\r\n"
-    )
-    return Request(data)
+    data = "GET / HTTP/1.1"
+    headers = {
+        "host": "localhost:5005",
+        "user-agent": "curl/7.88.1",
+        "accept": "*/*",
+    }
+    return Request(data, headers)
 
 
 def test_handle_root(get_root_request):
@@ -39,7 +40,7 @@ def test_handle_root(get_root_request):
     ],
 )
 def test_search_path_match(pattern, expected):
-    assert search_path_match(pattern) is expected
+    assert (make_router(None).resolve(pattern) is not None) is expected
 
 
 def test_url():